@@ -0,0 +1,579 @@
+"""
+AyurSutra - Clinic Analytics Reports
+Aditya Mastwal - Progress Tracking, Billing & Inventory Management
+
+Therapist utilization, therapy effectiveness by prakriti type and revenue
+per therapy, computed with NumPy over columnar copies of the session,
+patient, billing and invoice line tables.
+
+Each frame is read in id-keyset batches into a structured array (dates as
+day numbers, statuses as small codes) and kept in process. Triggers bump a
+cache_versions counter per source table; a frame is reloaded in the
+background once its tables' counters moved and it is older than
+refresh_seconds, so requests never wait on a reload after the first load
+and a busy clinic pays for at most one reload per table per interval.
+Report results are memoised by (report, range, frame versions), and every
+report is a handful of masks, bincounts and searchsorted joins over the
+arrays.
+
+Sessions, invoices and invoice lines moved to the archive files are loaded once into their
+own frames (reloaded only when an archive run or restore bumps the 'archive'
+counter) and merged in only for reports whose range starts before the
+archive horizon.
+
+Usage: python analytics.py {utilization,effectiveness,revenue} [--start YYYY-MM-DD]
+                           [--end YYYY-MM-DD] [--database PATH]
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import date, timedelta
+
+import numpy as np
+from flask import current_app
+
+import archive
+from availability import parse_hours
+from database import connect, per_database
+
+LOAD_BATCH_SIZE = 50000
+DEFAULT_DAYS = 90
+
+STATUSES = ('scheduled', 'completed', 'cancelled', 'rescheduled')
+PAYMENT_STATUSES = ('pending', 'paid', 'partially_paid', 'refunded')
+SCHEDULED, COMPLETED = STATUSES.index('scheduled'), STATUSES.index('completed')
+PAID, REFUNDED = PAYMENT_STATUSES.index('paid'), PAYMENT_STATUSES.index('refunded')
+
+# Prakriti type: bit per dominant dosha (ties set several bits)
+DOSHAS = ('vata', 'pitta', 'kapha')
+PRAKRITI_TYPES = {
+    0: 'unassessed', 1: 'vata', 2: 'pitta', 3: 'vata-pitta',
+    4: 'kapha', 5: 'vata-kapha', 6: 'pitta-kapha', 7: 'sama',
+}
+
+# table -> columns whose updates change a frame
+WATCHED_TABLES = {
+    'appointments': 'patient_id, therapist_id, therapy_id, appointment_date, start_time, end_time, status',
+    'progress_notes': 'appointment_id, improvement_scale',
+    'patients': ', '.join(f'{kind}_{dosha}' for kind in ('prakriti', 'vikriti') for dosha in DOSHAS),
+    'billing': 'patient_id, appointment_id, total_amount, discount_amount, final_amount, '
+               'payment_status, created_at',
+}
+
+
+def _version_name(table):
+    return f'analytics_{table}'
+
+
+def _watermark_triggers():
+    statements = [
+        f"INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('{_version_name(table)}', 0)"
+        for table in WATCHED_TABLES
+    ]
+    for table, columns in WATCHED_TABLES.items():
+        bump = f"UPDATE cache_versions SET version = version + 1 WHERE name = '{_version_name(table)}';"
+        for suffix, event in (('insert', 'INSERT'), ('update', f'UPDATE OF {columns}'), ('delete', 'DELETE')):
+            statements.append(f"""CREATE TRIGGER IF NOT EXISTS trg_analytics_{table}_{suffix}
+                AFTER {event} ON {table} BEGIN {bump} END""")
+    return statements
+
+
+TRIGGERS_SQL = _watermark_triggers()
+
+
+def _day(column):
+    """SQL for a DATE/TIMESTAMP column as days since 1970-01-01"""
+    return f"CAST(julianday(substr({column}, 1, 10)) - 2440587.5 AS INTEGER)"
+
+
+def _minutes(column):
+    return f"(CAST(substr({column}, 1, 2) AS INTEGER) * 60 + CAST(substr({column}, 4, 2) AS INTEGER))"
+
+
+def _code(column, values):
+    whens = ' '.join(f"WHEN '{value}' THEN {index}" for index, value in enumerate(values))
+    return f"CASE {column} {whens} ELSE -1 END"
+
+
+SESSION_DTYPE = np.dtype([('id', 'i8'), ('patient_id', 'i8'), ('therapist_id', 'i8'), ('therapy_id', 'i8'),
+                          ('day', 'i4'), ('minutes', 'i4'), ('status', 'i1'), ('score', 'i1')])
+PATIENT_DTYPE = np.dtype([('id', 'i8')] + [(f'{kind}_{dosha}', 'i2') for kind in ('prakriti', 'vikriti')
+                                           for dosha in DOSHAS])
+INVOICE_DTYPE = np.dtype([('id', 'i8'), ('patient_id', 'i8'), ('appointment_id', 'i8'), ('day', 'i4'),
+                          ('total', 'f8'), ('discount', 'f8'), ('final', 'f8'), ('status', 'i1')])
+# invoice_lines, keyed by appointment like the table
+LINE_DTYPE = np.dtype([('id', 'i8'), ('billing_id', 'i8'), ('therapy_id', 'i8'), ('amount', 'f8')])
+
+_SESSIONS_SQL = f"""
+    SELECT a.id, a.patient_id, a.therapist_id, a.therapy_id, {_day('a.appointment_date')},
+           {_minutes('a.end_time')} - {_minutes('a.start_time')},
+           {_code('a.status', STATUSES)}, COALESCE(n.improvement_scale, 0)
+    FROM {{schema}}.appointments a
+    LEFT JOIN {{schema}}.progress_notes n ON n.appointment_id = a.id
+    WHERE a.id > ?
+    ORDER BY a.id
+    LIMIT ?
+"""
+
+_PATIENTS_SQL = f"""
+    SELECT id, {', '.join(f'COALESCE({name}, 0)' for name in PATIENT_DTYPE.names[1:])}
+    FROM patients
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+_INVOICES_SQL = f"""
+    SELECT id, patient_id, COALESCE(appointment_id, 0), {_day('created_at')},
+           total_amount, COALESCE(discount_amount, 0), final_amount, {_code('payment_status', PAYMENT_STATUSES)}
+    FROM {{schema}}.billing
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+_LINES_SQL = """
+    SELECT appointment_id, billing_id, therapy_id, amount
+    FROM {schema}.invoice_lines
+    WHERE appointment_id > ?
+    ORDER BY appointment_id
+    LIMIT ?
+"""
+
+
+def _load_batched(conn, sql, dtype, batch_size=LOAD_BATCH_SIZE):
+    """Read a table into a structured array in id order, one short read per batch"""
+    chunks = []
+    last_id = 0
+    while True:
+        chunk = np.fromiter(conn.execute(sql, (last_id, batch_size)), dtype=dtype)
+        if not len(chunk):
+            break
+        chunks.append(chunk)
+        last_id = int(chunk['id'][-1])
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+
+
+def load_sessions(conn):
+    return _load_batched(conn, _SESSIONS_SQL.format(schema='main'), SESSION_DTYPE)
+
+
+def load_patients(conn):
+    return _load_batched(conn, _PATIENTS_SQL, PATIENT_DTYPE)
+
+
+def load_invoices(conn):
+    return _load_batched(conn, _INVOICES_SQL.format(schema='main'), INVOICE_DTYPE)
+
+
+def load_lines(conn):
+    return _load_batched(conn, _LINES_SQL.format(schema='main'), LINE_DTYPE)
+
+
+def _load_archived(conn, table, sql, dtype):
+    chunks = []
+    for year in archive.years(conn, table):
+        with archive.attached(conn, year) as schema:
+            chunks.append(_load_batched(conn, sql.format(schema=schema), dtype))
+    return _by_id(chunks, dtype)
+
+
+def _by_id(chunks, dtype):
+    chunks = [chunk for chunk in chunks if len(chunk)]
+    if not chunks:
+        return np.empty(0, dtype=dtype)
+    merged = np.concatenate(chunks)
+    return merged[np.argsort(merged['id'], kind='stable')]
+
+
+def load_archived_sessions(conn):
+    return _load_archived(conn, 'appointments', _SESSIONS_SQL, SESSION_DTYPE)
+
+
+def load_archived_invoices(conn):
+    return _load_archived(conn, 'billing', _INVOICES_SQL, INVOICE_DTYPE)
+
+
+def load_archived_lines(conn):
+    return _load_archived(conn, 'invoice_lines', _LINES_SQL, LINE_DTYPE)
+
+
+Therapists = namedtuple('Therapists', 'ids names max_sessions available_minutes')
+Therapies = namedtuple('Therapies', 'ids names')
+
+
+def load_therapists(conn):
+    """Every therapist, active or not - their past sessions still count"""
+    rows = conn.execute("""
+        SELECT t.id, COALESCE(u.full_name, ''), COALESCE(t.max_sessions_per_day, 8), t.available_hours
+        FROM therapists t
+        LEFT JOIN users u ON t.user_id = u.id
+        ORDER BY t.id
+    """).fetchall()
+    return Therapists(np.array([row[0] for row in rows], dtype='i8'), [row[1] for row in rows],
+                      np.array([row[2] for row in rows], dtype='i4'),
+                      np.array([sum(end - start for start, end in parse_hours(row[3])) for row in rows],
+                               dtype='i4'))
+
+
+def load_therapies(conn):
+    rows = conn.execute('SELECT id, therapy_name FROM therapies ORDER BY id').fetchall()
+    return Therapies(np.array([row[0] for row in rows], dtype='i8'), [row[1] for row in rows])
+
+
+# frame name -> (cache_versions names it depends on, loader)
+FRAMES = {
+    'sessions': ((_version_name('appointments'), _version_name('progress_notes')), load_sessions),
+    'patients': ((_version_name('patients'),), load_patients),
+    'invoices': ((_version_name('billing'),), load_invoices),
+    # Lines are only written with their invoice and never updated
+    'lines': ((_version_name('billing'),), load_lines),
+    'therapists': (('therapists',), load_therapists),
+    'therapies': (('therapies',), load_therapies),
+    'archived_sessions': (('archive',), load_archived_sessions),
+    'archived_invoices': (('archive',), load_archived_invoices),
+    'archived_lines': (('archive',), load_archived_lines),
+}
+
+# frame -> its archived counterpart, merged in for ranges before the horizon
+ARCHIVED_FRAMES = {'sessions': 'archived_sessions', 'invoices': 'archived_invoices',
+                   'lines': 'archived_lines'}
+
+
+def _lookup(sorted_ids, ids):
+    """Positions of ids in sorted_ids, and a mask of the ids that were found"""
+    if not len(sorted_ids):
+        return np.zeros(len(ids), dtype='i8'), np.zeros(len(ids), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return positions, sorted_ids[positions] == ids
+
+
+def _ratio(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.zeros(len(numerator)), where=denominator > 0)
+
+
+def therapist_utilization(frames, start, end):
+    """Booked sessions and minutes per therapist against their daily capacity"""
+    sessions, therapists = frames['sessions'], frames['therapists']
+    booked = sessions[(sessions['day'] >= start) & (sessions['day'] <= end)
+                      & ((sessions['status'] == SCHEDULED) | (sessions['status'] == COMPLETED))]
+    index, found = _lookup(therapists.ids, booked['therapist_id'])
+    index, booked = index[found], booked[found]
+    count = len(therapists.ids)
+    days = end - start + 1
+
+    session_counts = np.bincount(index, minlength=count)
+    minutes = np.bincount(index, weights=booked['minutes'], minlength=count)
+    # Sessions per (therapist, day) for active and over-capacity days
+    day_keys, per_day = np.unique(index * days + (booked['day'] - start), return_counts=True)
+    day_owner = day_keys // days
+    active_days = np.bincount(day_owner, minlength=count)
+    overbooked_days = np.bincount(day_owner[per_day > therapists.max_sessions[day_owner]], minlength=count)
+
+    capacity_sessions = therapists.max_sessions.astype('i8') * days
+    capacity_minutes = therapists.available_minutes.astype('i8') * days
+    session_utilization = _ratio(session_counts, capacity_sessions)
+    minute_utilization = _ratio(minutes, capacity_minutes)
+    return [{
+        'therapist_id': int(therapists.ids[i]), 'therapist_name': therapists.names[i],
+        'sessions': int(session_counts[i]), 'booked_minutes': int(minutes[i]),
+        'active_days': int(active_days[i]), 'overbooked_days': int(overbooked_days[i]),
+        'capacity_sessions': int(capacity_sessions[i]), 'capacity_minutes': int(capacity_minutes[i]),
+        'session_utilization': round(float(session_utilization[i]), 4),
+        'minute_utilization': round(float(minute_utilization[i]), 4),
+    } for i in np.argsort(-session_utilization, kind='stable')]
+
+
+def prakriti_types(patients):
+    """PRAKRITI_TYPES code per patient from the dominant prakriti dosha(s)"""
+    scores = np.stack([patients[f'prakriti_{dosha}'] for dosha in DOSHAS], axis=1)
+    top = scores.max(axis=1)
+    dominant = (scores == top[:, None]) @ np.array([1, 2, 4])
+    return np.where(top > 0, dominant, 0)
+
+
+def therapy_effectiveness(frames, start, end):
+    """improvement_scale of completed sessions by therapy and prakriti type"""
+    sessions, patients, therapies = frames['sessions'], frames['patients'], frames['therapies']
+    scored = sessions[(sessions['day'] >= start) & (sessions['day'] <= end)
+                      & (sessions['status'] == COMPLETED) & (sessions['score'] > 0)]
+    therapy_index, found = _lookup(therapies.ids, scored['therapy_id'])
+    patient_index, known = _lookup(patients['id'], scored['patient_id'])
+    keep = found & known
+    therapy_index, patient_index, scores = therapy_index[keep], patient_index[keep], scored['score'][keep]
+
+    types = len(PRAKRITI_TYPES)
+    groups = len(therapies.ids) * types
+    group = therapy_index * types + prakriti_types(patients)[patient_index]
+
+    counts = np.bincount(group, minlength=groups)
+    means = _ratio(np.bincount(group, weights=scores, minlength=groups), counts)
+    variances = _ratio(np.bincount(group, weights=scores.astype('f8') ** 2, minlength=groups), counts) - means ** 2
+    # Scores are 1-10, so a per-group histogram gives exact medians
+    histogram = np.bincount(group * 11 + scores, minlength=groups * 11).reshape(groups, 11)
+    medians = (histogram.cumsum(axis=1) * 2 >= counts[:, None]).argmax(axis=1)
+    responders = histogram[:, 7:].sum(axis=1)
+    # Distinct patients per group: sort (group, patient) keys, count the first of each run
+    keys = np.sort(group * len(patients) + patient_index)
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    patient_counts = np.bincount(keys[first] // max(1, len(patients)), minlength=groups)
+
+    therapy_counts = counts.reshape(-1, types).sum(axis=1)
+    therapy_means = _ratio(np.bincount(therapy_index, weights=scores, minlength=len(therapies.ids)),
+                           therapy_counts)
+    return [{
+        'therapy_id': int(therapies.ids[g // types]), 'therapy_name': therapies.names[g // types],
+        'prakriti_type': PRAKRITI_TYPES[g % types],
+        'sessions': int(counts[g]), 'patients': int(patient_counts[g]),
+        'mean_improvement': round(float(means[g]), 2),
+        'std_improvement': round(float(np.sqrt(max(variances[g], 0.0))), 2),
+        'median_improvement': int(medians[g]),
+        'responder_rate': round(float(responders[g] / counts[g]), 4),
+        'lift_vs_therapy': round(float(means[g] - therapy_means[g // types]), 2),
+    } for g in np.flatnonzero(counts)]
+
+
+def revenue_per_therapy(frames, start, end):
+    """Invoiced and collected amounts per therapy for invoices raised in the range.
+
+    Generated invoices are split over their invoice_lines: each therapy
+    gets its lines' share of the invoice total, applied to the final and
+    discount amounts, and the invoice counts once for every therapy on it.
+    Hand-made invoices have no lines and go by their appointment instead.
+    """
+    sessions, invoices, therapies = frames['sessions'], frames['invoices'], frames['therapies']
+    lines = frames['lines']
+    invoices = invoices[(invoices['day'] >= start) & (invoices['day'] <= end) & (invoices['status'] != REFUNDED)]
+    unattributed = len(therapies.ids)
+    buckets = unattributed + 1
+
+    line_invoice, on_invoice = _lookup(invoices['id'], lines['billing_id'])
+    lines, line_invoice = lines[on_invoice], line_invoice[on_invoice]
+    line_index, found = _lookup(therapies.ids, lines['therapy_id'])
+    line_bucket = np.where(found, line_index, unattributed)
+    share = _ratio(lines['amount'], invoices['total'][line_invoice])
+    itemised = np.zeros(len(invoices), dtype=bool)
+    itemised[line_invoice] = True
+
+    # Invoice -> appointment -> therapy; invoices without one are unattributed
+    unitemised = invoices[~itemised]
+    session_index, linked = _lookup(sessions['id'], unitemised['appointment_id'])
+    invoice_therapy = sessions['therapy_id'][session_index] if len(sessions) else unitemised['appointment_id'] * 0
+    therapy_index, found = _lookup(therapies.ids, invoice_therapy)
+    bucket = np.where(linked & found, therapy_index, unattributed)
+
+    def split(amounts):
+        """Per-bucket sums of a per-invoice amount"""
+        return (np.bincount(bucket, weights=amounts[~itemised], minlength=buckets)
+                + np.bincount(line_bucket, weights=amounts[line_invoice] * share, minlength=buckets))
+
+    # One count per (invoice, therapy) pair, however many sessions it bills
+    pairs = np.unique(line_invoice * buckets + line_bucket)
+    invoice_counts = np.bincount(bucket, minlength=buckets) + np.bincount(pairs % buckets, minlength=buckets)
+    billed = split(invoices['final'])
+    discounts = split(invoices['discount'])
+    collected = split(np.where(invoices['status'] == PAID, invoices['final'], 0.0))
+
+    completed = sessions[(sessions['day'] >= start) & (sessions['day'] <= end) & (sessions['status'] == COMPLETED)]
+    completed_index, found = _lookup(therapies.ids, completed['therapy_id'])
+    session_counts = np.bincount(completed_index[found], minlength=buckets)
+    per_session = _ratio(billed, session_counts)
+
+    names = list(therapies.names) + [None]
+    ids = [int(therapy_id) for therapy_id in therapies.ids] + [None]
+    return [{
+        'therapy_id': ids[b], 'therapy_name': names[b],
+        'invoices': int(invoice_counts[b]), 'billed': round(float(billed[b]), 2),
+        'collected': round(float(collected[b]), 2), 'outstanding': round(float(billed[b] - collected[b]), 2),
+        'discounts': round(float(discounts[b]), 2), 'completed_sessions': int(session_counts[b]),
+        'revenue_per_session': round(float(per_session[b]), 2),
+    } for b in np.argsort(-billed, kind='stable') if invoice_counts[b] or session_counts[b]]
+
+
+# report name -> (frames it reads, function)
+REPORTS = {
+    'utilization': (('sessions', 'therapists'), therapist_utilization),
+    'effectiveness': (('sessions', 'patients', 'therapies'), therapy_effectiveness),
+    'revenue': (('sessions', 'invoices', 'lines', 'therapies'), revenue_per_therapy),
+}
+
+_EPOCH = date(1970, 1, 1)
+
+
+def _database_path(conn):
+    return conn.execute('PRAGMA database_list').fetchone()[2]
+
+
+def to_day(value):
+    """YYYY-MM-DD (or a date) as days since 1970-01-01"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return (value - _EPOCH).days
+
+
+class Analytics:
+    """Columnar frames and memoised reports, shared by a worker's threads"""
+
+    def __init__(self, refresh_seconds=60.0, max_results=256):
+        self.refresh_seconds = refresh_seconds
+        self.max_results = max_results
+        self._lock = threading.RLock()
+        self._frames = {}             # name -> (versions, loaded_at, value)
+        self._results = OrderedDict()
+        self._reloading = set()
+        self._merged = {}             # name -> (versions, value)
+        self._loads = {name: 0 for name in FRAMES}
+        self._hits = self._misses = 0
+
+    def _versions(self, conn):
+        names = sorted({name for dependencies, _ in FRAMES.values() for name in dependencies})
+        placeholders = ', '.join('?' * len(names))
+        return dict(conn.execute(f'SELECT name, version FROM cache_versions WHERE name IN ({placeholders})',
+                                 names).fetchall())
+
+    def frame(self, conn, name, versions=None):
+        """The named frame and the versions it was loaded at.
+
+        Only the first load blocks. Once the frame's tables have changed and
+        it is older than refresh_seconds, the current copy keeps being served
+        while a background thread loads the new one on its own connection.
+        """
+        dependencies, loader = FRAMES[name]
+        versions = self._versions(conn) if versions is None else versions
+        current = tuple(versions.get(dependency, 0) for dependency in dependencies)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._frames.get(name)
+            if entry:
+                if entry[0] != current and now - entry[1] >= self.refresh_seconds and name not in self._reloading:
+                    self._reloading.add(name)
+                    threading.Thread(target=self._reload, args=(_database_path(conn), name, current),
+                                     name=f'analytics-{name}', daemon=True).start()
+                return entry[0], entry[2]
+
+        return current, self._load(conn, name, current)
+
+    def _load(self, conn, name, versions):
+        # Versions were read before the load, so a racing write only makes
+        # the frame look one version old and it is reloaded next interval
+        loaded_at = time.monotonic()
+        value = FRAMES[name][1](conn)
+        with self._lock:
+            self._frames[name] = (versions, loaded_at, value)
+            self._loads[name] += 1
+        return value
+
+    def _reload(self, database, name, versions):
+        try:
+            conn = connect(database)
+            try:
+                self._load(conn, name, versions)
+            finally:
+                conn.close()
+        finally:
+            with self._lock:
+                self._reloading.discard(name)
+
+    def report(self, conn, name, start, end):
+        """Rows of REPORTS[name] for start..end (YYYY-MM-DD, inclusive)"""
+        frame_names, function = REPORTS[name]
+        start_day, end_day = to_day(start), to_day(end)
+        if end_day < start_day:
+            raise ValueError('end must not be before start')
+
+        versions = self._versions(conn)
+        horizon = archive.horizon(conn)
+        with_archive = horizon is not None and start_day < to_day(horizon)
+        frames, watermark = {}, []
+        for frame_name in frame_names:
+            frame_versions, frames[frame_name] = self.frame(conn, frame_name, versions)
+            if with_archive and frame_name in ARCHIVED_FRAMES:
+                archived_versions, archived = self.frame(conn, ARCHIVED_FRAMES[frame_name], versions)
+                frame_versions += archived_versions
+                frames[frame_name] = self._merge(frame_name, frame_versions, frames[frame_name], archived)
+            watermark.append(frame_versions)
+        key = (name, start_day, end_day, tuple(watermark))
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self._hits += 1
+                return self._results[key]
+            self._misses += 1
+
+        rows = function(frames, start_day, end_day)
+        with self._lock:
+            self._results[key] = rows
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        return rows
+
+    def _merge(self, name, versions, live, archived):
+        """live + archived in id order; a row in both (interrupted move) counts once"""
+        with self._lock:
+            entry = self._merged.get(name)
+            if entry and entry[0] == versions:
+                return entry[1]
+        merged = _by_id([archived[~np.isin(archived['id'], live['id'])], live], live.dtype)
+        with self._lock:
+            self._merged[name] = (versions, merged)
+        return merged
+
+    def stats(self):
+        with self._lock:
+            return {
+                'frames': {name: {'rows': len(getattr(entry[2], 'ids', entry[2])),
+                                  'versions': entry[0], 'age_seconds': round(time.monotonic() - entry[1], 1)}
+                           for name, entry in self._frames.items()},
+                'loads': dict(self._loads),
+                'results_cached': len(self._results),
+                'hits': self._hits,
+                'misses': self._misses,
+            }
+
+
+def init_app(app):
+    app.config.setdefault('ANALYTICS_REFRESH_SECONDS', 60.0)
+    app.extensions['analytics'] = {}
+
+
+def get_analytics():
+    return per_database('analytics', lambda: Analytics(
+        refresh_seconds=current_app.config['ANALYTICS_REFRESH_SECONDS']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Clinic analytics reports')
+    parser.add_argument('report', choices=sorted(REPORTS))
+    parser.add_argument('--start', help='first day, YYYY-MM-DD (default: %d days ago)' % DEFAULT_DAYS)
+    parser.add_argument('--end', help='last day, YYYY-MM-DD (default: today)')
+    parser.add_argument('--database', default='ayursutra.db')
+    args = parser.parse_args(argv)
+
+    end = args.end or date.today().isoformat()
+    start = args.start or (date.fromisoformat(end) - timedelta(days=DEFAULT_DAYS)).isoformat()
+    conn = connect(args.database)
+    try:
+        analytics = Analytics()
+        started = time.perf_counter()
+        try:
+            rows = analytics.report(conn, args.report, start, end)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+        elapsed = time.perf_counter() - started
+        print(json.dumps(rows, indent=2, ensure_ascii=False))
+        frames = ', '.join(f"{name}={stat['rows']}" for name, stat in analytics.stats()['frames'].items())
+        print(f"✅ {args.report} {start}..{end}: {len(rows)} rows in {elapsed:.3f}s (frames: {frames})",
+              file=sys.stderr)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
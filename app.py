@@ -8,25 +8,74 @@ Team Members and Responsibilities:
 - Aditya Mastwal (240211335): Progress Tracking, Billing & Inventory Management
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort, Response, stream_with_context, g
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
+import json
+import os
 import sqlite3
+import uuid
+
+from database import init_app as init_db_pool, connect, current_database, get_db, pool_stats
+from migrations import migrate
+from availability import init_app as init_availability, get_availability, insert_appointment
+from course_scheduler import CoursePreferences, book_course, plan_course
+from idgen import init_app as init_idgen, get_id_generator
+from billing_rollup import window_stats as billing_window_stats, revenue_report
+from patient_search import search as search_patients
+from pagination import Keyset, Page, fetch_page, page_size, stream_list
+from cache import init_app as init_cache, get_reference_cache, reference
+from instrumentation import init_app as init_instrumentation, get_metrics, metrics_authorized
+from inventory import apply_stock, consume
+from invoicing import invoice_completed, invoice_lines
+from jobs import enqueue, job_status, queue_stats
+from bulk_io import ENTITIES as BULK_ENTITIES, FORMATS as BULK_FORMATS, detect_format, export_chunks
+from inventory_alerts import active_alerts, is_due as alerts_due, roll_window as roll_alerts_window
+from archive import (attached as attached_archive, horizon as archive_horizon,
+                     invoice_lines as archived_invoice_lines, locate as locate_archived)
+from analytics import REPORTS as ANALYTICS_REPORTS, DEFAULT_DAYS as REPORT_DEFAULT_DAYS, init_app as init_analytics, get_analytics
+from similarity import init_app as init_similarity, get_dosha_index, find_similar
+from calendar_grid import (init_app as init_calendar, get_schedule_cache, parse_range as parse_schedule_range,
+                           schedule_etag, build_grid as build_schedule_grid, capacity as schedule_capacity,
+                           grid_json as schedule_grid_json)
+from events import EventFilter, init_app as init_events, get_broadcaster
+from writer import init_app as init_writer, write, writer_stats
+from branches import (GROUP_REPORTS, HOME as HOME_BRANCH, BranchError, branch_databases, current_branch,
+                      init_app as init_branches, get_directory)
+from conditional import conditional, init_app as init_page_cache, get_page_cache
+from patient_timeline import TIMELINE_COLUMNS, load_summary as load_patient_summary, load_timeline as load_patient_timeline
 
 app = Flask(__name__)
 app.secret_key = 'ayursutra_secret_key_2024'
+app.config['DATABASE'] = 'ayursutra.db'
+app.config['IMPORT_FOLDER'] = 'imports'
+init_db_pool(app)
+init_instrumentation(app)
+init_availability(app)
+init_idgen(app)
+init_cache(app)
+init_analytics(app)
+init_similarity(app)
+init_calendar(app)
+init_page_cache(app)
+init_events(app)
+init_writer(app)
+init_branches(app)
 
 # =============================================================================
 # DATABASE SETUP AND INITIALIZATION
 # Responsibility: Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
 # =============================================================================
 
-def init_database():
+def init_database(database=None):
     """
     Initialize the SQLite database with all required tables
     Aniruddh Negi - Creates comprehensive database schema for the entire system
+
+    Without a database, initializes app.config['DATABASE'] and then every
+    branch database registered in it
     """
-    conn = sqlite3.connect('ayursutra.db')
+    conn = connect(database or app.config['DATABASE'])
     cursor = conn.cursor()
 
     # Users table
@@ -195,16 +244,23 @@ def init_database():
     """)
 
     conn.commit()
+
+    # Indexes and later schema changes are versioned migrations
+    migrate(conn)
+    shards = [] if database else branch_databases(conn, app.config['DATABASE'])
     conn.close()
-    print("✅ Database initialized successfully!")
+    print(f"✅ Database initialized successfully! ({database or app.config['DATABASE']})")
+
+    for shard in shards:
+        init_database(shard)
 
 # =============================================================================
 # USER MANAGEMENT (Aniruddh Negi)
 # =============================================================================
 
-def create_default_admin():
+def create_default_admin(database=None, username='admin'):
     """Create default admin user for initial setup"""
-    conn = sqlite3.connect('ayursutra.db')
+    conn = connect(database or app.config['DATABASE'])
     cursor = conn.cursor()
 
     cursor.execute("SELECT id FROM users WHERE role = 'admin' LIMIT 1")
@@ -216,7 +272,7 @@ def create_default_admin():
     cursor.execute("""
         INSERT INTO users (username, email, password_hash, role, full_name, phone)
         VALUES (?, ?, ?, ?, ?, ?)
-    """, ('admin', 'admin@ayursutra.com', admin_password, 'admin', 'System Administrator', '9999999999'))
+    """, (username, f'{username}@ayursutra.com', admin_password, 'admin', 'System Administrator', '9999999999'))
 
     conn.commit()
     conn.close()
@@ -245,16 +301,26 @@ def login():
         username = request.form['username']
         password = request.form['password']
 
-        conn = sqlite3.connect('ayursutra.db')
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, username, password_hash, role, full_name, email
-            FROM users WHERE username = ? AND is_active = 1
-        """, (username,))
-        user = cursor.fetchone()
-        conn.close()
+        # Users live in their branch's database
+        try:
+            branch = get_directory().branch_for_user(username)
+        except BranchError:
+            branch = None
+        user = None
+        if branch is not None:
+            g.database = branch.database
+            conn = get_db()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, username, password_hash, role, full_name, email
+                FROM users WHERE username = ? AND is_active = 1
+            """, (username,))
+            user = cursor.fetchone()
 
         if user and check_password_hash(user[2], password):
+            session.pop('branch', None)
+            if branch.code != HOME_BRANCH:
+                session['branch'] = branch.code
             session['user_id'] = user[0]
             session['username'] = user[1]
             session['user_role'] = user[3]
@@ -278,6 +344,8 @@ def logout():
 # PATIENT PROFILES (Mohit Yadav)
 # =============================================================================
 
+PATIENTS_KEYSET = Keyset(('created_at', 'id'), positions=(7, 0))
+
 @app.route('/patients')
 def patients_list():
     """List patients with search - Mohit Yadav"""
@@ -285,26 +353,35 @@ def patients_list():
         return redirect(url_for('login'))
 
     search_query = request.args.get('search', '')
-    conn = sqlite3.connect('ayursutra.db')
-    cursor = conn.cursor()
+    cursor = request.args.get('cursor')
+    conn = get_db()
 
     if search_query:
-        cursor.execute("""
-            SELECT id, patient_id, full_name, age, gender, phone, email, created_at
-            FROM patients
-            WHERE full_name LIKE ? OR patient_id LIKE ? OR phone LIKE ?
-            ORDER BY created_at DESC
-        """, (f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'))
+        patients = Page.of(*search_patients(conn, search_query, limit=page_size(), cursor=cursor))
     else:
-        cursor.execute("""
+        patients = fetch_page(conn, """
             SELECT id, patient_id, full_name, age, gender, phone, email, created_at
-            FROM patients ORDER BY created_at DESC
-        """)
+            FROM patients
+            WHERE {keyset}
+            ORDER BY {order_by}
+        """, (), PATIENTS_KEYSET, cursor, page_size())
 
-    patients = cursor.fetchall()
-    conn.close()
+    return stream_list('patients_list.html', patients=patients, search_query=search_query)
+
+@app.route('/api/patients/search')
+def api_patient_search():
+    """Ranked typeahead search over patients - Mohit Yadav"""
+    if 'user_id' not in session:
+        abort(401)
 
-    return render_template('patients_list.html', patients=patients, search_query=search_query)
+    patients, next_cursor = search_patients(get_db(), request.args.get('q', ''),
+                                            limit=request.args.get('limit', 10, type=int),
+                                            cursor=request.args.get('cursor'))
+    return jsonify(next_cursor=next_cursor, results=[
+        {'id': row[0], 'patient_id': row[1], 'full_name': row[2], 'age': row[3],
+         'gender': row[4], 'phone': row[5]}
+        for row in patients
+    ])
 
 @app.route('/add_patient', methods=['GET', 'POST'])
 def add_patient():
@@ -332,12 +409,11 @@ def add_patient():
         vikriti_pitta = int(request.form.get('vikriti_pitta', 0))
         vikriti_kapha = int(request.form.get('vikriti_kapha', 0))
 
-        patient_id = f"AYU{datetime.now().strftime('%Y%m%d')}{phone[-4:]}"
+        patient_id = get_id_generator().next_id('AYU')
 
+        created_by = session['user_id']
         try:
-            conn = sqlite3.connect('ayursutra.db')
-            cursor = conn.cursor()
-            cursor.execute("""
+            write(lambda conn: conn.execute("""
                 INSERT INTO patients (
                     patient_id, full_name, age, gender, phone, email, address,
                     emergency_contact, medical_history, allergies, contraindications,
@@ -347,14 +423,12 @@ def add_patient():
             """, (patient_id, full_name, age, gender, phone, email, address,
                   emergency_contact, medical_history, allergies, contraindications,
                   prakriti_vata, prakriti_pitta, prakriti_kapha,
-                  vikriti_vata, vikriti_pitta, vikriti_kapha, session['user_id']))
-
-            conn.commit()
-            conn.close()
+                  vikriti_vata, vikriti_pitta, vikriti_kapha, created_by)))
+            get_dosha_index().mark_stale()
             flash(f'Patient {full_name} (ID: {patient_id}) added successfully!', 'success')
             return redirect(url_for('patients_list'))
         except sqlite3.IntegrityError:
-            flash('Error adding patient. Phone number might already exist!', 'danger')
+            flash('Error adding patient. Please check the details and try again!', 'danger')
 
     return render_template('add_patient.html')
 
@@ -364,7 +438,7 @@ def patient_profile(patient_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    conn = sqlite3.connect('ayursutra.db')
+    conn = get_db()
     cursor = conn.cursor()
 
     cursor.execute("""
@@ -379,57 +453,130 @@ def patient_profile(patient_id):
         flash('Patient not found!', 'danger')
         return redirect(url_for('patients_list'))
 
-    cursor.execute("""
-        SELECT a.appointment_date, a.start_time, th.therapy_name,
-               a.status, u.full_name as therapist_name
-        FROM appointments a
-        JOIN therapies th ON a.therapy_id = th.id
-        JOIN therapists t ON a.therapist_id = t.id
-        JOIN users u ON t.user_id = u.id
-        WHERE a.patient_id = ?
-        ORDER BY a.appointment_date DESC, a.start_time DESC
-        LIMIT 10
-    """, (patient_id,))
-    recent_appointments = cursor.fetchall()
+    # Course history and progress come from the trigger-maintained
+    # timeline: one primary-key read for the summary, one range read for
+    # the sessions, names from the cached catalogs
+    return render_template('patient_profile.html', patient=patient,
+                           summary=load_patient_summary(conn, patient_id),
+                           timeline=load_patient_timeline(conn, patient_id),
+                           similar=find_similar(conn, get_dosha_index(), patient_id, k=5),
+                           therapies=reference(conn, 'therapies'),
+                           therapists=reference(conn, 'therapists'))
+
+@app.route('/api/patients/<int:patient_id>/similar')
+def api_similar_patients(patient_id):
+    """Patients with a similar dosha profile and their therapy outcomes - Mohit Yadav"""
+    if 'user_id' not in session:
+        abort(401)
+
+    conn = get_db()
+    result = find_similar(conn, get_dosha_index(), patient_id,
+                          k=min(max(request.args.get('k', 10, type=int), 1), 100),
+                          imbalance_weight=max(request.args.get('imbalance_weight', 1.0, type=float), 0.0))
+    if result is None:
+        abort(404)
+
+    neighbours, responses = result
+    return jsonify(
+        neighbours=[dict(neighbour._asdict(), scores=list(neighbour.scores),
+                         therapies={therapy_id: {'sessions': sessions, 'mean_improvement': mean}
+                                    for therapy_id, (sessions, mean) in neighbour.therapies.items()})
+                    for neighbour in neighbours],
+        therapies=[response._asdict() for response in responses],
+        therapy_names=catalog_names(reference(conn, 'therapies'), {response.therapy_id for response in responses}))
+
+def catalog_names(catalog, ids):
+    """{id: name} for the given ids of a reference catalog (None if not listed)"""
+    return {row_id: catalog.get(row_id)[1] if catalog.get(row_id) else None for row_id in ids}
+
+@app.route('/api/patients/<int:patient_id>/timeline')
+def api_patient_timeline(patient_id):
+    """Compact treatment timeline and progress summary - Aditya Mastwal"""
+    if 'user_id' not in session:
+        abort(401)
 
-    conn.close()
+    conn = get_db()
+    summary = load_patient_summary(conn, patient_id)
+    if summary is None:
+        abort(404)
 
-    return render_template('patient_profile.html', patient=patient,
-                           recent_appointments=recent_appointments)
+    # Sessions are positional arrays in TIMELINE_COLUMNS order; names are
+    # sent once per id rather than once per session
+    sessions = load_patient_timeline(conn, patient_id, descending=False)
+    return jsonify(summary=summary, columns=TIMELINE_COLUMNS, sessions=[list(row) for row in sessions],
+                   therapies=catalog_names(reference(conn, 'therapies'),
+                                           {row[3] for row in sessions} | set(summary['therapy_sessions'])),
+                   therapists=catalog_names(reference(conn, 'therapists'), {row[4] for row in sessions}))
 
 # =============================================================================
 # SCHEDULING (Mohit Yadav)
 # =============================================================================
 
 @app.route('/schedule')
+@conditional('appointments', 'patients', references=('therapists', 'therapies'))
 def schedule_view():
-    """Weekly schedule view - Mohit Yadav"""
+    """Schedule for any week, optionally one therapist or therapy - Mohit Yadav"""
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
     today = datetime.now().date()
-    week_start = today - timedelta(days=today.weekday())
-    week_end = week_start + timedelta(days=6)
-
-    conn = sqlite3.connect('ayursutra.db')
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT a.*, p.full_name as patient_name, p.phone as patient_phone,
-               th.therapy_name, u.full_name as therapist_name
-        FROM appointments a
-        JOIN patients p ON a.patient_id = p.id
-        JOIN therapies th ON a.therapy_id = th.id
-        JOIN therapists t ON a.therapist_id = t.id
-        JOIN users u ON t.user_id = u.id
-        WHERE a.appointment_date BETWEEN ? AND ?
-        ORDER BY a.appointment_date, a.start_time
-    """, (week_start, week_end))
-    appointments = cursor.fetchall()
-    conn.close()
+    try:
+        start, days = parse_schedule_range(request.args.get('start') or
+                                           (today - timedelta(days=today.weekday())).isoformat(),
+                                           days=request.args.get('days', 7, type=int))
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('schedule_view'))
+    therapist_id = request.args.get('therapist_id', type=int)
+    therapy_id = request.args.get('therapy_id', type=int)
+
+    conn = get_db()
+    therapists = reference(conn, 'therapists')
+    grid = build_schedule_grid(conn, therapists, start, days, therapist_id, therapy_id)
+    open_slots, booked_slots, sessions = schedule_capacity(grid)
+    return render_template('schedule.html', grid=grid, open_slots=open_slots, booked_slots=booked_slots,
+                           sessions=sessions, therapists=therapists, therapies=reference(conn, 'therapies'),
+                           therapist_id=therapist_id, therapy_id=therapy_id,
+                           dates=[start + timedelta(days=offset) for offset in range(days)],
+                           week_start=start, week_end=start + timedelta(days=days - 1),
+                           previous_start=start - timedelta(days=days), next_start=start + timedelta(days=days))
+
+@app.route('/api/schedule')
+def api_schedule():
+    """Calendar grid JSON with ETag revalidation - Mohit Yadav"""
+    if 'user_id' not in session:
+        abort(401)
 
-    return render_template('schedule.html', appointments=appointments,
-                           week_start=week_start, week_end=week_end)
+    today = datetime.now().date()
+    try:
+        start, days = parse_schedule_range(request.args.get('start', today.isoformat()), request.args.get('end'),
+                                           days=request.args.get('days', 7, type=int))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    therapist_id = request.args.get('therapist_id', type=int)
+    therapy_id = request.args.get('therapy_id', type=int)
+
+    # The ETag needs only the per-day counters; an unchanged range is
+    # answered without reading a single appointment
+    conn = get_db()
+    etag = schedule_etag(conn, start, days, therapist_id, therapy_id, scope=current_database())
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(get_schedule_cache().get(etag, lambda: schedule_grid_json(
+            build_schedule_grid(conn, reference(conn, 'therapists'), start, days, therapist_id, therapy_id))))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def selected_patient(conn):
+    """Patient preselected in a booking form (from ?patient_id= or a rejected
+    submission); all other patients are picked via /api/patients/search"""
+    patient_id = request.form.get('patient_id') or request.args.get('patient_id')
+    if not patient_id or not patient_id.isdigit():
+        return None
+    return conn.execute('SELECT id, patient_id, full_name FROM patients WHERE id = ?',
+                        (int(patient_id),)).fetchone()
 
 @app.route('/book_appointment', methods=['GET', 'POST'])
 def book_appointment():
@@ -437,10 +584,11 @@ def book_appointment():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    conn = sqlite3.connect('ayursutra.db')
-    cursor = conn.cursor()
+    conn = get_db()
 
-    if request.method == 'POST':
+    if request.method == 'POST' and not request.form.get('patient_id', '').isdigit():
+        flash('Please choose a patient from the search results.', 'danger')
+    elif request.method == 'POST':
         patient_id = int(request.form['patient_id'])
         therapist_id = int(request.form['therapist_id'])
         therapy_id = int(request.form['therapy_id'])
@@ -448,75 +596,200 @@ def book_appointment():
         start_time = request.form['start_time']
         notes = request.form.get('notes', '')
 
-        cursor.execute('SELECT duration_minutes FROM therapies WHERE id = ?', (therapy_id,))
-        duration = cursor.fetchone()[0]
+        therapy = reference(conn, 'therapies').get(therapy_id)
+        if therapy is None:
+            abort(400)
+        duration = therapy[2]
 
         start_dt = datetime.strptime(f"{appointment_date} {start_time}", "%Y-%m-%d %H:%M")
         end_dt = start_dt + timedelta(minutes=duration)
         end_time = end_dt.strftime("%H:%M")
 
-        cursor.execute("""
-            SELECT id FROM appointments 
-            WHERE therapist_id = ? AND appointment_date = ? 
-            AND status != 'cancelled'
-            AND (
-                (start_time <= ? AND end_time > ?) OR
-                (start_time < ? AND end_time >= ?) OR
-                (start_time >= ? AND end_time <= ?)
-            )
-        """, (therapist_id, appointment_date, start_time, start_time,
-              end_time, end_time, start_time, end_time))
-        conflict = cursor.fetchone()
-
-        if conflict:
-            flash('Time slot conflict! Please choose a different time.', 'danger')
+        engine = get_availability()
+        is_free, reason = engine.check(conn, therapist_id, appointment_date, start_time, duration)
+
+        if is_free:
+            appointment_code = get_id_generator().next_id('APP')
+            created_by = session['user_id']
+
+            def insert(conn):
+                cursor = conn.cursor()
+                if insert_appointment(cursor, appointment_code, patient_id, therapist_id, therapy_id,
+                                      appointment_date, start_time, end_time, notes, created_by):
+                    return cursor.lastrowid
+                return None
+
+            appointment_row_id = write(insert)
+            if appointment_row_id is not None:
+                engine.book(therapist_id, appointment_date, start_time, end_time, appointment_row_id)
+                flash('Appointment booked successfully!', 'success')
+                return redirect(url_for('schedule_view'))
+            # Another desk took the slot after our cached view was loaded
+            engine.invalidate(appointment_date)
+            reason = 'Time slot conflict'
+
+        suggestions = engine.next_free_slots(conn, therapist_id, appointment_date, duration,
+                                             count=3, not_before=start_time, days=7)
+        free_now = engine.therapists_free_at(conn, appointment_date, start_time, duration)
+        message = f'{reason}! Please choose a different time.'
+        if suggestions:
+            message += ' Next free: ' + ', '.join(f'{slot.date} {slot.start_time}' for slot in suggestions) + '.'
+        if free_now:
+            message += f' Free at {start_time}: ' + ', '.join(info.name for info in free_now[:5]) + '.'
+        flash(message, 'danger')
+
+    therapists = reference(conn, 'therapists')
+    therapies = reference(conn, 'therapies')
+
+    return render_template('book_appointment.html', selected_patient=selected_patient(conn),
+                           therapists=therapists, therapies=therapies)
+
+@app.route('/book_course', methods=['GET', 'POST'])
+def book_course_view():
+    """Book a multi-day Panchakarma course in one submission - Mohit Yadav"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    conn = get_db()
+    plan = None
+
+    if request.method == 'POST' and not request.form.get('patient_id', '').isdigit():
+        flash('Please choose a patient from the search results.', 'danger')
+    elif request.method == 'POST':
+        try:
+            preferences = CoursePreferences(
+                therapist_ids=request.form.getlist('therapist_ids'),
+                earliest=request.form.get('earliest') or '09:00',
+                latest=request.form.get('latest') or None,
+                gap_minutes=request.form.get('gap_minutes') or 15,
+                skip_weekdays=request.form.getlist('skip_weekdays'))
+            plan = plan_course(conn, get_availability(), int(request.form['patient_id']),
+                               [int(t) for t in request.form.getlist('therapy_ids')],
+                               request.form['start_date'], request.form['end_date'], preferences)
+        except KeyError as e:
+            flash(f'Missing field: {e.args[0]}', 'danger')
+        except ValueError as e:
+            flash(str(e), 'danger')
         else:
-            appointment_code = f"APP{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            cursor.execute("""
-                INSERT INTO appointments (
-                    appointment_id, patient_id, therapist_id, therapy_id,
-                    appointment_date, start_time, end_time, notes, created_by
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (appointment_code, patient_id, therapist_id, therapy_id,
-                  appointment_date, start_time, end_time, notes, session['user_id']))
-            conn.commit()
-            flash('Appointment booked successfully!', 'success')
-            conn.close()
-            return redirect(url_for('schedule_view'))
-
-    cursor.execute('SELECT id, patient_id, full_name FROM patients ORDER BY full_name')
-    patients = cursor.fetchall()
+            if plan.ok and book_course(conn, write, get_availability(), plan, session['user_id'],
+                                       get_id_generator(), request.form.get('notes', '')):
+                flash(f'Course {plan.course_code} booked: {len(plan.sessions)} sessions.', 'success')
+                return redirect(url_for('schedule_view'))
+            flash(f'{len(plan.conflicts)} session(s) could not be placed. Nothing was booked.', 'danger')
 
-    cursor.execute("""
-        SELECT t.id, u.full_name, t.specialization
-        FROM therapists t
-        JOIN users u ON t.user_id = u.id
-        WHERE u.is_active = 1
-        ORDER BY u.full_name
-    """)
-    therapists = cursor.fetchall()
+    therapists = reference(conn, 'therapists')
+    therapies = reference(conn, 'therapies')
 
-    cursor.execute('SELECT id, therapy_name, duration_minutes, cost FROM therapies ORDER BY therapy_name')
-    therapies = cursor.fetchall()
+    return render_template('book_course.html', therapists=therapists, therapies=therapies, plan=plan,
+                           selected_patient=selected_patient(conn))
 
-    conn.close()
-    return render_template('book_appointment.html', patients=patients,
-                           therapists=therapists, therapies=therapies)
+@app.route('/api/book_course', methods=['POST'])
+def api_book_course():
+    """Plan (and unless dry_run, book) a course from JSON - Mohit Yadav"""
+    if 'user_id' not in session:
+        abort(401)
+
+    data = request.get_json(silent=True) or {}
+    conn = get_db()
+    engine = get_availability()
+    try:
+        plan = plan_course(conn, engine, int(data['patient_id']),
+                           [int(t) for t in data.get('therapy_ids', [])],
+                           data['start_date'], data['end_date'],
+                           CoursePreferences.from_mapping(data.get('preferences', {})))
+    except (KeyError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+
+    if not plan.ok:
+        return jsonify(plan.as_dict()), 409
+    if data.get('dry_run'):
+        return jsonify(plan.as_dict())
+    if not book_course(conn, write, engine, plan, session['user_id'], get_id_generator(),
+                       data.get('notes', '')):
+        return jsonify(plan.as_dict()), 409
+    return jsonify(plan.as_dict()), 201
+
+@app.route('/cancel_appointment/<int:appointment_id>', methods=['POST'])
+def cancel_appointment(appointment_id):
+    """Cancel a scheduled appointment and free its slot - Mohit Yadav"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT therapist_id, appointment_date FROM appointments WHERE id = ?', (appointment_id,))
+    appointment = cursor.fetchone()
+
+    cancelled = write(lambda conn: conn.execute("""
+        UPDATE appointments SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'scheduled'
+    """, (appointment_id,)).rowcount)
+    if cancelled:
+        get_availability().release(appointment[0], appointment[1], appointment_id)
+        flash('Appointment cancelled.', 'info')
+    else:
+        flash('Only scheduled appointments can be cancelled!', 'danger')
+    return redirect(url_for('schedule_view'))
+
+@app.route('/api/availability/slots')
+def api_free_slots():
+    """Next free slots for a therapist and therapy - Mohit Yadav"""
+    if 'user_id' not in session:
+        abort(401)
+
+    conn = get_db()
+    therapist_id = request.args.get('therapist_id', type=int)
+    therapy_id = request.args.get('therapy_id', type=int)
+    appointment_date = request.args.get('date', datetime.now().date().isoformat())
+    count = min(request.args.get('count', 5, type=int), 50)
+    # Each day searched holds the engine lock, so the search stays short
+    days = min(request.args.get('days', 1, type=int), 60)
+
+    therapy = reference(conn, 'therapies').get(therapy_id)
+    if therapy is None or therapist_id is None:
+        abort(400)
+
+    try:
+        slots = get_availability().next_free_slots(
+            conn, therapist_id, appointment_date, therapy[2], count=count,
+            not_before=request.args.get('after'), days=days)
+    except ValueError:
+        return jsonify(error='date must be YYYY-MM-DD and after HH:MM'), 400
+    return jsonify(slots=[slot._asdict() for slot in slots])
+
+@app.route('/api/availability/therapists')
+def api_free_therapists():
+    """All therapists free for a therapy at a given time - Mohit Yadav"""
+    if 'user_id' not in session:
+        abort(401)
+
+    conn = get_db()
+    therapy_id = request.args.get('therapy_id', type=int)
+    appointment_date = request.args.get('date', '')
+    start_time = request.args.get('time', '')
+
+    row = conn.execute('SELECT duration_minutes FROM therapies WHERE id = ?', (therapy_id,)).fetchone()
+    if row is None or not appointment_date or not start_time:
+        abort(400)
+
+    free = get_availability().therapists_free_at(conn, appointment_date, start_time, row[0])
+    return jsonify(therapists=[{'id': info.id, 'name': info.name, 'specialization': info.specialization}
+                               for info in free])
 
 # =============================================================================
 # PROGRESS TRACKING (Aditya Mastwal)
 # =============================================================================
 
+PROGRESS_KEYSET = Keyset(('a.appointment_date', 'a.start_time', 'a.id'), positions=(4, 5, 0))
+
 @app.route('/progress')
+@conditional('appointments', 'patients', 'progress_notes', references=('therapies',))
 def progress_dashboard():
     """Progress dashboard - Aditya Mastwal"""
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    conn = sqlite3.connect('ayursutra.db')
-    cursor = conn.cursor()
-
-    cursor.execute("""
+    appointments = fetch_page(get_db(), """
         SELECT a.id, a.appointment_id, p.full_name as patient_name,
                th.therapy_name, a.appointment_date, a.start_time,
                CASE WHEN pn.id IS NOT NULL THEN 1 ELSE 0 END as has_progress_note
@@ -524,14 +797,11 @@ def progress_dashboard():
         JOIN patients p ON a.patient_id = p.id
         JOIN therapies th ON a.therapy_id = th.id
         LEFT JOIN progress_notes pn ON a.id = pn.appointment_id
-        WHERE a.status = 'completed' OR a.appointment_date <= date('now')
-        ORDER BY a.appointment_date DESC, a.start_time DESC
-        LIMIT 20
-    """)
-    appointments = cursor.fetchall()
-    conn.close()
+        WHERE (a.status = 'completed' OR a.appointment_date <= date('now')) AND {keyset}
+        ORDER BY {order_by}
+    """, (), PROGRESS_KEYSET, request.args.get('cursor'), page_size(20))
 
-    return render_template('progress_dashboard.html', appointments=appointments)
+    return stream_list('progress_dashboard.html', appointments=appointments)
 
 @app.route('/add_progress_note/<int:appointment_id>', methods=['GET', 'POST'])
 def add_progress_note(appointment_id):
@@ -539,26 +809,42 @@ def add_progress_note(appointment_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    conn = sqlite3.connect('ayursutra.db')
+    conn = get_db()
     cursor = conn.cursor()
 
-    cursor.execute("""
+    appointment_sql = """
         SELECT a.*, p.full_name as patient_name, th.therapy_name,
                u.full_name as therapist_name
-        FROM appointments a
+        FROM {schema}.appointments a
         JOIN patients p ON a.patient_id = p.id
         JOIN therapies th ON a.therapy_id = th.id
         JOIN therapists t ON a.therapist_id = t.id
         JOIN users u ON t.user_id = u.id
         WHERE a.id = ?
-    """, (appointment_id,))
+    """
+    cursor.execute(appointment_sql.format(schema='main'), (appointment_id,))
     appointment = cursor.fetchone()
 
+    # Closed sessions past the archive horizon are shown from their year's file, read-only
+    archived_year = None if appointment else locate_archived(conn, 'appointments', appointment_id)
+    if archived_year is not None:
+        if request.method == 'POST':
+            flash('This session has been archived; its progress note can no longer be changed.', 'warning')
+            return redirect(url_for('progress_dashboard'))
+        with attached_archive(conn, archived_year) as schema:
+            appointment = cursor.execute(appointment_sql.format(schema=schema), (appointment_id,)).fetchone()
+            existing_note = cursor.execute(f'SELECT * FROM {schema}.progress_notes WHERE appointment_id = ?',
+                                           (appointment_id,)).fetchone()
+        return render_template('add_progress_note.html', appointment=appointment, existing_note=existing_note,
+                               archived=True)
+
     if not appointment:
         flash('Appointment not found!', 'danger')
         return redirect(url_for('progress_dashboard'))
 
     if request.method == 'POST':
+        # Leased before the write starts; a first lease needs its own write
+        generator = get_id_generator()
         session_notes = request.form['session_notes']
         patient_response = request.form['patient_response']
         therapist_observations = request.form['therapist_observations']
@@ -567,41 +853,58 @@ def add_progress_note(appointment_id):
         recommendations = request.form['recommendations']
         next_session_notes = request.form.get('next_session_notes', '')
 
-        cursor.execute('SELECT id FROM progress_notes WHERE appointment_id = ?', (appointment_id,))
-        existing = cursor.fetchone()
+        user_id = session['user_id']
+
+        def save_note(conn):
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM progress_notes WHERE appointment_id = ?', (appointment_id,))
+            existing = cursor.fetchone()
+
+            if existing:
+                cursor.execute("""
+                    UPDATE progress_notes SET
+                        session_notes = ?, patient_response = ?, therapist_observations = ?,
+                        improvement_scale = ?, side_effects = ?, recommendations = ?,
+                        next_session_notes = ?, created_by = ?
+                    WHERE appointment_id = ?
+                """, (session_notes, patient_response, therapist_observations,
+                      improvement_scale, side_effects, recommendations,
+                      next_session_notes, user_id, appointment_id))
+            else:
+                cursor.execute("""
+                    INSERT INTO progress_notes (
+                        appointment_id, session_notes, patient_response, therapist_observations,
+                        improvement_scale, side_effects, recommendations, next_session_notes, created_by
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (appointment_id, session_notes, patient_response, therapist_observations,
+                      improvement_scale, side_effects, recommendations, next_session_notes, user_id))
 
-        if existing:
             cursor.execute("""
-                UPDATE progress_notes SET
-                    session_notes = ?, patient_response = ?, therapist_observations = ?,
-                    improvement_scale = ?, side_effects = ?, recommendations = ?,
-                    next_session_notes = ?, created_by = ?
-                WHERE appointment_id = ?
-            """, (session_notes, patient_response, therapist_observations,
-                  improvement_scale, side_effects, recommendations,
-                  next_session_notes, session['user_id'], appointment_id))
+                UPDATE appointments SET status = 'completed', updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status != 'completed'
+            """, (appointment_id,))
+            if not cursor.rowcount:
+                return existing, [], None
+            # Same transaction as the status change, so a session is charged once
+            shortages = consume(conn, [appointment_id], used_by=user_id).shortages
+            return existing, shortages, invoice_completed(conn, generator, [appointment_id], created_by=user_id)
+
+        existing, shortages, invoiced = write(save_note)
+        if existing:
             flash('Progress note updated successfully!', 'success')
         else:
-            cursor.execute("""
-                INSERT INTO progress_notes (
-                    appointment_id, session_notes, patient_response, therapist_observations,
-                    improvement_scale, side_effects, recommendations, next_session_notes, created_by
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (appointment_id, session_notes, patient_response, therapist_observations,
-                  improvement_scale, side_effects, recommendations, next_session_notes, session['user_id']))
             flash('Progress note added successfully!', 'success')
-
-        cursor.execute("""
-            UPDATE appointments SET status = 'completed', updated_at = CURRENT_TIMESTAMP
-            WHERE id = ? AND status != 'completed'
-        """, (appointment_id,))
-        conn.commit()
-        conn.close()
+        if shortages:
+            flash('Not enough stock to record consumables: ' + ', '.join(
+                f'{s.item_name} (need {s.needed} {s.unit}, {s.in_stock} left)' for s in shortages)
+                + '. They will be charged at reconciliation after restocking.', 'warning')
+        if invoiced and invoiced.invoices:
+            flash(f'{invoiced.invoices} invoice(s) raised for {invoiced.sessions} session(s), '
+                  f'₹{invoiced.amount:,.2f}.', 'info')
         return redirect(url_for('progress_dashboard'))
 
     cursor.execute('SELECT * FROM progress_notes WHERE appointment_id = ?', (appointment_id,))
     existing_note = cursor.fetchone()
-    conn.close()
 
     return render_template('add_progress_note.html', appointment=appointment, existing_note=existing_note)
 
@@ -609,71 +912,140 @@ def add_progress_note(appointment_id):
 # BILLING & INVENTORY (Aditya Mastwal)
 # =============================================================================
 
+INVOICES_KEYSET = Keyset(('b.created_at', 'b.id'), positions=(9, 0))
+
 @app.route('/billing')
+@conditional('billing', 'patients')
 def billing_dashboard():
     """Billing dashboard - Aditya Mastwal"""
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    conn = sqlite3.connect('ayursutra.db')
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT b.*, p.full_name as patient_name, p.patient_id
+    conn = get_db()
+    invoices = fetch_page(conn, """
+        SELECT b.id, b.invoice_id, p.full_name as patient_name, p.patient_id,
+               b.total_amount, b.discount_amount, b.final_amount,
+               b.payment_status, b.payment_method, b.created_at
         FROM billing b
         JOIN patients p ON b.patient_id = p.id
-        ORDER BY b.created_at DESC
-        LIMIT 50
-    """)
-    invoices = cursor.fetchall()
+        WHERE {keyset}
+        ORDER BY {order_by}
+    """, (), INVOICES_KEYSET, request.args.get('cursor'), page_size())
 
-    cursor.execute("""
-        SELECT 
-            COUNT(*) as total_invoices,
-            SUM(final_amount) as total_revenue,
-            SUM(CASE WHEN payment_status = 'paid' THEN final_amount ELSE 0 END) as collected_revenue,
-            SUM(CASE WHEN payment_status = 'pending' THEN final_amount ELSE 0 END) as pending_revenue
-        FROM billing
-        WHERE created_at >= date('now', '-30 days')
-    """)
-    stats = cursor.fetchone()
-    conn.close()
+    # 30-day totals come from the trigger-maintained daily rollup
+    stats = billing_window_stats(conn, days=30)
+
+    return stream_list('billing_dashboard.html', invoices=invoices, stats=stats)
+
+@app.route('/billing/generate', methods=['POST'])
+def generate_invoices():
+    """Queue the invoicing catch-up run, or a month-end close - Aditya Mastwal"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    day = request.form.get('through') or datetime.now().date().isoformat()
+    month_end = bool(request.form.get('month_end'))
+    payload = {'through': day, 'close_courses': month_end, 'created_by': session['user_id']}
+    job_id = write(lambda conn: enqueue(conn, 'invoicing.run', payload,
+                                        key=f"invoicing.run:{day}:{'month_end' if month_end else 'ready'}"))
+    flash(f"{'Month-end close' if month_end else 'Invoicing'} through {day} queued (job #{job_id}).", 'success')
+    return redirect(url_for('billing_dashboard'))
+
+@app.route('/api/invoices/<int:billing_id>/lines')
+def api_invoice_lines(billing_id):
+    """Sessions billed on one invoice - Aditya Mastwal"""
+    if 'user_id' not in session:
+        abort(401)
+
+    conn = get_db()
+    columns = ('appointment_id', 'appointment_date', 'therapy_name', 'amount')
+    lines = invoice_lines(conn, billing_id) or archived_invoice_lines(conn, billing_id)
+    return jsonify(lines=[dict(zip(columns, row)) for row in lines])
+
+@app.route('/billing/report')
+def billing_report():
+    """Daily revenue by payment status for a date range - Aditya Mastwal"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    today = datetime.now().date()
+    start_date = request.args.get('start', (today - timedelta(days=30)).isoformat())
+    end_date = request.args.get('end', today.isoformat())
+
+    rows = revenue_report(get_db(), start_date, end_date)
+    return jsonify(start=start_date, end=end_date, days=[
+        {'day': row[0], 'payment_status': row[1], 'invoice_count': row[2],
+         'total_amount': row[3], 'discount_amount': row[4], 'final_amount': row[5]}
+        for row in rows
+    ])
+
+@app.route('/admin/reports')
+def analytics_reports():
+    """Available analytics reports and frame cache state - Aditya Mastwal"""
+    if 'user_id' not in session or session.get('user_role') != 'admin':
+        abort(403)
 
-    return render_template('billing_dashboard.html', invoices=invoices, stats=stats)
+    return jsonify(reports=sorted(ANALYTICS_REPORTS), **get_analytics().stats())
+
+@app.route('/admin/reports/<report>')
+def analytics_report(report):
+    """Therapist utilization, therapy effectiveness and revenue per therapy - Aditya Mastwal"""
+    if 'user_id' not in session or session.get('user_role') != 'admin':
+        abort(403)
+    if report not in ANALYTICS_REPORTS:
+        abort(404)
+
+    today = datetime.now().date()
+    start_date = request.args.get('start', (today - timedelta(days=REPORT_DEFAULT_DAYS)).isoformat())
+    end_date = request.args.get('end', today.isoformat())
+    try:
+        rows = get_analytics().report(get_db(), report, start_date, end_date)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(report=report, start=start_date, end=end_date, rows=rows)
+
+@app.route('/admin/group/<report>')
+def group_report(report):
+    """Billing and inventory totals across every branch - Aditya Mastwal"""
+    if 'user_id' not in session or session.get('user_role') != 'admin' or current_branch() != HOME_BRANCH:
+        abort(403)
+    if report not in GROUP_REPORTS:
+        abort(404)
+
+    today = datetime.now().date()
+    start_date = request.args.get('start', (today - timedelta(days=REPORT_DEFAULT_DAYS)).isoformat())
+    end_date = request.args.get('end', today.isoformat())
+    try:
+        datetime.strptime(start_date, '%Y-%m-%d')
+        datetime.strptime(end_date, '%Y-%m-%d')
+    except ValueError:
+        return jsonify(error='start and end must be YYYY-MM-DD'), 400
+    return jsonify(report=report, start=start_date, end=end_date, **GROUP_REPORTS[report](start_date, end_date))
 
 @app.route('/inventory')
+@conditional('inventory', 'stock_usage', references=('inventory_catalog',))
 def inventory_dashboard():
     """Inventory dashboard - Aditya Mastwal"""
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    conn = sqlite3.connect('ayursutra.db')
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT *, 
-               CASE 
-                   WHEN current_stock <= min_stock_alert THEN 'low' 
-                   WHEN current_stock <= (min_stock_alert * 2) THEN 'medium'
-                   ELSE 'good' 
-               END as stock_status
-        FROM inventory
-        ORDER BY item_type, item_name
-    """)
-    inventory_items = cursor.fetchall()
+    conn = get_db()
+    if alerts_due(conn):
+        # Once a day the first visitor rolls the window (a no-op if another
+        # request or the nightly job got there first)
+        write(roll_alerts_window)
 
-    cursor.execute("""
-        SELECT item_name, current_stock, min_stock_alert, item_type
-        FROM inventory
-        WHERE current_stock <= min_stock_alert
-        ORDER BY current_stock ASC
-    """)
-    low_stock_items = cursor.fetchall()
-    conn.close()
+    # Stock levels are only read for items with an alert; everything else
+    # comes from the cached catalog
+    alerts = active_alerts(conn)
+    alerts_by_item = {}
+    for alert in alerts:
+        alerts_by_item.setdefault(alert[0], []).append(alert)
 
     return render_template('inventory_dashboard.html',
-                           inventory_items=inventory_items,
-                           low_stock_items=low_stock_items)
+                           catalog=reference(conn, 'inventory_catalog').rows,
+                           alerts=alerts,
+                           alerts_by_item=alerts_by_item)
 
 @app.route('/add_inventory_item', methods=['GET', 'POST'])
 def add_inventory_item():
@@ -691,18 +1063,14 @@ def add_inventory_item():
         supplier = request.form.get('supplier', '')
         expiry_date = request.form.get('expiry_date') or None
 
-        conn = sqlite3.connect('ayursutra.db')
-        cursor = conn.cursor()
-        cursor.execute("""
+        write(lambda conn: conn.execute("""
             INSERT INTO inventory (
                 item_name, item_type, current_stock, unit, min_stock_alert,
                 cost_per_unit, supplier, expiry_date
             ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """, (item_name, item_type, current_stock, unit, min_stock_alert,
-              cost_per_unit, supplier, expiry_date))
-
-        conn.commit()
-        conn.close()
+              cost_per_unit, supplier, expiry_date)))
+        get_reference_cache().invalidate('inventory_catalog')
         flash(f'Item {item_name} added to inventory successfully!', 'success')
         return redirect(url_for('inventory_dashboard'))
 
@@ -715,28 +1083,25 @@ def update_stock(item_id):
         return redirect(url_for('login'))
 
     new_stock = int(request.form['new_stock'])
+    used_by = session['user_id']
 
-    conn = sqlite3.connect('ayursutra.db')
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT current_stock FROM inventory WHERE id = ?', (item_id,))
-    current_stock = cursor.fetchone()[0]
+    if write(lambda conn: apply_stock(conn, item_id, new_stock, used_by)) is None:
+        flash('Item not found!', 'danger')
+        return redirect(url_for('inventory_dashboard'))
 
-    cursor.execute("""
-        UPDATE inventory SET current_stock = ?, last_updated = CURRENT_TIMESTAMP
-        WHERE id = ?
-    """, (new_stock, item_id))
+    flash('Stock updated successfully!', 'success')
+    return redirect(url_for('inventory_dashboard'))
 
-    if new_stock < current_stock:
-        quantity_used = current_stock - new_stock
-        cursor.execute("""
-            INSERT INTO stock_usage (inventory_id, quantity_used, used_by)
-            VALUES (?, ?, ?)
-        """, (item_id, quantity_used, session['user_id']))
+@app.route('/inventory/reconcile', methods=['POST'])
+def reconcile_inventory():
+    """Charge pending consumables of a day's completed sessions - Aditya Mastwal"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
 
-    conn.commit()
-    conn.close()
-    flash('Stock updated successfully!', 'success')
+    day = request.form.get('date') or datetime.now().date().isoformat()
+    job_id = write(lambda conn: enqueue(conn, 'inventory.reconcile', {'date': day},
+                                        key=f'inventory.reconcile:{day}'))
+    flash(f'Reconciliation of {day} queued (job #{job_id}); shortages will show as stock alerts.', 'success')
     return redirect(url_for('inventory_dashboard'))
 
 # =============================================================================
@@ -750,46 +1115,192 @@ def setup_default_data():
         flash('Access denied! Admin role required.', 'danger')
         return redirect(url_for('index'))
 
-    conn = sqlite3.connect('ayursutra.db')
-    cursor = conn.cursor()
+    # Repeated clicks while the job is pending return the same job
+    job_id = write(lambda conn: enqueue(conn, 'setup_default_data', priority=10, key='setup_default_data'))
+    flash(f'Default data setup queued (job #{job_id}).', 'success')
+    return redirect(url_for('index'))
 
-    default_therapies = [
-        ('Abhyanga', 'Full body oil massage with warm herbal oils', 90, 2500.00, 1, 200),
-        ('Shirodhara', 'Continuous pouring of oil on forehead', 60, 3000.00, 1, 500),
-        ('Pizhichil', 'Oil bath therapy with warm medicated oils', 75, 4000.00, 1, 1000),
-        ('Udvartana', 'Herbal powder massage for weight reduction', 45, 2000.00, 0, 0),
-        ('Nasya', 'Nasal administration of medicated oils', 30, 1500.00, 1, 50),
-        ('Karna Purana', 'Ear treatment with medicated oils', 20, 1000.00, 1, 30),
-        ('Akshi Tarpana', 'Eye treatment with medicated ghee', 30, 2500.00, 1, 100)
-    ]
-    for therapy in default_therapies:
-        cursor.execute("""
-            INSERT OR IGNORE INTO therapies 
-            (therapy_name, description, duration_minutes, cost, requires_oil, oil_quantity_ml)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, therapy)
-
-    default_inventory = [
-        ('Sesame Oil', 'oil', 5000, 'ml', 1000, 15.00, 'Ayur Supplier', None),
-        ('Coconut Oil', 'oil', 3000, 'ml', 500, 25.00, 'Ayur Supplier', None),
-        ('Mahanarayan Oil', 'oil', 2000, 'ml', 200, 45.00, 'Ayur Supplier', None),
-        ('Triphala Churna', 'medicine', 1000, 'gm', 100, 120.00, 'Herbal Co.', '2025-12-31'),
-        ('Ashwagandha Tablets', 'medicine', 500, 'tablets', 50, 2.00, 'Herbal Co.', '2025-10-31'),
-        ('Cotton Towels', 'consumable', 50, 'pieces', 10, 150.00, 'Textile Supplier', None),
-        ('Disposable Sheets', 'consumable', 200, 'pieces', 20, 25.00, 'Medical Supplier', None)
-    ]
-    for item in default_inventory:
-        cursor.execute("""
-            INSERT OR IGNORE INTO inventory 
-            (item_name, item_type, current_stock, unit, min_stock_alert, 
-             cost_per_unit, supplier, expiry_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, item)
+@app.route('/api/jobs/<int:job_id>')
+def api_job_status(job_id):
+    """Status and result of a background job - Aniruddh Negi"""
+    if 'user_id' not in session:
+        abort(401)
 
-    conn.commit()
-    conn.close()
-    flash('Default data setup completed successfully!', 'success')
-    return redirect(url_for('index'))
+    job = job_status(get_db(), job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+@app.route('/admin/jobs')
+def job_queue_stats():
+    """Background job counts and recent failures - Aniruddh Negi"""
+    if 'user_id' not in session or session.get('user_role') != 'admin':
+        abort(403)
+
+    return jsonify(queue_stats(get_db()))
+
+@app.route('/admin/archive', methods=['GET', 'POST'])
+def archive_status():
+    """Archive horizon, per-year segments and recent runs; POST queues a run - Aniruddh Negi"""
+    if 'user_id' not in session or session.get('user_role') != 'admin':
+        abort(403)
+
+    conn = get_db()
+    if request.method == 'POST':
+        before = request.form.get('before') or None
+        job_id = write(lambda conn: enqueue(conn, 'archive.run', {'before': before},
+                                            key=f'archive.run:{before or "default"}'))
+        return jsonify(job_id=job_id, status_url=url_for('api_job_status', job_id=job_id)), 202
+
+    segments = conn.execute("""
+        SELECT year, table_name, row_count, min_key, max_key, checksum IS NOT NULL, updated_at
+        FROM archive_segments ORDER BY year, table_name
+    """).fetchall()
+    runs = conn.execute("""
+        SELECT id, horizon, started_at, finished_at, moved FROM archive_runs ORDER BY id DESC LIMIT 10
+    """).fetchall()
+    return jsonify(
+        horizon=archive_horizon(conn),
+        segments=[dict(zip(('year', 'table', 'rows', 'min_key', 'max_key', 'sealed', 'updated_at'), row))
+                  for row in segments],
+        runs=[dict(zip(('id', 'horizon', 'started_at', 'finished_at'), run[:4]),
+                   moved=json.loads(run[4]) if run[4] else None) for run in runs])
+
+@app.route('/admin/import/<entity>', methods=['POST'])
+def bulk_import(entity):
+    """Queue an uploaded CSV/NDJSON file for background import - Aniruddh Negi"""
+    if 'user_id' not in session or session.get('user_role') != 'admin':
+        abort(403)
+    if entity not in BULK_ENTITIES:
+        abort(404)
+
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify(error='file is required'), 400
+    fmt = request.form.get('format') or detect_format(upload.filename)
+    if fmt not in BULK_FORMATS:
+        return jsonify(error=f'format must be one of {", ".join(BULK_FORMATS)}'), 400
+
+    os.makedirs(app.config['IMPORT_FOLDER'], exist_ok=True)
+    name = f'{entity}-{uuid.uuid4().hex}.{fmt}'
+    path = os.path.abspath(os.path.join(app.config['IMPORT_FOLDER'], name))
+    upload.save(path)
+    payload = {
+        'entity': entity, 'path': path, 'format': fmt,
+        'key': f'upload:{name}', 'created_by': session['user_id'],
+    }
+    job_id = write(lambda conn: enqueue(conn, 'bulk_io.import', payload, priority=-1))
+    return jsonify(job_id=job_id, status_url=url_for('api_job_status', job_id=job_id)), 202
+
+@app.route('/admin/export/<entity>')
+def bulk_export(entity):
+    """Stream patients, appointments or billing as CSV/NDJSON - Aniruddh Negi"""
+    if 'user_id' not in session or session.get('user_role') != 'admin':
+        abort(403)
+    fmt = request.args.get('format', 'csv')
+    if entity not in BULK_ENTITIES or fmt not in BULK_FORMATS:
+        abort(404)
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_chunks(get_db(), entity, fmt)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={entity}.{fmt}'})
+
+@app.route('/admin/db_pool')
+def db_pool_stats():
+    """Connection pool checkouts, waits and write queue contention - Aniruddh Negi"""
+    if 'user_id' not in session or session.get('user_role') != 'admin':
+        abort(403)
+
+    return jsonify(pools=pool_stats(), writers=writer_stats())
+
+@app.route('/admin/branches')
+def branch_list():
+    """Clinic branches and their database files - Aniruddh Negi"""
+    if 'user_id' not in session or session.get('user_role') != 'admin' or current_branch() != HOME_BRANCH:
+        abort(403)
+
+    return jsonify(branches=[branch._asdict() for branch in get_directory().branches().values()])
+
+@app.route('/admin/cache')
+def reference_cache_stats():
+    """Reference data and rendered page cache hits, misses and versions - Aniruddh Negi"""
+    if 'user_id' not in session or session.get('user_role') != 'admin':
+        abort(403)
+
+    return jsonify(dict(get_reference_cache().stats(), pages=get_page_cache().stats()))
+
+@app.route('/admin/metrics')
+def metrics():
+    """Request latency, query and template metrics in Prometheus text format - Aniruddh Negi"""
+    if not metrics_authorized():
+        abort(403)
+
+    pools = pool_stats()
+    writers = writer_stats()
+    cache_stats = get_reference_cache().stats()['entries']
+    body = get_metrics().prometheus(extra_gauges=[
+        ('ayursutra_db_pool_in_use', 'Pooled connections checked out',
+         {f'database="{pool["database"]}"': pool['in_use'] for pool in pools}),
+        ('ayursutra_db_pool_waits', 'Checkouts that had to wait for a connection',
+         {f'database="{pool["database"]}"': pool['waits'] for pool in pools}),
+        ('ayursutra_write_queue_depth', 'Write units waiting for the writer thread',
+         {f'database="{writer["database"]}"': writer['queued'] for writer in writers}),
+        ('ayursutra_write_batches', 'Group commits by the writer thread',
+         {f'database="{writer["database"]}"': writer['batches'] for writer in writers}),
+        ('ayursutra_write_units', 'Write units committed or rolled back',
+         {f'database="{writer["database"]}"': writer['units'] for writer in writers}),
+        ('ayursutra_write_lock_wait_ms', 'Time spent waiting for the database write lock',
+         {f'database="{writer["database"]}"': writer['lock_wait_ms'] for writer in writers}),
+        ('ayursutra_write_busy_retries', 'Group commits retried after SQLITE_BUSY',
+         {f'database="{writer["database"]}"': writer['busy_retries'] for writer in writers}),
+        ('ayursutra_reference_cache_hits', 'Reference cache hits',
+         {f'cache="{name}"': entry['hits'] for name, entry in cache_stats.items()}),
+        ('ayursutra_reference_cache_misses', 'Reference cache misses',
+         {f'cache="{name}"': entry['misses'] for name, entry in cache_stats.items()}),
+    ])
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/admin/slow_queries')
+def slow_queries():
+    """Most recent slow statements with bound SQL and query plans - Aniruddh Negi"""
+    if not metrics_authorized():
+        abort(403)
+
+    return jsonify(slow_queries=get_metrics().slow_log())
+
+@app.route('/api/events')
+def api_events():
+    """Server-Sent Events for committed appointment and stock changes - Aniruddh Negi"""
+    if 'user_id' not in session:
+        abort(401)
+
+    try:
+        event_filter = EventFilter.from_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_event_id is not None and not last_event_id.isdigit():
+        return jsonify(error='Last-Event-ID must be an event id'), 400
+
+    try:
+        lines = get_broadcaster().stream(event_filter, int(last_event_id) if last_event_id else None,
+                                         max_seconds=app.config['EVENTS_STREAM_SECONDS'])
+    except OverflowError as e:
+        return jsonify(error=str(e)), 503, {'Retry-After': '10'}
+
+    # No stream_with_context: a client holds no pooled connection while it waits
+    response = Response(lines, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/admin/events')
+def event_stats():
+    """Live event clients, buffer and replay counters - Aniruddh Negi"""
+    if 'user_id' not in session or session.get('user_role') != 'admin':
+        abort(403)
+
+    return jsonify(get_broadcaster().stats())
 
 # =============================================================================
 # ERROR HANDLERS (Aniruddh Negi)
@@ -824,5 +1335,6 @@ if __name__ == '__main__':
     print("✅ System initialization completed!")
     print("🌐 http://localhost:5000")
     print("🔑 Login: admin / admin123")
+    print("⚙️  Background jobs: python jobs.py worker")
     print("="*70)
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,552 @@
+"""
+AyurSutra - Hot/Cold Archival
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+Closed records older than the horizon (HORIZON_DAYS, two years by default)
+move out of the live database into one archive file per year, next to it
+in archive/<name>-<year>.db. Closed means:
+
+- billing: paid or refunded; its invoice_lines move with it
+- appointments: no longer scheduled, not waiting to be invoiced and not on
+  any invoice still in the live file; their progress_notes move with them
+- stock_usage: all of it (usage_daily keeps the per-day totals)
+
+patient_timeline, patient_summary and the daily rollups stay in the live
+file. They are the compact history the profile page and the billing
+reports read, so those need no archive at all. Reads that need the archived
+detail rows (an old session's note, an old invoice's lines, analytics over
+a range before the horizon) ATTACH the year's file for that one query.
+
+Rows are copied into the archive first and deleted from the live file in a
+second, short BEGIN IMMEDIATE transaction, and only when the archived copy
+is identical. A crash in between leaves a row in both places, where the
+live copy wins and the next run finishes the move. archive_guard is
+non-empty only inside those transactions, which the rollup, timeline,
+queue and event triggers check (guard_triggers), so moving history does not
+change derived data; the version counters still fire so caches reload.
+
+Usage: python archive.py run [--before YYYY-MM-DD] [--database PATH]
+       python archive.py verify [--year YYYY] [--database PATH]
+       python archive.py restore YEAR [--database PATH]
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from database import connect
+from writer import retry_busy
+
+HORIZON_DAYS = 730
+BATCH_SIZE = 2000
+ARCHIVE_FOLDER = 'archive'
+
+ARCHIVE_TABLES = ('billing', 'invoice_lines', 'appointments', 'progress_notes', 'stock_usage')
+
+# One archived table and the rows that move with it. `year_column` picks the
+# file, `order` (plus id) is the keyset walked along an index, `closed` is
+# evaluated on the live row as t.
+Segment = namedtuple('Segment', 'table year_column order closed children')
+
+SEGMENTS = (
+    Segment('billing', 'created_at', ('created_at',),
+            "t.payment_status IN ('paid', 'refunded')",
+            (('invoice_lines', 'billing_id'),)),
+    # After billing, so sessions of archived invoices are no longer referenced
+    Segment('appointments', 'appointment_date', ('appointment_date', 'start_time'),
+            """t.status != 'scheduled'
+               AND NOT EXISTS (SELECT 1 FROM main.unbilled_sessions u WHERE u.appointment_id = t.id)
+               AND NOT EXISTS (SELECT 1 FROM main.billing b WHERE b.appointment_id = t.id)
+               AND NOT EXISTS (SELECT 1 FROM main.invoice_lines l WHERE l.appointment_id = t.id)""",
+            (('progress_notes', 'appointment_id'),)),
+    Segment('stock_usage', 'usage_date', ('usage_date',), '1', ()),
+)
+
+TABLES_SQL = [
+    """CREATE TABLE IF NOT EXISTS archive_segments (
+           year INTEGER NOT NULL,
+           table_name TEXT NOT NULL,
+           row_count INTEGER NOT NULL DEFAULT 0,
+           min_key INTEGER,
+           max_key INTEGER,
+           checksum TEXT,
+           updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (year, table_name)
+       ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS archive_runs (
+           id INTEGER PRIMARY KEY,
+           horizon DATE NOT NULL,
+           started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           finished_at TIMESTAMP,
+           moved TEXT
+       )""",
+    "CREATE TABLE IF NOT EXISTS archive_guard (active INTEGER PRIMARY KEY)",
+    "CREATE INDEX IF NOT EXISTS idx_stock_usage_date ON stock_usage (usage_date)",
+    "INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('archive', 0)",
+]
+
+# Triggers maintaining derived data that archival must not change
+GUARDED_TRIGGERS = (
+    'trg_timeline_appointment_insert', 'trg_timeline_appointment_delete',
+    'trg_timeline_note_insert', 'trg_timeline_note_delete',
+    'trg_events_appointment_insert', 'trg_events_appointment_delete',
+    'trg_unbilled_appointment_insert', 'trg_unbilled_appointment_delete', 'trg_unbilled_billing_insert',
+    'trg_billing_daily_insert', 'trg_billing_daily_delete',
+    'trg_usage_daily_insert',
+)
+
+# Read paths inside an archive file
+ARCHIVE_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_appointments_patient_date ON appointments (patient_id, appointment_date)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS {schema}.idx_progress_notes_appointment ON progress_notes (appointment_id)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_billing_created ON billing (created_at)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_billing_patient ON billing (patient_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_invoice_lines_billing ON invoice_lines (billing_id)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_stock_usage_inventory_date ON stock_usage (inventory_id, usage_date)',
+]
+
+_GUARD = 'NOT EXISTS (SELECT 1 FROM archive_guard)'
+_TRIGGER_HEAD_RE = re.compile(r'\bON\s+(\w+)\s+(?:FOR EACH ROW\s+)?(?:WHEN\s+(.*?)\s+)?BEGIN\b',
+                              re.IGNORECASE | re.DOTALL)
+_CREATE_TABLE_RE = re.compile(r'^\s*CREATE TABLE\s+(?:IF NOT EXISTS\s+)?\w+', re.IGNORECASE)
+
+
+class ArchiveError(Exception):
+    """An archive file the registry refers to is missing or inconsistent"""
+
+
+Archived = namedtuple('Archived', 'horizon moved')
+
+
+def guard_triggers(conn):
+    """Recreate GUARDED_TRIGGERS with a WHEN clause skipping archive moves"""
+    for name in GUARDED_TRIGGERS:
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                           (name,)).fetchone()
+        if row is None or _GUARD in row[0]:
+            continue
+        match = _TRIGGER_HEAD_RE.search(row[0])
+        condition = f'({match.group(2)}) AND {_GUARD}' if match.group(2) else _GUARD
+        conn.execute(f'DROP TRIGGER {name}')
+        conn.execute(f'{row[0][:match.start()]}ON {match.group(1)} WHEN {condition} BEGIN{row[0][match.end():]}')
+
+
+# =============================================================================
+# ARCHIVE FILES
+# =============================================================================
+
+def _database_path(conn):
+    return conn.execute('PRAGMA database_list').fetchone()[2]
+
+
+def _archive_prefix(database):
+    folder = os.path.join(os.path.dirname(os.path.abspath(database)), ARCHIVE_FOLDER)
+    return os.path.join(folder, os.path.splitext(os.path.basename(database))[0])
+
+
+def archive_path(database, year):
+    """archive/<name>-<year>.db next to the live database file"""
+    return f'{_archive_prefix(database)}-{int(year)}.db'
+
+
+def _columns(conn, table, schema='main'):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})')]
+
+
+def _primary_key(conn, table):
+    return next(row[1] for row in conn.execute(f'PRAGMA main.table_info({table})') if row[5] == 1)
+
+
+def _ensure_schema(conn, schema):
+    """Archive tables as declared in the live file, plus any columns added since"""
+    for table in ARCHIVE_TABLES:
+        sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                           (table,)).fetchone()[0]
+        conn.execute(_CREATE_TABLE_RE.sub(f'CREATE TABLE IF NOT EXISTS {schema}.{table}', sql, count=1))
+        archived = set(_columns(conn, table, schema))
+        for row in conn.execute(f'PRAGMA main.table_info({table})').fetchall():
+            if row[1] not in archived:
+                conn.execute(f'ALTER TABLE {schema}.{table} ADD COLUMN {row[1]} {row[2]}')
+    for sql in ARCHIVE_INDEXES:
+        conn.execute(sql.format(schema=schema))
+
+
+@contextmanager
+def attached(conn, year, create=False):
+    """ATTACH the year's archive file for the duration of the block.
+
+    Yields the schema name to qualify its tables with. Must be entered
+    outside a transaction; anything left uncommitted is rolled back.
+    """
+    path = archive_path(_database_path(conn), year)
+    if create:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    elif not os.path.exists(path):
+        raise ArchiveError(f'Archive file for {year} is missing: {path}')
+
+    schema = f'archive_{int(year)}'
+    conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+    try:
+        if create:
+            _ensure_schema(conn, schema)
+        yield schema
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute(f'DETACH DATABASE {schema}')
+
+
+def horizon(conn):
+    """Latest archive horizon (YYYY-MM-DD), or None if nothing was archived.
+    Rows dated before it may be in an archive file."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archive_runs'").fetchone() is None:
+        return None
+    return conn.execute('SELECT MAX(horizon) FROM archive_runs').fetchone()[0]
+
+
+def years(conn, table=None):
+    """Years with archived rows (of one table, or any)"""
+    if table is None:
+        rows = conn.execute('SELECT DISTINCT year FROM archive_segments WHERE row_count > 0 ORDER BY year')
+    else:
+        rows = conn.execute('SELECT year FROM archive_segments WHERE table_name = ? AND row_count > 0 ORDER BY year',
+                            (table,))
+    return [row[0] for row in rows]
+
+
+def locate(conn, table, key):
+    """Year of the archive file holding table's row with this primary key, or None"""
+    candidates = [row[0] for row in conn.execute("""
+        SELECT year FROM archive_segments
+        WHERE table_name = ? AND row_count > 0 AND min_key <= ? AND max_key >= ?
+        ORDER BY year DESC
+    """, (table, key, key))]
+    primary_key = _primary_key(conn, table)
+    for year in candidates:
+        with attached(conn, year) as schema:
+            if conn.execute(f'SELECT 1 FROM {schema}.{table} WHERE {primary_key} = ?', (key,)).fetchone():
+                return year
+    return None
+
+
+def fetch(conn, table, keys):
+    """Archived rows of table by primary key, in the live table's column order"""
+    keys = sorted({int(key) for key in keys})
+    if not keys:
+        return []
+    columns = ', '.join(_columns(conn, table))
+    primary_key = _primary_key(conn, table)
+    candidates = [row[0] for row in conn.execute("""
+        SELECT year FROM archive_segments
+        WHERE table_name = ? AND row_count > 0 AND min_key <= ? AND max_key >= ?
+        ORDER BY year
+    """, (table, keys[-1], keys[0]))]
+    rows = []
+    for year in candidates:
+        with attached(conn, year) as schema:
+            rows.extend(conn.execute(f"""
+                SELECT {columns} FROM {schema}.{table}
+                WHERE {primary_key} IN (SELECT value FROM json_each(?))
+            """, (json.dumps(keys),)).fetchall())
+    return rows
+
+
+def invoice_lines(conn, billing_id):
+    """invoicing.invoice_lines for an archived invoice"""
+    invoice = fetch(conn, 'billing', [billing_id])
+    if not invoice:
+        return []
+    year = int(invoice[0][_columns(conn, 'billing').index('created_at')][:4])
+    with attached(conn, year) as schema:
+        lines = conn.execute(f"""
+            SELECT l.appointment_id, l.therapy_id, l.amount FROM {schema}.invoice_lines l WHERE l.billing_id = ?
+        """, (billing_id,)).fetchall()
+    columns = _columns(conn, 'appointments')
+    day, start = columns.index('appointment_date'), columns.index('start_time')
+    sessions = {row[0]: (row[day], row[start]) for row in fetch(conn, 'appointments', [line[0] for line in lines])}
+    therapies = dict(conn.execute('SELECT id, therapy_name FROM therapies').fetchall())
+    lines = sorted(lines, key=lambda line: sessions.get(line[0], ('', '')))
+    return [(appointment_id, sessions.get(appointment_id, (None,))[0], therapies.get(therapy_id), amount)
+            for appointment_id, therapy_id, amount in lines]
+
+
+# =============================================================================
+# MOVING ROWS
+# =============================================================================
+
+def _candidates_sql(segment):
+    order = ', '.join(f't.{column}' for column in segment.order)
+    keyset = ', '.join('?' for _ in segment.order)
+    return f"""
+        SELECT t.id, CAST(substr(t.{segment.year_column}, 1, 4) AS INTEGER), {order}, t.id
+        FROM main.{segment.table} t
+        WHERE t.{segment.year_column} < ? AND ({order}, t.id) > ({keyset}, ?) AND {segment.closed}
+        ORDER BY {order}, t.id
+        LIMIT ?
+    """
+
+
+def _identical(conn, table, schema):
+    """EXISTS clause: an identical copy of live row t is in the archive"""
+    primary_key = _primary_key(conn, table)
+    same = ' AND '.join(f'c.{column} IS t.{column}' for column in _columns(conn, table))
+    return f'EXISTS (SELECT 1 FROM {schema}.{table} c WHERE c.{primary_key} = t.{primary_key} AND {same})'
+
+
+def _copy(conn, schema, segment, ids):
+    """Phase one: copy the rows and their children (writes the archive only)"""
+    conn.execute('BEGIN')
+    try:
+        for table, column in ((segment.table, 'id'), *segment.children):
+            columns = ', '.join(_columns(conn, table))
+            conn.execute(f"""
+                INSERT OR REPLACE INTO {schema}.{table} ({columns})
+                SELECT {columns} FROM main.{table} WHERE {column} IN (SELECT value FROM json_each(?))
+            """, (ids,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _update_segment(conn, schema, year, table):
+    primary_key = _primary_key(conn, table)
+    conn.execute(f"""
+        INSERT INTO main.archive_segments (year, table_name, row_count, min_key, max_key, checksum, updated_at)
+        SELECT ?, ?, COUNT(*), MIN({primary_key}), MAX({primary_key}), NULL, CURRENT_TIMESTAMP
+        FROM {schema}.{table}
+        WHERE true
+        ON CONFLICT (year, table_name) DO UPDATE SET
+            row_count = excluded.row_count, min_key = excluded.min_key, max_key = excluded.max_key,
+            checksum = NULL, updated_at = excluded.updated_at
+    """, (year, table))
+
+
+def _delete_copied(conn, schema, year, segment, ids):
+    """Phase two: drop live rows whose identical copy is archived and that
+    are still closed; archived copies of rows that changed meanwhile go"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('INSERT INTO main.archive_guard (active) VALUES (1)')
+        moved = {}
+        cursor = conn.execute(f"""
+            DELETE FROM main.{segment.table} AS t
+            WHERE t.id IN (SELECT value FROM json_each(?)) AND {segment.closed}
+              AND {_identical(conn, segment.table, schema)}
+        """, (ids,))
+        moved[segment.table] = cursor.rowcount
+        conn.execute(f"""
+            DELETE FROM {schema}.{segment.table}
+            WHERE id IN (SELECT id FROM main.{segment.table} WHERE id IN (SELECT value FROM json_each(?)))
+        """, (ids,))
+        for table, column in segment.children:
+            cursor = conn.execute(f"""
+                DELETE FROM main.{table} AS t
+                WHERE t.{column} IN (SELECT value FROM json_each(?))
+                  AND NOT EXISTS (SELECT 1 FROM main.{segment.table} p WHERE p.id = t.{column})
+                  AND {_identical(conn, table, schema)}
+            """, (ids,))
+            moved[table] = cursor.rowcount
+            conn.execute(f"""
+                DELETE FROM {schema}.{table}
+                WHERE {column} IN (SELECT id FROM main.{segment.table} WHERE id IN (SELECT value FROM json_each(?)))
+            """, (ids,))
+        for table in (segment.table, *(child for child, _ in segment.children)):
+            _update_segment(conn, schema, year, table)
+        conn.execute('DELETE FROM main.archive_guard')
+        conn.execute("UPDATE main.cache_versions SET version = version + 1 WHERE name = 'archive'")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return moved
+
+
+def _checksum(conn, schema, table):
+    digest = hashlib.sha256()
+    for row in conn.execute(f'SELECT * FROM {schema}.{table} ORDER BY {_primary_key(conn, table)}'):
+        digest.update(repr(tuple(row)).encode())
+    return digest.hexdigest()
+
+
+def seal(conn):
+    """Checksum every segment changed since it was last sealed"""
+    unsealed = defaultdict(list)
+    for year, table in conn.execute('SELECT year, table_name FROM archive_segments WHERE checksum IS NULL'):
+        unsealed[year].append(table)
+    for year, tables in unsealed.items():
+        with attached(conn, year) as schema:
+            checksums = [(_checksum(conn, schema, table), year, table) for table in tables]
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('UPDATE archive_segments SET checksum = ? WHERE year = ? AND table_name = ?', checksums)
+        conn.commit()
+    return sum(len(tables) for tables in unsealed.values())
+
+
+def run(conn, before=None, batch_size=BATCH_SIZE):
+    """Move closed records dated before `before` (default HORIZON_DAYS ago)
+    into the per-year archive files, batch_size rows per transaction.
+
+    Safe to interrupt and to run again. Returns Archived(horizon, {table: rows moved}).
+    """
+    before = date.fromisoformat(before or (date.today() - timedelta(days=HORIZON_DAYS)).isoformat()).isoformat()
+    conn.execute('BEGIN IMMEDIATE')
+    run_id = conn.execute('INSERT INTO archive_runs (horizon) VALUES (?)', (before,)).lastrowid
+    conn.commit()
+
+    moved = dict.fromkeys(ARCHIVE_TABLES, 0)
+    for segment in SEGMENTS:
+        sql = _candidates_sql(segment)
+        after = ('',) * len(segment.order) + (0,)
+        while True:
+            rows = conn.execute(sql, (before, *after, batch_size)).fetchall()
+            if not rows:
+                break
+            batches = defaultdict(list)
+            for row in rows:
+                batches[row[1]].append(row[0])
+            for year, ids in batches.items():
+                ids = json.dumps(ids)
+                with attached(conn, year, create=True) as schema:
+                    _copy(conn, schema, segment, ids)
+                    counts = retry_busy(lambda: _delete_copied(conn, schema, year, segment, ids), conn)
+                for table, count in counts.items():
+                    moved[table] += count
+            after = tuple(rows[-1][2:])
+
+    seal(conn)
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('UPDATE archive_runs SET finished_at = CURRENT_TIMESTAMP, moved = ? WHERE id = ?',
+                 (json.dumps(moved), run_id))
+    conn.commit()
+    return Archived(before, moved)
+
+
+# =============================================================================
+# VERIFY AND RESTORE
+# =============================================================================
+
+def verify(conn, only_year=None):
+    """Problems found in the archive files (empty if all is well): missing or
+    corrupt files, counts or checksums that differ from archive_segments,
+    rows present in both files and archive files nobody registered"""
+    problems = []
+    registered = defaultdict(dict)
+    for year, table, row_count, min_key, max_key, checksum in conn.execute(
+            'SELECT year, table_name, row_count, min_key, max_key, checksum FROM archive_segments'):
+        registered[year][table] = (row_count, min_key, max_key, checksum)
+
+    database = _database_path(conn)
+    on_disk = {int(match.group(1)) for match in (
+        re.search(r'-(\d{4})\.db$', path) for path in glob.glob(f'{_archive_prefix(database)}-*.db')) if match}
+    for year in sorted(on_disk - set(registered)):
+        if only_year in (None, year):
+            problems.append(f'{year}: {archive_path(database, year)} is not registered in archive_segments')
+
+    for year in sorted(registered):
+        if only_year not in (None, year):
+            continue
+        try:
+            with attached(conn, year) as schema:
+                result = conn.execute(f'PRAGMA {schema}.quick_check').fetchone()[0]
+                if result != 'ok':
+                    problems.append(f'{year}: quick_check failed: {result}')
+                    continue
+                for table, (row_count, min_key, max_key, checksum) in sorted(registered[year].items()):
+                    primary_key = _primary_key(conn, table)
+                    actual = conn.execute(f'SELECT COUNT(*), MIN({primary_key}), MAX({primary_key}) '
+                                          f'FROM {schema}.{table}').fetchone()
+                    if tuple(actual) != (row_count, min_key, max_key):
+                        problems.append(f'{year} {table}: file has {tuple(actual)} (rows, min, max), '
+                                        f'registry says {(row_count, min_key, max_key)}')
+                    if checksum is None:
+                        problems.append(f'{year} {table}: not sealed (interrupted run; run again)')
+                    elif _checksum(conn, schema, table) != checksum:
+                        problems.append(f'{year} {table}: checksum mismatch')
+                    both = conn.execute(f"""
+                        SELECT COUNT(*) FROM {schema}.{table} c
+                        WHERE EXISTS (SELECT 1 FROM main.{table} t WHERE t.{primary_key} = c.{primary_key})
+                    """).fetchone()[0]
+                    if both:
+                        problems.append(f'{year} {table}: {both} row(s) also in the live file (run again)')
+        except ArchiveError as e:
+            problems.append(f'{year}: {e}')
+    return problems
+
+
+def restore(conn, year):
+    """Move every row of one archive year back into the live file.
+
+    The archive file is kept as <file>.restored. Returns {table: rows restored}.
+    """
+    restored = {}
+    with attached(conn, year) as schema:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT INTO main.archive_guard (active) VALUES (1)')
+            for table in ARCHIVE_TABLES:
+                archived = set(_columns(conn, table, schema))
+                columns = ', '.join(column for column in _columns(conn, table) if column in archived)
+                restored[table] = conn.execute(f"""
+                    INSERT OR IGNORE INTO main.{table} ({columns}) SELECT {columns} FROM {schema}.{table}
+                """).rowcount
+            conn.execute('DELETE FROM main.archive_segments WHERE year = ?', (year,))
+            conn.execute('DELETE FROM main.archive_guard')
+            conn.execute("UPDATE main.cache_versions SET version = version + 1 WHERE name = 'archive'")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    path = archive_path(_database_path(conn), year)
+    os.replace(path, path + '.restored')
+    return restored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='AyurSutra hot/cold archival')
+    parser.add_argument('command', choices=['run', 'verify', 'restore'])
+    parser.add_argument('year', nargs='?', type=int, help='archive year (restore)')
+    parser.add_argument('--before', help=f'archive records dated before this day (default {HORIZON_DAYS} days ago)')
+    parser.add_argument('--year', dest='only_year', type=int, help='verify one year only')
+    parser.add_argument('--database', default='ayursutra.db')
+    args = parser.parse_args(argv)
+
+    conn = connect(args.database)
+    try:
+        if args.command == 'run':
+            result = run(conn, before=args.before)
+            print(f"✅ Archived records before {result.horizon}: "
+                  + ', '.join(f'{table} {count}' for table, count in result.moved.items()))
+            return 0
+
+        if args.command == 'restore':
+            if args.year is None:
+                parser.error('restore needs a YEAR')
+            restored = restore(conn, args.year)
+            print(f"✅ Restored {args.year}: " + ', '.join(f'{table} {count}' for table, count in restored.items()))
+            return 0
+
+        problems = verify(conn, args.only_year)
+        for problem in problems:
+            print(f"❌ {problem}")
+        if problems:
+            return 1
+        print(f"✅ {len(years(conn))} archive year(s) match the registry")
+        return 0
+    except (ArchiveError, sqlite3.OperationalError) as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
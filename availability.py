@@ -0,0 +1,308 @@
+"""
+AyurSutra - Therapist Availability Engine
+Mohit Yadav - Therapy Scheduling Engine
+
+Keeps each therapist's booked sessions for a day as sorted, non-overlapping
+intervals so conflict checks and free-slot searches are binary searches
+instead of a database round trip per booking attempt. Days are loaded for
+all therapists in one indexed query and kept current by write-through calls
+from the booking routes; the appointments table stays the source of truth.
+"""
+
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from database import per_database
+
+DEFAULT_HOURS = '09:00-18:00'
+SLOT_STEP_MINUTES = 15
+
+TherapistInfo = namedtuple('TherapistInfo', 'id name specialization windows max_sessions')
+Slot = namedtuple('Slot', 'therapist_id date start_time end_time')
+
+
+def to_minutes(hhmm):
+    """'HH:MM' (or 'HH:MM:SS') -> minutes since midnight"""
+    hours, minutes = hhmm.split(':')[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def to_hhmm(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def parse_hours(text):
+    """Parse therapists.available_hours such as '09:00-13:00, 14:00-18:00'"""
+    windows = []
+    for part in (text or '').replace(';', ',').split(','):
+        if '-' not in part:
+            continue
+        try:
+            start, end = (to_minutes(value.strip()) for value in part.split('-', 1))
+        except ValueError:
+            continue
+        if start < end:
+            windows.append((start, end))
+    return sorted(windows) or parse_hours(DEFAULT_HOURS)
+
+
+class DaySchedule:
+    """Booked intervals of one therapist on one day, sorted by start"""
+
+    __slots__ = ('starts', 'ends', 'appointment_ids')
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.appointment_ids = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlaps(self, start, end):
+        """True if [start, end) intersects any booked interval"""
+        index = bisect_right(self.starts, start)
+        if index and self.ends[index - 1] > start:
+            return True
+        return index < len(self.starts) and self.starts[index] < end
+
+    def add(self, start, end, appointment_id=None):
+        index = bisect_left(self.starts, start)
+        self.starts.insert(index, start)
+        self.ends.insert(index, end)
+        self.appointment_ids.insert(index, appointment_id)
+
+    def remove(self, appointment_id):
+        if appointment_id in self.appointment_ids:
+            index = self.appointment_ids.index(appointment_id)
+            del self.starts[index], self.ends[index], self.appointment_ids[index]
+
+    def merged(self, *others):
+        """New schedule holding the union of this and other schedules' intervals"""
+        union = DaySchedule()
+        intervals = sorted(interval for schedule in (self,) + others
+                           for interval in zip(schedule.starts, schedule.ends))
+        for start, end in intervals:
+            if union.starts and start < union.ends[-1]:
+                union.ends[-1] = max(union.ends[-1], end)
+            else:
+                union.starts.append(start)
+                union.ends.append(end)
+                union.appointment_ids.append(None)
+        return union
+
+    def gaps(self, windows, not_before=0):
+        """Free (start, end) stretches inside the working windows"""
+        for window_start, window_end in windows:
+            cursor = max(window_start, not_before)
+            index = bisect_right(self.ends, cursor)
+            while cursor < window_end:
+                if index < len(self.starts) and self.starts[index] < window_end:
+                    if self.starts[index] > cursor:
+                        yield cursor, self.starts[index]
+                    cursor = max(cursor, self.ends[index])
+                    index += 1
+                else:
+                    yield cursor, window_end
+                    break
+
+
+class AvailabilityEngine:
+    """Per-process cache of therapist day schedules with write-through updates"""
+
+    def __init__(self, step=SLOT_STEP_MINUTES, ttl=30.0, max_days=400):
+        self.step = step
+        self.ttl = ttl
+        self.max_days = max_days
+        self._lock = threading.RLock()
+        self._therapists = {}
+        self._therapists_loaded = 0.0
+        self._days = OrderedDict()      # date -> (loaded_at, {therapist_id: DaySchedule})
+
+    # ------------------------------------------------------------------ loading
+
+    def therapists(self, conn):
+        """Active therapists keyed by id, refreshed every ttl seconds"""
+        with self._lock:
+            if time.monotonic() - self._therapists_loaded > self.ttl:
+                rows = conn.execute("""
+                    SELECT t.id, u.full_name, t.specialization, t.available_hours, t.max_sessions_per_day
+                    FROM therapists t
+                    JOIN users u ON t.user_id = u.id
+                    WHERE u.is_active = 1
+                    ORDER BY u.full_name
+                """).fetchall()
+                self._therapists = OrderedDict(
+                    (row[0], TherapistInfo(row[0], row[1], row[2], parse_hours(row[3]), row[4] or 8))
+                    for row in rows
+                )
+                self._therapists_loaded = time.monotonic()
+            return self._therapists
+
+    def _day(self, conn, date):
+        with self._lock:
+            entry = self._days.get(date)
+            if entry and time.monotonic() - entry[0] <= self.ttl:
+                self._days.move_to_end(date)
+                return entry[1]
+
+            schedules = {}
+            for therapist_id, appointment_id, start_time, end_time in conn.execute("""
+                SELECT therapist_id, id, start_time, end_time
+                FROM appointments
+                WHERE appointment_date = ? AND status != 'cancelled'
+            """, (date,)):
+                schedules.setdefault(therapist_id, DaySchedule()).add(
+                    to_minutes(start_time), to_minutes(end_time), appointment_id)
+
+            self._days[date] = (time.monotonic(), schedules)
+            self._days.move_to_end(date)
+            while len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+            return schedules
+
+    def invalidate(self, date=None):
+        """Drop cached days (all of them when date is None)"""
+        with self._lock:
+            if date is None:
+                self._days.clear()
+                self._therapists_loaded = 0.0
+            else:
+                self._days.pop(date, None)
+
+    # ------------------------------------------------------------------ queries
+
+    def check(self, conn, therapist_id, date, start_time, duration):
+        """(is_free, reason) for one therapist and slot"""
+        info = self.therapists(conn).get(therapist_id)
+        if info is None:
+            return False, 'Therapist is not available'
+
+        start = to_minutes(start_time)
+        end = start + duration
+        if not any(w_start <= start and end <= w_end for w_start, w_end in info.windows):
+            return False, 'Outside therapist working hours'
+
+        with self._lock:
+            day = self._day(conn, date).get(therapist_id)
+            if day is not None:
+                if len(day) >= info.max_sessions:
+                    return False, f'Therapist already has {info.max_sessions} sessions that day'
+                if day.overlaps(start, end):
+                    return False, 'Time slot conflict'
+        return True, None
+
+    def booked_count(self, conn, therapist_id, date):
+        """Sessions already booked for a therapist on a day"""
+        with self._lock:
+            day = self._day(conn, date).get(therapist_id)
+            return len(day) if day is not None else 0
+
+    def is_free(self, conn, therapist_id, date, start_time, duration):
+        return self.check(conn, therapist_id, date, start_time, duration)[0]
+
+    def next_free_slots(self, conn, therapist_id, date, duration, count=5, not_before=None, days=1,
+                        blocked=()):
+        """First `count` free slots of `duration` minutes, searching `days` days ahead.
+
+        `blocked` holds extra DaySchedules (e.g. the patient's own sessions or a
+        plan not yet written) that slots on the first day must also avoid.
+        """
+        info = self.therapists(conn).get(therapist_id)
+        if info is None:
+            return []
+
+        slots = []
+        current = datetime.strptime(date, '%Y-%m-%d').date()
+        earliest = to_minutes(not_before) if not_before else 0
+        for _ in range(days):
+            day_key = current.isoformat()
+            with self._lock:
+                day = self._day(conn, day_key).get(therapist_id) or DaySchedule()
+                if len(day) < info.max_sessions:
+                    free = day.merged(*blocked) if blocked else day
+                    for gap_start, gap_end in free.gaps(info.windows, earliest):
+                        start = gap_start + (-gap_start % self.step)
+                        while start + duration <= gap_end and len(slots) < count:
+                            slots.append(Slot(therapist_id, day_key, to_hhmm(start), to_hhmm(start + duration)))
+                            start += self.step
+                        if len(slots) >= count:
+                            return slots
+            current += timedelta(days=1)
+            earliest = 0
+            blocked = ()
+        return slots
+
+    def therapists_free_at(self, conn, date, start_time, duration):
+        """Every active therapist who can take [start_time, +duration) on date"""
+        return [info for therapist_id, info in self.therapists(conn).items()
+                if self.check(conn, therapist_id, date, start_time, duration)[0]]
+
+    # ------------------------------------------------------------ write-through
+
+    def book(self, therapist_id, date, start_time, end_time, appointment_id):
+        with self._lock:
+            entry = self._days.get(date)
+            if entry:
+                entry[1].setdefault(therapist_id, DaySchedule()).add(
+                    to_minutes(start_time), to_minutes(end_time), appointment_id)
+
+    def release(self, therapist_id, date, appointment_id):
+        with self._lock:
+            entry = self._days.get(date)
+            if entry and therapist_id in entry[1]:
+                entry[1][therapist_id].remove(appointment_id)
+
+
+def init_app(app):
+    app.config.setdefault('AVAILABILITY_TTL', 30.0)
+    app.extensions['availability'] = {}
+
+
+def get_availability():
+    return per_database('availability', lambda: AvailabilityEngine(ttl=current_app.config['AVAILABILITY_TTL']))
+
+
+GUARDED_INSERT_SQL = """
+    INSERT INTO appointments (
+        appointment_id, patient_id, therapist_id, therapy_id,
+        appointment_date, start_time, end_time, notes, created_by, course_id
+    )
+    SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+    WHERE NOT EXISTS (
+        SELECT 1 FROM appointments
+        WHERE therapist_id = ? AND appointment_date = ? AND status != 'cancelled'
+          AND start_time < ? AND end_time > ?
+    )
+    AND (
+        SELECT COUNT(*) FROM appointments
+        WHERE therapist_id = ? AND appointment_date = ? AND status != 'cancelled'
+    ) < COALESCE((SELECT max_sessions_per_day FROM therapists WHERE id = ?), 8)
+"""
+
+
+def guarded_insert_params(appointment_code, patient_id, therapist_id, therapy_id,
+                          appointment_date, start_time, end_time, notes, created_by, course_id=None):
+    """Parameters for GUARDED_INSERT_SQL, usable with execute or executemany"""
+    return (appointment_code, patient_id, therapist_id, therapy_id,
+            appointment_date, start_time, end_time, notes, created_by, course_id,
+            therapist_id, appointment_date, end_time, start_time,
+            therapist_id, appointment_date, therapist_id)
+
+
+def insert_appointment(cursor, appointment_code, patient_id, therapist_id, therapy_id,
+                       appointment_date, start_time, end_time, notes, created_by, course_id=None):
+    """Insert only if the therapist is still free and under the daily cap.
+
+    Returns True when the row was written; False means another booking won
+    the slot since the engine last looked.
+    """
+    cursor.execute(GUARDED_INSERT_SQL, guarded_insert_params(
+        appointment_code, patient_id, therapist_id, therapy_id,
+        appointment_date, start_time, end_time, notes, created_by, course_id))
+    return cursor.rowcount == 1
@@ -0,0 +1,12 @@
+"""
+AyurSutra - Benchmarks
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+datagen fills a scratch database with a deterministic synthetic clinic;
+loadtest drives the app through a realistic traffic mix against it and
+writes per-route throughput and latency percentiles as JSON that can be
+compared with a stored baseline.
+
+    python -m benchmarks.datagen --scale small --database bench.db
+    python -m benchmarks.loadtest --database bench.db --output run.json --baseline baseline.json
+"""
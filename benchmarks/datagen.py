@@ -0,0 +1,301 @@
+"""
+AyurSutra - Synthetic Clinic Data Generator
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+Builds the init_database schema (with all migrations) in a fresh file and
+fills it with therapists, patients and several years of appointments,
+progress notes, invoices and stock usage. The same seed, scale and
+--today always produce the same rows, so benchmark runs are comparable.
+
+Usage: python -m benchmarks.datagen [--scale NAME] [--seed N] [--today YYYY-MM-DD]
+                                    [--database PATH] [--patients N] [--therapists N]
+                                    [--years N] [--force]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from availability import parse_hours, to_hhmm
+from database import connect
+from idgen import IdGenerator, lease_worker_id
+from inventory import seed_default_consumables
+
+# patients, therapists, years of history, average sessions per therapist-day
+SCALES = {
+    'tiny': {'patients': 200, 'therapists': 4, 'years': 1, 'sessions_per_day': 3},
+    'small': {'patients': 2000, 'therapists': 8, 'years': 2, 'sessions_per_day': 4},
+    'medium': {'patients': 20000, 'therapists': 20, 'years': 3, 'sessions_per_day': 5},
+    'large': {'patients': 100000, 'therapists': 50, 'years': 5, 'sessions_per_day': 6},
+}
+
+FUTURE_DAYS = 30
+BATCH_SIZE = 5000
+
+FIRST_NAMES = [
+    'Aarav', 'Aditi', 'Akash', 'Ananya', 'Anil', 'Anita', 'Arjun', 'Asha', 'Ayushi', 'Deepak',
+    'Divya', 'Gopal', 'Ishaan', 'Kavita', 'Krishna', 'Lakshmi', 'Manish', 'Meera', 'Mohan', 'Neha',
+    'Nikhil', 'Pooja', 'Priya', 'Rahul', 'Rajesh', 'Ramesh', 'Ritu', 'Rohan', 'Sanjay', 'Sarita',
+    'Shreya', 'Sunil', 'Sunita', 'Suresh', 'Tanvi', 'Uma', 'Varun', 'Vikram', 'Vinod', 'Yamini',
+]
+LAST_NAMES = [
+    'Agarwal', 'Bhatt', 'Chauhan', 'Desai', 'Gupta', 'Iyer', 'Joshi', 'Kapoor', 'Kulkarni', 'Mastwal',
+    'Menon', 'Mishra', 'Nair', 'Negi', 'Patel', 'Pillai', 'Rawat', 'Reddy', 'Sharma', 'Singh',
+    'Thakur', 'Verma', 'Yadav',
+]
+SPECIALIZATIONS = ['Panchakarma', 'Abhyanga', 'Shirodhara', 'Marma Therapy', 'Nasya', 'Basti']
+HOURS = ['09:00-18:00', '08:00-14:00', '12:00-20:00', '09:00-13:00, 14:00-18:00']
+
+THERAPIES = [
+    ('Abhyanga', 'Full body oil massage with warm herbal oils', 90, 2500.00, 1, 200),
+    ('Shirodhara', 'Continuous pouring of oil on forehead', 60, 3000.00, 1, 500),
+    ('Pizhichil', 'Oil bath therapy with warm medicated oils', 75, 4000.00, 1, 1000),
+    ('Udvartana', 'Herbal powder massage for weight reduction', 45, 2000.00, 0, 0),
+    ('Nasya', 'Nasal administration of medicated oils', 30, 1500.00, 1, 50),
+    ('Karna Purana', 'Ear treatment with medicated oils', 20, 1000.00, 1, 30),
+    ('Akshi Tarpana', 'Eye treatment with medicated ghee', 30, 2500.00, 1, 100),
+]
+INVENTORY = [
+    ('Sesame Oil', 'oil', 500000, 'ml', 1000, 15.00, 'Ayur Supplier', None),
+    ('Coconut Oil', 'oil', 300000, 'ml', 500, 25.00, 'Ayur Supplier', None),
+    ('Mahanarayan Oil', 'oil', 200000, 'ml', 200, 45.00, 'Ayur Supplier', None),
+    ('Triphala Churna', 'medicine', 10000, 'gm', 100, 120.00, 'Herbal Co.', '2027-12-31'),
+    ('Cotton Towels', 'consumable', 500, 'pieces', 10, 150.00, 'Textile Supplier', None),
+    ('Disposable Sheets', 'consumable', 2000, 'pieces', 20, 25.00, 'Medical Supplier', None),
+]
+NOTES = [
+    ('Session completed as planned.', 'Relaxed, slept well', 'Reduced stiffness in lower back'),
+    ('Oil temperature adjusted mid-session.', 'Mild discomfort initially', 'Improved circulation'),
+    ('Short session due to fatigue.', 'Tired', 'Pulse slightly elevated'),
+    ('Follow-up on previous recommendations.', 'Reports better digestion', 'Tongue coating reduced'),
+]
+
+
+def _timestamp(day, minutes=600):
+    return f'{day.isoformat()} {to_hhmm(minutes)}:00'
+
+
+def _epoch_ms(day, minutes=600):
+    return int(datetime(day.year, day.month, day.day, minutes // 60, minutes % 60).timestamp() * 1000)
+
+
+def _insert_many(conn, sql, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        conn.executemany(sql, rows[start:start + BATCH_SIZE])
+
+
+def create_schema(database):
+    """init_database + default admin on a fresh file, via the app's own code"""
+    from app import app, create_default_admin, init_database
+
+    previous = app.config['DATABASE']
+    app.config['DATABASE'] = database
+    try:
+        init_database()
+        create_default_admin()
+    finally:
+        app.config['DATABASE'] = previous
+
+
+def generate(database, scale='small', seed=42, today=None, **overrides):
+    """Fill `database` (which must not exist yet) and return row counts"""
+    params = dict(SCALES[scale])
+    params.update({key: value for key, value in overrides.items() if value is not None})
+    rnd = random.Random(seed)
+    today = today or date.today()
+    first_day = today - timedelta(days=365 * params['years'])
+
+    create_schema(database)
+    conn = connect(database)
+    generator = IdGenerator(lease_worker_id(conn))
+    counts = {}
+    conn.execute('BEGIN')
+    try:
+        conn.executemany("""
+            INSERT INTO therapies (therapy_name, description, duration_minutes, cost, requires_oil, oil_quantity_ml)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, THERAPIES)
+        conn.executemany("""
+            INSERT INTO inventory (item_name, item_type, current_stock, unit, min_stock_alert,
+                                   cost_per_unit, supplier, expiry_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, INVENTORY)
+        therapies = conn.execute('SELECT id, duration_minutes, cost, requires_oil, oil_quantity_ml FROM therapies').fetchall()
+        seed_default_consumables(conn)
+        consumables = {}
+        for therapy_id, inventory_id, quantity in conn.execute(
+                'SELECT therapy_id, inventory_id, quantity FROM therapy_consumables'):
+            consumables.setdefault(therapy_id, []).append((inventory_id, quantity))
+
+        # Therapists (one shared password hash: hashing is deliberately slow)
+        password_hash = generate_password_hash('therapist123')
+        therapists = []
+        for index in range(params['therapists']):
+            name = f'{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}'
+            user_id = conn.execute("""
+                INSERT INTO users (username, email, password_hash, role, full_name, phone)
+                VALUES (?, ?, ?, 'therapist', ?, ?)
+            """, (f'therapist{index + 1}', f'therapist{index + 1}@ayursutra.local', password_hash,
+                  name, f'9{rnd.randrange(10 ** 9):09d}')).lastrowid
+            hours = rnd.choice(HOURS)
+            therapist_id = conn.execute("""
+                INSERT INTO therapists (user_id, specialization, experience_years, available_hours, max_sessions_per_day)
+                VALUES (?, ?, ?, ?, 8)
+            """, (user_id, rnd.choice(SPECIALIZATIONS), rnd.randint(1, 25), hours)).lastrowid
+            therapists.append((therapist_id, user_id, parse_hours(hours)))
+        counts['therapists'] = len(therapists)
+
+        # Patients registered evenly over the history, oldest first
+        span_days = (today - first_day).days
+        patient_days = sorted(first_day + timedelta(days=rnd.randrange(span_days))
+                              for _ in range(params['patients']))
+        patient_rows = []
+        for day in patient_days:
+            minutes = rnd.randrange(9 * 60, 18 * 60)
+            patient_rows.append((
+                generator.next_id('AYU', at_ms=_epoch_ms(day, minutes)),
+                f'{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}',
+                rnd.randint(18, 80), rnd.choice(('Male', 'Female', 'Female', 'Male', 'Other')),
+                f'9{rnd.randrange(10 ** 9):09d}', rnd.randint(1, 5), rnd.randint(1, 5), rnd.randint(1, 5),
+                _timestamp(day, minutes),
+            ))
+        _insert_many(conn, """
+            INSERT INTO patients (patient_id, full_name, age, gender, phone,
+                                  prakriti_vata, prakriti_pitta, prakriti_kapha, created_by, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+        """, patient_rows)
+        first_patient = conn.execute('SELECT MIN(id) FROM patients').fetchone()[0]
+        counts['patients'] = len(patient_rows)
+        del patient_rows
+
+        # Appointments: back-to-back sessions inside each therapist's hours
+        appointment_rows = []
+        day = first_day
+        while day <= today + timedelta(days=FUTURE_DAYS):
+            registered = bisect_right(patient_days, day)
+            if day.weekday() != 6 and registered:
+                for therapist_id, user_id, windows in therapists:
+                    sessions = min(8, max(0, round(rnd.gauss(params['sessions_per_day'], 1.5))))
+                    cursor_minutes = windows[0][0] + rnd.choice((0, 15, 30))
+                    for _ in range(sessions):
+                        therapy = rnd.choice(therapies)
+                        # Earliest start from which the session fits inside a window
+                        cursor_minutes = next((max(cursor_minutes, start) for start, end in windows
+                                               if max(cursor_minutes, start) + therapy[1] <= end), None)
+                        if cursor_minutes is None:
+                            break
+                        finish = cursor_minutes + therapy[1]
+                        if day < today:
+                            status = rnd.choices(('completed', 'cancelled', 'rescheduled'), (92, 6, 2))[0]
+                        else:
+                            status = 'scheduled'
+                        booked = day - timedelta(days=rnd.randint(0, 14))
+                        appointment_rows.append((
+                            generator.next_id('APP', at_ms=_epoch_ms(booked, cursor_minutes)),
+                            first_patient + rnd.randrange(registered), therapist_id, therapy[0],
+                            day.isoformat(), to_hhmm(cursor_minutes), to_hhmm(finish), status,
+                            _timestamp(booked, cursor_minutes), user_id, therapy,
+                        ))
+                        cursor_minutes = finish + 15
+            day += timedelta(days=1)
+
+        _insert_many(conn, """
+            INSERT INTO appointments (appointment_id, patient_id, therapist_id, therapy_id,
+                                      appointment_date, start_time, end_time, status, created_at, created_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+        """, [row[:9] for row in appointment_rows])
+        counts['appointments'] = len(appointment_rows)
+
+        # Notes, invoices and consumables used by completed sessions (stock
+        # levels are left as generated, as if restocked along the way)
+        ids = dict(conn.execute('SELECT appointment_id, id FROM appointments'))
+        notes, invoices, usage = [], [], []
+        for code, patient_id, _, _, day_text, start, _, status, _, user_id, therapy in appointment_rows:
+            if status != 'completed':
+                continue
+            appointment_id = ids[code]
+            day = date.fromisoformat(day_text)
+            minutes = int(start[:2]) * 60 + int(start[3:])
+            if rnd.random() < 0.8:
+                session_notes, response, observations = rnd.choice(NOTES)
+                notes.append((appointment_id, session_notes, response, observations,
+                              rnd.randint(3, 10), user_id, _timestamp(day, minutes + therapy[1])))
+            discount = round(therapy[2] * 0.1, 2) if rnd.random() < 0.2 else 0.0
+            payment = rnd.choices(('paid', 'pending', 'partially_paid', 'refunded'), (85, 10, 4, 1))[0]
+            invoices.append((
+                generator.next_id('INV', at_ms=_epoch_ms(day, minutes)), patient_id, appointment_id,
+                therapy[2], discount, therapy[2] - discount, payment,
+                rnd.choice(('cash', 'card', 'upi')) if payment != 'pending' else None,
+                _timestamp(day, minutes) if payment != 'pending' else None, _timestamp(day, minutes),
+            ))
+            used_at = _timestamp(day, minutes + therapy[1])
+            usage.extend((inventory_id, appointment_id, quantity, used_at, user_id)
+                         for inventory_id, quantity in consumables.get(therapy[0], ()))
+        del appointment_rows, ids
+
+        _insert_many(conn, """
+            INSERT INTO progress_notes (appointment_id, session_notes, patient_response, therapist_observations,
+                                        improvement_scale, created_by, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, notes)
+        _insert_many(conn, """
+            INSERT INTO billing (invoice_id, patient_id, appointment_id, total_amount, discount_amount,
+                                 final_amount, payment_status, payment_method, payment_date, created_by, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+        """, invoices)
+        _insert_many(conn, """
+            INSERT INTO stock_usage (inventory_id, appointment_id, quantity_used, usage_date, used_by)
+            VALUES (?, ?, ?, ?, ?)
+        """, usage)
+        counts.update(progress_notes=len(notes), invoices=len(invoices), stock_usage=len(usage))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute('PRAGMA optimize')
+        conn.close()
+    return counts
+
+
+def remove_database(database):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic AyurSutra clinic database')
+    parser.add_argument('--database', default='bench.db')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--today', type=date.fromisoformat, help='anchor date (default: today)')
+    parser.add_argument('--patients', type=int)
+    parser.add_argument('--therapists', type=int)
+    parser.add_argument('--years', type=int)
+    parser.add_argument('--force', action='store_true', help='replace an existing database file')
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.database):
+        if not args.force:
+            print(f"❌ {args.database} exists (use --force to replace it)")
+            return 1
+        remove_database(args.database)
+
+    started = time.perf_counter()
+    counts = generate(args.database, args.scale, args.seed, today=args.today, patients=args.patients,
+                      therapists=args.therapists, years=args.years)
+    for table, count in counts.items():
+        print(f"✅ {table}: {count}")
+    print(f"✅ {args.database} generated in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""
+AyurSutra - Load Test Suite
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+Drives the Flask test client through a weighted mix of front-desk traffic
+(login, patient search, booking, schedule, progress and billing pages) from
+several threads, each with its own seeded random stream, and reports
+throughput and latency percentiles per route as JSON.
+
+With --baseline, routes whose p95 grew by more than --tolerance (and by at
+least --noise-ms) are reported and the exit status is 1.
+
+Usage: python -m benchmarks.loadtest [--database PATH | --scale NAME] [--requests N]
+                                     [--threads N] [--seed N] [--output FILE]
+                                     [--baseline FILE] [--tolerance 0.2]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from benchmarks import datagen
+
+# (route label, weight) - roughly a clinic front desk during opening hours
+TRAFFIC_MIX = [
+    ('login', 2),
+    ('patient_search', 20),
+    ('patients_list', 8),
+    ('schedule', 12),
+    ('book_form', 5),
+    ('book_submit', 8),
+    ('availability', 8),
+    ('progress', 10),
+    ('billing', 10),
+    ('billing_report', 5),
+]
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Workload:
+    """Route actions plus the reference ids they pick from"""
+
+    def __init__(self, database):
+        conn = sqlite3.connect(database)
+        try:
+            self.patient_ids = [row[0] for row in conn.execute('SELECT id FROM patients')]
+            self.therapist_ids = [row[0] for row in conn.execute('SELECT id FROM therapists')]
+            self.therapy_ids = [row[0] for row in conn.execute('SELECT id FROM therapies')]
+            self.name_prefixes = sorted({row[0][:3].lower() for row in conn.execute(
+                'SELECT full_name FROM patients LIMIT 500')})
+            self.phone_fragments = [row[0][-4:] for row in conn.execute('SELECT phone FROM patients LIMIT 200')]
+        finally:
+            conn.close()
+        self.today = date.today()
+
+    def request(self, client, route, rnd):
+        """Issue one request for `route`; returns the response"""
+        if route == 'login':
+            client.get('/logout')
+            return client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        if route == 'patient_search':
+            query = rnd.choice(self.name_prefixes) if rnd.random() < 0.7 else rnd.choice(self.phone_fragments)
+            return client.get('/api/patients/search', query_string={'q': query})
+        if route == 'patients_list':
+            if rnd.random() < 0.3:
+                return client.get('/patients', query_string={'search': rnd.choice(self.name_prefixes)})
+            return client.get('/patients')
+        if route == 'schedule':
+            return client.get('/schedule')
+        if route == 'book_form':
+            return client.get('/book_appointment')
+        if route == 'book_submit':
+            day = self.today + timedelta(days=rnd.randint(1, 60))
+            minutes = rnd.randrange(9 * 60, 17 * 60, 15)
+            return client.post('/book_appointment', data={
+                'patient_id': rnd.choice(self.patient_ids),
+                'therapist_id': rnd.choice(self.therapist_ids),
+                'therapy_id': rnd.choice(self.therapy_ids),
+                'appointment_date': day.isoformat(),
+                'start_time': f'{minutes // 60:02d}:{minutes % 60:02d}',
+            })
+        if route == 'availability':
+            return client.get('/api/availability/slots', query_string={
+                'therapist_id': rnd.choice(self.therapist_ids),
+                'therapy_id': rnd.choice(self.therapy_ids),
+                'date': (self.today + timedelta(days=rnd.randint(0, 14))).isoformat(),
+            })
+        if route == 'progress':
+            return client.get('/progress')
+        if route == 'billing':
+            return client.get('/billing')
+        if route == 'billing_report':
+            start = self.today - timedelta(days=rnd.choice((7, 30, 90, 365)))
+            return client.get('/billing/report', query_string={'start': start.isoformat(),
+                                                                'end': self.today.isoformat()})
+        raise ValueError(f'Unknown route {route}')
+
+
+def _worker(app, workload, routes, weights, count, seed, samples, warmup):
+    rnd = random.Random(seed)
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    for index in range(warmup + count):
+        route = rnd.choices(routes, weights)[0]
+        started = time.perf_counter()
+        response = workload.request(client, route, rnd)
+        response.get_data()          # streamed pages do their work here
+        response.close()
+        elapsed = time.perf_counter() - started
+        if index >= warmup:
+            samples.append((route, elapsed, response.status_code))
+
+
+def run(database, requests=2000, threads=4, seed=42, warmup=50, mix=None):
+    """Run the traffic mix and return the JSON-ready report"""
+    from app import app
+
+    app.config['DATABASE'] = database
+    mix = mix or TRAFFIC_MIX
+    routes = [route for route, _ in mix]
+    weights = [weight for _, weight in mix]
+    workload = Workload(database)
+
+    per_thread = [[] for _ in range(threads)]
+    workers = [threading.Thread(target=_worker, args=(
+        app, workload, routes, weights, requests // threads, seed + index, per_thread[index],
+        warmup // threads)) for index in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - started
+
+    samples = [sample for thread_samples in per_thread for sample in thread_samples]
+    report = {'meta': _metadata(database, requests, threads, seed), 'routes': {}}
+    for route in routes + ['all']:
+        latencies = sorted(elapsed * 1000 for name, elapsed, _ in samples if route in (name, 'all'))
+        errors = sum(1 for name, _, status in samples if route in (name, 'all') and status >= 500)
+        if not latencies:
+            continue
+        stats = {
+            'count': len(latencies),
+            'errors': errors,
+            'throughput_rps': round(len(latencies) / wall, 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'max_ms': round(latencies[-1], 3),
+        }
+        stats.update({f'p{pct}_ms': round(percentile(latencies, pct), 3) for pct in PERCENTILES})
+        report['routes'][route] = stats
+    report['meta']['wall_seconds'] = round(wall, 3)
+    return report
+
+
+def _metadata(database, requests, threads, seed):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    conn = sqlite3.connect(database)
+    try:
+        sizes = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                 for table in ('patients', 'appointments', 'billing', 'progress_notes')}
+    finally:
+        conn.close()
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'requests': requests,
+        'threads': threads,
+        'seed': seed,
+        'rows': sizes,
+    }
+
+
+def compare(report, baseline, tolerance=0.2, noise_ms=1.0):
+    """Routes whose p95 regressed beyond tolerance, as (route, old, new) tuples"""
+    regressions = []
+    for route, stats in report['routes'].items():
+        old = baseline.get('routes', {}).get(route)
+        if not old:
+            continue
+        before, after = old['p95_ms'], stats['p95_ms']
+        if after > before * (1 + tolerance) and after - before >= noise_ms:
+            regressions.append((route, before, after))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the AyurSutra routes')
+    parser.add_argument('--database', help='existing database (default: generate one at --scale)')
+    parser.add_argument('--scale', choices=sorted(datagen.SCALES), default='small')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the JSON report here (default: stdout)')
+    parser.add_argument('--baseline', help='JSON report to compare p95 latencies against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--noise-ms', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    scratch = None
+    database = args.database
+    if database is None:
+        scratch = tempfile.mkdtemp(prefix='ayursutra-bench-')
+        database = os.path.join(scratch, 'bench.db')
+        datagen.generate(database, args.scale, args.seed)
+
+    # Bookings made by the run are rolled into a copy, so a run can be repeated
+    # against the same generated file with identical starting data
+    work_dir = tempfile.mkdtemp(prefix='ayursutra-run-')
+    working_copy = os.path.join(work_dir, 'run.db')
+    source = sqlite3.connect(database)
+    target = sqlite3.connect(working_copy)
+    source.backup(target)
+    source.close()
+    target.close()
+
+    try:
+        report = run(working_copy, args.requests, args.threads, args.seed)
+    finally:
+        for directory in (work_dir, scratch):
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+    report['meta']['database'] = args.database or f'generated:{args.scale}'
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(text + '\n')
+        print(f"✅ {report['routes']['all']['count']} requests, "
+              f"{report['routes']['all']['throughput_rps']} req/s -> {args.output}")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare(report, json.load(handle), args.tolerance, args.noise_ms)
+        for route, before, after in regressions:
+            print(f"❌ {route}: p95 {before:.2f} ms -> {after:.2f} ms")
+        if regressions:
+            return 1
+        print("✅ no p95 regressions against the baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
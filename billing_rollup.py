@@ -0,0 +1,176 @@
+"""
+AyurSutra - Daily Billing Rollup
+Aditya Mastwal - Billing & Inventory Management
+
+billing_daily holds one row per (day, payment_status) with invoice counts
+and amount sums. Triggers on billing keep it current on every insert,
+update and delete, so dashboards and date-range reports read a few dozen
+rollup rows instead of aggregating the raw invoices.
+
+Days before the archive horizon keep their rollup rows when their invoices
+move to the archive files, so rebuild and verify only recompute the days
+from the horizon on.
+
+Usage: python billing_rollup.py {rebuild,verify} [--database PATH]
+"""
+
+import argparse
+import sys
+
+from archive import horizon as archive_horizon
+from database import connect
+
+ROLLUP_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS billing_daily (
+        day DATE NOT NULL,
+        payment_status TEXT NOT NULL,
+        invoice_count INTEGER NOT NULL DEFAULT 0,
+        total_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+        discount_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+        final_amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, payment_status)
+    ) WITHOUT ROWID
+"""
+
+_ADD_NEW = """
+    INSERT INTO billing_daily (day, payment_status, invoice_count, total_amount, discount_amount, final_amount)
+    VALUES (date(NEW.created_at), COALESCE(NEW.payment_status, 'pending'), 1,
+            NEW.total_amount, COALESCE(NEW.discount_amount, 0), NEW.final_amount)
+    ON CONFLICT (day, payment_status) DO UPDATE SET
+        invoice_count = invoice_count + 1,
+        total_amount = total_amount + excluded.total_amount,
+        discount_amount = discount_amount + excluded.discount_amount,
+        final_amount = final_amount + excluded.final_amount;
+"""
+
+_REMOVE_OLD = """
+    UPDATE billing_daily SET
+        invoice_count = invoice_count - 1,
+        total_amount = total_amount - OLD.total_amount,
+        discount_amount = discount_amount - COALESCE(OLD.discount_amount, 0),
+        final_amount = final_amount - OLD.final_amount
+    WHERE day = date(OLD.created_at) AND payment_status = COALESCE(OLD.payment_status, 'pending');
+    DELETE FROM billing_daily
+    WHERE day = date(OLD.created_at) AND payment_status = COALESCE(OLD.payment_status, 'pending')
+      AND invoice_count <= 0;
+"""
+
+TRIGGERS_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_billing_daily_insert AFTER INSERT ON billing
+        BEGIN {_ADD_NEW} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_billing_daily_delete AFTER DELETE ON billing
+        BEGIN {_REMOVE_OLD} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_billing_daily_update
+        AFTER UPDATE OF created_at, payment_status, total_amount, discount_amount, final_amount ON billing
+        BEGIN {_REMOVE_OLD} {_ADD_NEW} END""",
+]
+
+_RECOMPUTE_SQL = """
+    SELECT date(created_at) AS day, COALESCE(payment_status, 'pending') AS payment_status,
+           COUNT(*), SUM(total_amount), SUM(COALESCE(discount_amount, 0)), SUM(final_amount)
+    FROM billing
+    WHERE created_at >= ?
+    GROUP BY 1, 2
+"""
+
+
+def rebuild(conn, manage_transaction=True):
+    """Recompute billing_daily from the raw billing rows (from the archive horizon on)"""
+    if manage_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        since = archive_horizon(conn) or ''
+        conn.execute('DELETE FROM billing_daily WHERE day >= ?', (since,))
+        conn.execute(f"""
+            INSERT INTO billing_daily (day, payment_status, invoice_count,
+                                       total_amount, discount_amount, final_amount)
+            {_RECOMPUTE_SQL}
+        """, (since,))
+        if manage_transaction:
+            conn.commit()
+    except Exception:
+        if manage_transaction:
+            conn.rollback()
+        raise
+    return conn.execute('SELECT COUNT(*) FROM billing_daily').fetchone()[0]
+
+
+def verify(conn):
+    """Rows where the rollup and a fresh aggregation disagree (empty if consistent)"""
+    since = archive_horizon(conn) or ''
+    rollup = {(row[0], row[1]): tuple(round(value or 0, 2) for value in row[2:]) for row in conn.execute("""
+        SELECT day, payment_status, invoice_count, total_amount, discount_amount, final_amount
+        FROM billing_daily
+        WHERE day >= ?
+    """, (since,))}
+    fresh = {(row[0], row[1]): tuple(round(value or 0, 2) for value in row[2:])
+             for row in conn.execute(_RECOMPUTE_SQL, (since,))}
+
+    mismatches = []
+    for key in sorted(set(rollup) | set(fresh)):
+        if rollup.get(key) != fresh.get(key):
+            mismatches.append({'day': key[0], 'payment_status': key[1],
+                               'rollup': rollup.get(key), 'billing': fresh.get(key)})
+    return mismatches
+
+
+def window_stats(conn, days=30):
+    """(total_invoices, total_revenue, collected_revenue, pending_revenue) for the last `days` days"""
+    return conn.execute("""
+        SELECT
+            COALESCE(SUM(invoice_count), 0) as total_invoices,
+            SUM(final_amount) as total_revenue,
+            SUM(CASE WHEN payment_status = 'paid' THEN final_amount ELSE 0 END) as collected_revenue,
+            SUM(CASE WHEN payment_status = 'pending' THEN final_amount ELSE 0 END) as pending_revenue
+        FROM billing_daily
+        WHERE day >= date('now', ?)
+    """, (f'-{int(days)} days',)).fetchone()
+
+
+def revenue_report(conn, start_date, end_date):
+    """Per-day, per-status totals between two dates (inclusive)"""
+    return conn.execute("""
+        SELECT day, payment_status, invoice_count, total_amount, discount_amount, final_amount
+        FROM billing_daily
+        WHERE day BETWEEN ? AND ?
+        ORDER BY day, payment_status
+    """, (start_date, end_date)).fetchall()
+
+
+def status_totals(conn, start_date, end_date):
+    """Per-status totals between two dates (inclusive), for group reports"""
+    return conn.execute("""
+        SELECT payment_status, SUM(invoice_count), SUM(total_amount), SUM(discount_amount), SUM(final_amount)
+        FROM billing_daily
+        WHERE day BETWEEN ? AND ?
+        GROUP BY payment_status
+        ORDER BY payment_status
+    """, (start_date, end_date)).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild or verify the billing_daily rollup')
+    parser.add_argument('command', choices=['rebuild', 'verify'])
+    parser.add_argument('--database', default='ayursutra.db')
+    args = parser.parse_args(argv)
+
+    conn = connect(args.database)
+    try:
+        if args.command == 'rebuild':
+            print(f"✅ billing_daily rebuilt: {rebuild(conn)} rows")
+            return 0
+
+        mismatches = verify(conn)
+        for mismatch in mismatches:
+            print(f"❌ {mismatch['day']} {mismatch['payment_status']}: "
+                  f"rollup={mismatch['rollup']} billing={mismatch['billing']}")
+        if mismatches:
+            return 1
+        print("✅ billing_daily matches billing")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""
+AyurSutra - Multi-Branch Routing
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+Every clinic branch has its own database file, so branches never wait on
+each other's write lock and each file holds one clinic's data. The home
+database (app.config['DATABASE']) is the head-office branch and also the
+directory of the others:
+
+- branches: code, name and database file of every other branch (relative
+  paths are resolved next to the home database)
+- branch_users: the branch a username signs in to; anyone not listed
+  belongs to the home branch
+
+Login looks the username up once and keeps the branch code in the session.
+route_request() then points g.database at that branch's file before each
+request, so get_db(), write() and the per-database caches all follow it.
+Home-branch sessions carry no code and are not looked up at all. The
+directory is cached per process and re-read when its cache_versions
+counter moves, checked at most every BRANCH_CHECK_SECONDS.
+
+Every branch file has the full schema; app.init_database() migrates them
+all. Group reports run one query per active branch in parallel, each on a
+connection from that branch's pool, and merge the rows here (fan_out).
+
+Usage: python branches.py list [--database PATH]
+       python branches.py add CODE NAME [--path FILE] [--database PATH]
+       python branches.py assign USERNAME CODE [--database PATH]
+       python branches.py close CODE [--database PATH]
+       python branches.py migrate [--database PATH]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import abort, current_app, g, session
+
+from billing_rollup import status_totals
+from database import PoolTimeout, connect, get_pool
+from inventory import stock_levels
+
+HOME = 'main'
+HOME_NAME = 'Head office'
+BRANCH_FOLDER = 'branches'
+
+TABLES_SQL = [
+    f"""CREATE TABLE IF NOT EXISTS branches (
+           code TEXT PRIMARY KEY CHECK (code != '{HOME}'),
+           name TEXT NOT NULL,
+           database TEXT NOT NULL UNIQUE,
+           is_active INTEGER NOT NULL DEFAULT 1,
+           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+       ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS branch_users (
+           username TEXT PRIMARY KEY,
+           branch_code TEXT NOT NULL,
+           FOREIGN KEY (branch_code) REFERENCES branches (code)
+       ) WITHOUT ROWID""",
+    "INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('branches', 0)",
+    *(f"""CREATE TRIGGER IF NOT EXISTS trg_cache_branches_{event.lower()} AFTER {event} ON branches
+          BEGIN UPDATE cache_versions SET version = version + 1 WHERE name = 'branches'; END"""
+      for event in ('INSERT', 'UPDATE', 'DELETE')),
+]
+
+Branch = namedtuple('Branch', 'code name database is_active')
+BranchResult = namedtuple('BranchResult', 'branch value error')
+
+
+class BranchError(Exception):
+    """Raised for a branch code that is unknown or closed"""
+
+
+def resolve(home, database):
+    """Path of a branch database as stored in the directory"""
+    return os.path.join(os.path.dirname(home), database)
+
+
+def load(conn, home):
+    """{code: Branch} for the home branch and every registered branch"""
+    branches = {HOME: Branch(HOME, HOME_NAME, home, 1)}
+    for code, name, database, is_active in conn.execute("""
+        SELECT code, name, database, is_active FROM branches ORDER BY code
+    """):
+        branches[code] = Branch(code, name, resolve(home, database), is_active)
+    return branches
+
+
+def branch_databases(conn, home):
+    """Database files of every registered branch, closed ones included"""
+    return [branch.database for branch in load(conn, home).values() if branch.code != HOME]
+
+
+class Directory:
+    """Cached branch registry of one home database, shared by a worker's threads"""
+
+    def __init__(self, pool, check_seconds=2.0):
+        self.pool = pool
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._branches = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def branches(self, refresh=False):
+        """{code: Branch}, re-read if the registry changed since the last check"""
+        now = time.monotonic()
+        with self._lock:
+            if not refresh and self._branches is not None and now - self._checked_at < self.check_seconds:
+                return self._branches
+
+        conn = self.pool.acquire()
+        try:
+            version = conn.execute("SELECT version FROM cache_versions WHERE name = 'branches'").fetchone()
+            with self._lock:
+                branches = self._branches if version == self._version else None
+            if branches is None:
+                branches = load(conn, self.pool.database)
+        finally:
+            self.pool.release(conn)
+
+        with self._lock:
+            self._branches, self._version, self._checked_at = branches, version, now
+        return branches
+
+    def get(self, code):
+        """Active branch by code (None is the home branch)"""
+        code = code or HOME
+        branch = self.branches().get(code)
+        if branch is None:
+            # Registered since the last check, perhaps
+            branch = self.branches(refresh=True).get(code)
+        if branch is None or not branch.is_active:
+            raise BranchError(f'Unknown or closed branch: {code}')
+        return branch
+
+    def active(self):
+        return [branch for branch in self.branches().values() if branch.is_active]
+
+    def branch_for_user(self, username):
+        """The active branch a username signs in to"""
+        conn = self.pool.acquire()
+        try:
+            row = conn.execute('SELECT branch_code FROM branch_users WHERE username = ?', (username,)).fetchone()
+        finally:
+            self.pool.release(conn)
+        return self.get(row[0] if row else HOME)
+
+
+# =============================================================================
+# FLASK INTEGRATION
+# =============================================================================
+
+def init_app(app):
+    """Register routing defaults and the per-request branch lookup"""
+    app.config.setdefault('BRANCH_CHECK_SECONDS', 2.0)
+    app.config.setdefault('BRANCH_FANOUT_WORKERS', 8)
+    app.extensions['branch_directories'] = {}
+    app.before_request(route_request)
+
+
+def get_directory():
+    """Directory kept in the app's home database"""
+    app = current_app
+    home = app.config['DATABASE']
+    directories = app.extensions['branch_directories']
+    directory = directories.get(home)
+    if directory is None:
+        directory = directories.setdefault(home, Directory(get_pool(home),
+                                                           check_seconds=app.config['BRANCH_CHECK_SECONDS']))
+    return directory
+
+
+def route_request():
+    """before_request hook - route the request to the signed-in user's branch"""
+    code = session.get('branch')
+    if code is None:
+        return
+    try:
+        g.database = get_directory().get(code).database
+    except BranchError:
+        # The branch was closed under a live session
+        session.clear()
+        abort(403)
+
+
+def current_branch():
+    """Code of the branch the current request is routed to"""
+    return session.get('branch') or HOME
+
+
+def fan_out(query, branches=None):
+    """[BranchResult] of query(conn) on every active branch, run in parallel.
+
+    Each query gets a connection from its branch's pool and must not need
+    the app context. A branch that cannot be read is reported in its
+    result's error instead of failing the whole report.
+    """
+    branches = get_directory().active() if branches is None else branches
+    pools = [get_pool(branch.database) for branch in branches]
+
+    def run(branch, pool):
+        # A missing file must not be created empty by sqlite3.connect
+        if not os.path.exists(branch.database):
+            return BranchResult(branch, None, f'Database file is missing: {branch.database}')
+        try:
+            conn = pool.acquire()
+        except (PoolTimeout, sqlite3.Error) as e:
+            return BranchResult(branch, None, str(e))
+        try:
+            return BranchResult(branch, query(conn), None)
+        except sqlite3.Error as e:
+            return BranchResult(branch, None, str(e))
+        finally:
+            pool.release(conn)
+
+    workers = max(1, min(len(branches), current_app.config['BRANCH_FANOUT_WORKERS']))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, branches, pools))
+
+
+def _errors(results):
+    return {result.branch.code: result.error for result in results if result.error}
+
+
+# =============================================================================
+# GROUP REPORTS
+# =============================================================================
+
+def group_billing(start_date, end_date):
+    """Invoice totals per payment status for every branch and for the group"""
+    results = fan_out(lambda conn: status_totals(conn, start_date, end_date))
+    columns = ('invoice_count', 'total_amount', 'discount_amount', 'final_amount')
+    totals, branches = {}, []
+    for result in results:
+        if result.error:
+            continue
+        statuses = {}
+        for status, *values in result.value:
+            statuses[status] = dict(zip(columns, values))
+            group = totals.setdefault(status, dict.fromkeys(columns, 0))
+            for column, value in zip(columns, values):
+                group[column] += value
+        branches.append({'code': result.branch.code, 'name': result.branch.name, 'statuses': statuses})
+    for group in totals.values():
+        for column in columns[1:]:
+            group[column] = round(group[column], 2)
+    return {'branches': branches, 'totals': totals, 'errors': _errors(results)}
+
+
+def group_inventory(start_date, end_date):
+    """Stock and usage of each item (by name and unit) across branches,
+    with the branches where it is at or below its alert level"""
+    results = fan_out(lambda conn: stock_levels(conn, start_date, end_date))
+    items = {}
+    for result in results:
+        if result.error:
+            continue
+        for item_name, item_type, unit, current_stock, min_stock_alert, used in result.value:
+            item = items.setdefault((item_name, unit), {
+                'item_name': item_name, 'item_type': item_type, 'unit': unit,
+                'current_stock': 0, 'used': 0, 'low_stock': [], 'branches': {},
+            })
+            item['current_stock'] += current_stock
+            item['used'] += used
+            if current_stock <= min_stock_alert:
+                item['low_stock'].append(result.branch.code)
+            item['branches'][result.branch.code] = {
+                'current_stock': current_stock, 'min_stock_alert': min_stock_alert, 'used': used,
+            }
+    return {'items': sorted(items.values(), key=lambda item: (item['item_name'], item['unit'])),
+            'errors': _errors(results)}
+
+
+GROUP_REPORTS = {
+    'billing': group_billing,
+    'inventory': group_inventory,
+}
+
+
+# =============================================================================
+# COMMAND LINE
+# =============================================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='AyurSutra clinic branches')
+    parser.add_argument('command', choices=['list', 'add', 'assign', 'close', 'migrate'])
+    parser.add_argument('args', nargs='*', help='add: CODE NAME; assign: USERNAME CODE; close: CODE')
+    parser.add_argument('--path', help='add: database file, relative to the home database '
+                                       f'(default {BRANCH_FOLDER}/CODE.db)')
+    parser.add_argument('--database', default='ayursutra.db', help='home database')
+    args = parser.parse_args(argv)
+    expected = {'list': 0, 'add': 2, 'assign': 2, 'close': 1, 'migrate': 0}[args.command]
+    if len(args.args) != expected:
+        parser.error(f'{args.command} takes {expected} argument(s)')
+
+    # Schema creation lives with the app
+    from app import app, create_default_admin, init_database
+    app.config['DATABASE'] = args.database
+
+    if args.command == 'migrate':
+        init_database()
+        return 0
+
+    conn = connect(args.database)
+    try:
+        if args.command == 'list':
+            for branch in load(conn, args.database).values():
+                state = 'open' if branch.is_active else 'closed'
+                print(f"{branch.code:<12} {branch.name:<30} {state:<7} {branch.database}")
+            return 0
+
+        if args.command == 'add':
+            code, name = args.args
+            path = args.path or os.path.join(BRANCH_FOLDER, f'{code}.db')
+            database = resolve(args.database, path)
+            taken = [branch for branch in load(conn, args.database).values()
+                     if branch.code == code or os.path.abspath(branch.database) == os.path.abspath(database)]
+            if taken:
+                print(f"❌ Branch {taken[0].code} already uses that code or {taken[0].database}")
+                return 1
+            os.makedirs(os.path.dirname(database) or '.', exist_ok=True)
+            init_database(database)
+            admin = f'admin.{code}'
+            create_default_admin(database, username=admin)
+            with conn:
+                conn.execute('INSERT INTO branches (code, name, database) VALUES (?, ?, ?)', (code, name, path))
+                conn.execute('INSERT OR REPLACE INTO branch_users (username, branch_code) VALUES (?, ?)',
+                             (admin, code))
+            print(f"✅ Branch {code} ({name}) added: {database}, login {admin} / admin123")
+            return 0
+
+        if args.command == 'assign':
+            username, code = args.args
+            branch = load(conn, args.database).get(code)
+            if branch is None:
+                print(f"❌ Unknown branch {code}")
+                return 1
+            branch_conn = connect(branch.database)
+            try:
+                exists = branch_conn.execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone()
+            finally:
+                branch_conn.close()
+            if not exists:
+                print(f"❌ {username} is not a user of {branch.name}")
+                return 1
+            with conn:
+                if code == HOME:
+                    conn.execute('DELETE FROM branch_users WHERE username = ?', (username,))
+                else:
+                    conn.execute('INSERT OR REPLACE INTO branch_users (username, branch_code) VALUES (?, ?)',
+                                 (username, code))
+            print(f"✅ {username} signs in to {branch.name}")
+            return 0
+
+        with conn:
+            closed = conn.execute('UPDATE branches SET is_active = 0 WHERE code = ?', args.args).rowcount
+        if not closed:
+            print(f"❌ Unknown branch {args.args[0]}")
+            return 1
+        print(f"✅ Branch {args.args[0]} closed; its users can no longer sign in")
+        return 0
+    except sqlite3.IntegrityError as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
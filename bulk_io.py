@@ -0,0 +1,625 @@
+"""
+AyurSutra - Bulk Import and Export
+Aniruddh Negi (Team Lead) - Utilities
+
+Moves patients, appointments and billing records in and out of the
+database as CSV or NDJSON, for migrating clinics off legacy systems.
+
+Import is a generator pipeline: records are parsed one at a time, validated
+against the table's columns, and inserted with executemany in chunks. Each
+chunk is its own transaction, and the chunk writes its checkpoint
+(records done, imported, failed) in that same transaction, so an interrupted
+import resumes after the last committed chunk. A bad row is reported and
+skipped without aborting its chunk. Memory use depends on the chunk size,
+not the file size.
+
+References use the human-facing codes (patient_id AYU..., appointment_id
+APP...), the same columns the export writes, so an export can be imported
+into another clinic's database. Codes missing from the input are
+generated; legacy codes are kept as they are and resolved through id_aliases.
+
+Usage: python bulk_io.py import ENTITY FILE [--format csv|ndjson] [--errors FILE]
+                                            [--chunk-size N] [--restart] [--database PATH]
+       python bulk_io.py export ENTITY FILE [--format csv|ndjson] [--database PATH]
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import sys
+from collections import namedtuple
+from datetime import date, datetime
+from itertools import islice
+
+from database import connect
+from idgen import process_generator
+from jobs import task
+
+CHUNK_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 20
+FORMATS = ('csv', 'ndjson')
+
+CHECKPOINTS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS import_checkpoints (
+        import_key TEXT PRIMARY KEY,
+        entity TEXT NOT NULL,
+        records_done INTEGER NOT NULL DEFAULT 0,
+        imported INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'running' CHECK (status IN ('running', 'done')),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+ImportResult = namedtuple('ImportResult', 'read imported failed skipped errors')
+RowError = namedtuple('RowError', 'record error data')
+
+
+class ValidationError(ValueError):
+    """A field value that does not fit its column"""
+
+
+# -----------------------------------------------------------------------------
+# Field parsers - each takes the raw text (or JSON value) and returns the
+# value to store, raising ValidationError
+# -----------------------------------------------------------------------------
+
+_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_TIME_RE = re.compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+
+
+def _text(value):
+    return str(value).strip()
+
+
+def _integer(low, high):
+    def parse(value):
+        try:
+            number = int(str(value).strip())
+        except ValueError:
+            raise ValidationError(f'{value!r} is not a whole number') from None
+        if not low <= number <= high:
+            raise ValidationError(f'{number} is outside {low}-{high}')
+        return number
+    return parse
+
+
+def _money(value):
+    try:
+        amount = round(float(str(value).strip()), 2)
+    except ValueError:
+        raise ValidationError(f'{value!r} is not an amount') from None
+    if amount < 0:
+        raise ValidationError('amount cannot be negative')
+    return amount
+
+
+def _choice(*choices):
+    lookup = {choice.lower(): choice for choice in choices}
+
+    def parse(value):
+        try:
+            return lookup[str(value).strip().lower()]
+        except KeyError:
+            raise ValidationError(f"{value!r} is not one of {', '.join(choices)}") from None
+    return parse
+
+
+def _date(value):
+    text = str(value).strip()
+    try:
+        if _DATE_RE.match(text):
+            return date.fromisoformat(text).isoformat()
+    except ValueError:
+        pass
+    raise ValidationError(f'{value!r} is not a YYYY-MM-DD date')
+
+
+def _time(value):
+    text = str(value).strip()[:5]
+    if not _TIME_RE.match(text):
+        raise ValidationError(f'{value!r} is not an HH:MM time')
+    return text
+
+
+def _timestamp(value):
+    text = str(value).strip().replace('T', ' ')
+    try:
+        return datetime.fromisoformat(text).isoformat(sep=' ', timespec='seconds')
+    except ValueError:
+        raise ValidationError(f'{value!r} is not a timestamp') from None
+
+
+Field = namedtuple('Field', 'name parse required default')
+
+_DOSHA = _integer(0, 100)
+
+
+def _field(name, parse=_text, required=False, default=None):
+    return Field(name, parse, required, default)
+
+
+# -----------------------------------------------------------------------------
+# Entities
+# -----------------------------------------------------------------------------
+
+Entity = namedtuple('Entity', 'table code_column prefix alias fields references insert_columns export_sql')
+
+ENTITIES = {
+    'patients': Entity(
+        table='patients', code_column='patient_id', prefix='AYU', alias='patient',
+        fields=[
+            _field('patient_id'),
+            _field('full_name', required=True),
+            _field('age', _integer(0, 150), required=True),
+            _field('gender', _choice('Male', 'Female', 'Other'), required=True),
+            _field('phone', required=True),
+            _field('email'), _field('address'), _field('emergency_contact'),
+            _field('medical_history'), _field('allergies'), _field('contraindications'),
+            _field('prakriti_vata', _DOSHA, default=0), _field('prakriti_pitta', _DOSHA, default=0),
+            _field('prakriti_kapha', _DOSHA, default=0), _field('vikriti_vata', _DOSHA, default=0),
+            _field('vikriti_pitta', _DOSHA, default=0), _field('vikriti_kapha', _DOSHA, default=0),
+            _field('created_at', _timestamp),
+        ],
+        references={},
+        insert_columns=[
+            'patient_id', 'full_name', 'age', 'gender', 'phone', 'email', 'address',
+            'emergency_contact', 'medical_history', 'allergies', 'contraindications',
+            'prakriti_vata', 'prakriti_pitta', 'prakriti_kapha',
+            'vikriti_vata', 'vikriti_pitta', 'vikriti_kapha', 'created_by', 'created_at',
+        ],
+        export_sql="""
+            SELECT id, patient_id, full_name, age, gender, phone, email, address,
+                   emergency_contact, medical_history, allergies, contraindications,
+                   prakriti_vata, prakriti_pitta, prakriti_kapha,
+                   vikriti_vata, vikriti_pitta, vikriti_kapha, created_at
+            FROM patients WHERE id > ? ORDER BY id LIMIT ?
+        """,
+    ),
+    'appointments': Entity(
+        table='appointments', code_column='appointment_id', prefix='APP', alias='appointment',
+        fields=[
+            _field('appointment_id'),
+            _field('patient_id', required=True),
+            _field('therapist_id', _integer(1, 2**63 - 1), required=True),
+            _field('therapy_id', _integer(1, 2**63 - 1), required=True),
+            _field('appointment_date', _date, required=True),
+            _field('start_time', _time, required=True),
+            _field('end_time', _time),
+            _field('status', _choice('scheduled', 'completed', 'cancelled', 'rescheduled'),
+                   default='scheduled'),
+            _field('notes'),
+            _field('created_at', _timestamp),
+        ],
+        references={'patient_id': 'patient'},
+        insert_columns=[
+            'appointment_id', 'patient_id', 'therapist_id', 'therapy_id', 'appointment_date',
+            'start_time', 'end_time', 'status', 'notes', 'created_by', 'created_at',
+        ],
+        export_sql="""
+            SELECT a.id, a.appointment_id, p.patient_id, a.therapist_id, a.therapy_id,
+                   a.appointment_date, a.start_time, a.end_time, a.status, a.notes, a.created_at
+            FROM appointments a
+            JOIN patients p ON p.id = a.patient_id
+            WHERE a.id > ? ORDER BY a.id LIMIT ?
+        """,
+    ),
+    'billing': Entity(
+        table='billing', code_column='invoice_id', prefix='INV', alias='invoice',
+        fields=[
+            _field('invoice_id'),
+            _field('patient_id', required=True),
+            _field('appointment_id'),
+            _field('total_amount', _money, required=True),
+            _field('discount_amount', _money, default=0.0),
+            _field('final_amount', _money),
+            _field('payment_status', _choice('pending', 'paid', 'partially_paid', 'refunded'),
+                   default='pending'),
+            _field('payment_method'),
+            _field('payment_date', _timestamp),
+            _field('created_at', _timestamp),
+        ],
+        references={'patient_id': 'patient', 'appointment_id': 'appointment'},
+        insert_columns=[
+            'invoice_id', 'patient_id', 'appointment_id', 'total_amount', 'discount_amount',
+            'final_amount', 'payment_status', 'payment_method', 'payment_date', 'created_by',
+            'created_at',
+        ],
+        export_sql="""
+            SELECT b.id, b.invoice_id, p.patient_id, a.appointment_id, b.total_amount,
+                   b.discount_amount, b.final_amount, b.payment_status, b.payment_method,
+                   b.payment_date, b.created_at
+            FROM billing b
+            JOIN patients p ON p.id = b.patient_id
+            LEFT JOIN appointments a ON a.id = b.appointment_id
+            WHERE b.id > ? ORDER BY b.id LIMIT ?
+        """,
+    ),
+}
+
+# alias -> (table, code column) for resolving reference codes
+_REFERENCE_TABLES = {entity.alias: (entity.table, entity.code_column) for entity in ENTITIES.values()}
+
+
+def export_columns(entity):
+    """Column names written by export (and accepted by import)"""
+    return [field.name for field in ENTITIES[entity].fields]
+
+
+# -----------------------------------------------------------------------------
+# Reading
+# -----------------------------------------------------------------------------
+
+def detect_format(path, default='csv'):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    return {'csv': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson'}.get(extension, default)
+
+
+def read_records(stream, fmt):
+    """Yield (record number, dict or error message) from a text stream"""
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            if None in row:
+                yield number, 'more values than header columns'
+            else:
+                yield number, row
+    elif fmt == 'ndjson':
+        number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield number, f'invalid JSON: {exc}'
+                continue
+            yield number, record if isinstance(record, dict) else 'expected a JSON object'
+    else:
+        raise ValueError(f'Unknown format {fmt!r}')
+
+
+def validate(entity, record):
+    """Parsed column values for one record; raises ValidationError"""
+    values = {}
+    problems = []
+    for field in ENTITIES[entity].fields:
+        raw = record.get(field.name)
+        if raw is None or (isinstance(raw, str) and not raw.strip()):
+            if field.required:
+                problems.append(f'{field.name} is required')
+            values[field.name] = field.default
+            continue
+        try:
+            values[field.name] = field.parse(raw)
+        except ValidationError as exc:
+            problems.append(f'{field.name}: {exc}')
+    if problems:
+        raise ValidationError('; '.join(problems))
+    return values
+
+
+# -----------------------------------------------------------------------------
+# Import
+# -----------------------------------------------------------------------------
+
+def _resolve_codes(conn, alias, codes):
+    """code -> row id for existing (or aliased legacy) codes"""
+    if not codes:
+        return {}
+    table, column = _REFERENCE_TABLES[alias]
+    codes = json.dumps(sorted(codes))
+    found = dict(conn.execute(f"""
+        SELECT {column}, id FROM {table} WHERE {column} IN (SELECT value FROM json_each(?))
+    """, (codes,)))
+    found.update(conn.execute(f"""
+        SELECT a.legacy_id, t.id
+        FROM id_aliases a JOIN {table} t ON t.{column} = a.new_id
+        WHERE a.entity = ? AND a.legacy_id IN (SELECT value FROM json_each(?))
+    """, (alias, codes)))
+    return found
+
+
+def _prepare_chunk(conn, entity, chunk, generator, created_by, therapy_minutes, therapist_ids):
+    """Validate and resolve one chunk; returns (rows to insert, [RowError])"""
+    spec = ENTITIES[entity]
+    errors = []
+    valid = []
+    for number, record in chunk:
+        if isinstance(record, str):
+            errors.append(RowError(number, record, None))
+            continue
+        try:
+            valid.append((number, record, validate(entity, record)))
+        except ValidationError as exc:
+            errors.append(RowError(number, str(exc), record))
+
+    # One query per referenced table for the whole chunk
+    resolved = {
+        column: _resolve_codes(conn, alias, {values[column] for _, _, values in valid if values[column]})
+        for column, alias in spec.references.items()
+    }
+    existing = _resolve_codes(conn, spec.alias, {values[spec.code_column] for _, _, values in valid
+                                                 if values[spec.code_column]})
+    seen = set()
+    rows = []
+    for number, record, values in valid:
+        problems = []
+        code = values[spec.code_column]
+        if code and (code in existing or code in seen):
+            problems.append(f'{spec.code_column} {code} already exists')
+        for column, codes in resolved.items():
+            if values[column]:
+                if values[column] in codes:
+                    values[column] = codes[values[column]]
+                else:
+                    problems.append(f'{column} {values[column]} not found')
+
+        if entity == 'appointments':
+            if values['therapist_id'] not in therapist_ids:
+                problems.append(f"therapist_id {values['therapist_id']} not found")
+            if values['therapy_id'] not in therapy_minutes:
+                problems.append(f"therapy_id {values['therapy_id']} not found")
+            elif values['end_time'] is None:
+                start = int(values['start_time'][:2]) * 60 + int(values['start_time'][3:5])
+                end = start + therapy_minutes[values['therapy_id']]
+                values['end_time'] = f'{end // 60 % 24:02d}:{end % 60:02d}'
+        elif entity == 'billing':
+            if values['final_amount'] is None:
+                values['final_amount'] = round(values['total_amount'] - values['discount_amount'], 2)
+            if values['discount_amount'] > values['total_amount']:
+                problems.append('discount_amount exceeds total_amount')
+
+        if problems:
+            errors.append(RowError(number, '; '.join(problems), record))
+            continue
+        code = code or generator.next_id(spec.prefix)
+        seen.add(code)
+        values[spec.code_column] = code
+        values['created_by'] = created_by
+        rows.append((number, record, values))
+    return rows, errors
+
+
+def _insert_chunk(conn, entity, rows):
+    """executemany the rows; on a constraint error fall back to row by row
+    so only the offending rows are rejected. Returns (inserted, [RowError])"""
+    spec = ENTITIES[entity]
+    columns = spec.insert_columns
+    # created_at keeps the column default unless the input carries one
+    sql = (f"INSERT INTO {spec.table} ({', '.join(columns)}) "
+           f"VALUES ({', '.join('?' for _ in columns[:-1])}, COALESCE(?, CURRENT_TIMESTAMP))")
+    params = [[values[column] for column in columns] for _, _, values in rows]
+
+    conn.execute('SAVEPOINT bulk_chunk')
+    try:
+        conn.executemany(sql, params)
+        conn.execute('RELEASE bulk_chunk')
+        return len(rows), []
+    except sqlite3.IntegrityError:
+        conn.execute('ROLLBACK TO bulk_chunk')
+        conn.execute('RELEASE bulk_chunk')
+
+    inserted, errors = 0, []
+    for (number, record, _), row_params in zip(rows, params):
+        conn.execute('SAVEPOINT bulk_row')
+        try:
+            conn.execute(sql, row_params)
+            inserted += 1
+        except sqlite3.IntegrityError as exc:
+            conn.execute('ROLLBACK TO bulk_row')
+            errors.append(RowError(number, str(exc), record))
+        conn.execute('RELEASE bulk_row')
+    return inserted, errors
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_records(conn, entity, records, generator, checkpoint_key=None, created_by=None,
+                   chunk_size=CHUNK_SIZE, on_error=None):
+    """Import (record number, record) pairs in chunked transactions.
+
+    With a checkpoint_key, records up to the last committed chunk of an
+    earlier run with the same key are skipped. on_error is called with each
+    RowError; the result keeps only the first MAX_REPORTED_ERRORS of them.
+    """
+    if entity not in ENTITIES:
+        raise ValueError(f'Unknown entity {entity!r}')
+    done = 0
+    if checkpoint_key:
+        row = conn.execute('SELECT records_done FROM import_checkpoints WHERE import_key = ?',
+                           (checkpoint_key,)).fetchone()
+        done = row[0] if row else 0
+
+    therapy_minutes = dict(conn.execute('SELECT id, duration_minutes FROM therapies'))
+    therapist_ids = {row[0] for row in conn.execute('SELECT id FROM therapists')}
+    read = imported = failed = skipped = 0
+    reported = []
+
+    for chunk in _chunks(records, chunk_size):
+        read += len(chunk)
+        pending = [(number, record) for number, record in chunk if number > done]
+        skipped += len(chunk) - len(pending)
+        if not pending:
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows, errors = _prepare_chunk(conn, entity, pending, generator, created_by,
+                                          therapy_minutes, therapist_ids)
+            inserted, insert_errors = _insert_chunk(conn, entity, rows) if rows else (0, [])
+            errors += insert_errors
+            if checkpoint_key:
+                conn.execute("""
+                    INSERT INTO import_checkpoints (import_key, entity, records_done, imported, failed)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (import_key) DO UPDATE SET
+                        records_done = excluded.records_done,
+                        imported = imported + excluded.imported,
+                        failed = failed + excluded.failed,
+                        status = 'running', updated_at = CURRENT_TIMESTAMP
+                """, (checkpoint_key, entity, pending[-1][0], inserted, len(errors)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        imported += inserted
+        failed += len(errors)
+        for error in sorted(errors, key=lambda error: error.record):
+            if on_error:
+                on_error(error)
+            if len(reported) < MAX_REPORTED_ERRORS:
+                reported.append(error)
+
+    if checkpoint_key:
+        conn.execute("""
+            UPDATE import_checkpoints SET status = 'done', updated_at = CURRENT_TIMESTAMP
+            WHERE import_key = ?
+        """, (checkpoint_key,))
+        conn.commit()
+    return ImportResult(read, imported, failed, skipped, reported)
+
+
+def import_file(conn, entity, path, fmt=None, generator=None, checkpoint_key=None, created_by=None,
+                chunk_size=CHUNK_SIZE, on_error=None):
+    """Stream-import a CSV or NDJSON file (see import_records)"""
+    fmt = fmt or detect_format(path)
+    generator = generator or process_generator(conn)
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        return import_records(conn, entity, read_records(stream, fmt), generator, checkpoint_key,
+                              created_by, chunk_size, on_error)
+
+
+def default_checkpoint_key(entity, path):
+    """Same entity, file and size resume the same import"""
+    return f'{entity}:{os.path.abspath(path)}:{os.path.getsize(path)}'
+
+
+# -----------------------------------------------------------------------------
+# Export
+# -----------------------------------------------------------------------------
+
+def export_chunks(conn, entity, fmt='csv', batch_size=EXPORT_BATCH_SIZE):
+    """Yield the entity as CSV or NDJSON text, one batch of rows at a time.
+
+    Walks the table by id in short reads, so no read transaction stays open
+    for the whole export.
+    """
+    spec = ENTITIES[entity]
+    columns = export_columns(entity)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if fmt == 'csv':
+        writer.writerow(columns)
+    elif fmt != 'ndjson':
+        raise ValueError(f'Unknown format {fmt!r}')
+
+    last_id = 0
+    while True:
+        rows = conn.execute(spec.export_sql, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for row in rows:
+            if fmt == 'csv':
+                writer.writerow(row[1:])
+            else:
+                buffer.write(json.dumps(dict(zip(columns, row[1:])), ensure_ascii=False) + '\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@task('bulk_io.import')
+def _import_job(conn, payload):
+    """Background import of an uploaded file; the file is removed once done"""
+    path = payload['path']
+    errors_path = path + '.errors.ndjson'
+    with open(errors_path, 'w', encoding='utf-8') as errors_file:
+        def log_error(error):
+            errors_file.write(json.dumps(error._asdict(), ensure_ascii=False) + '\n')
+
+        result = import_file(conn, payload['entity'], path, payload.get('format'),
+                             checkpoint_key=payload.get('key'), created_by=payload.get('created_by'),
+                             on_error=log_error)
+    os.remove(path)
+    if not result.failed:
+        os.remove(errors_path)
+    summary = result._asdict()
+    summary['errors'] = [error._asdict() for error in result.errors]
+    summary['errors_file'] = errors_path if result.failed else None
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import/export of patients, appointments and billing')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('entity', choices=sorted(ENTITIES))
+    parser.add_argument('file', help="input or output file ('-' for stdout on export)")
+    parser.add_argument('--format', choices=FORMATS, help='default: from the file extension, else csv')
+    parser.add_argument('--errors', help='write rejected records to this NDJSON file')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint of an earlier run')
+    parser.add_argument('--database', default='ayursutra.db')
+    args = parser.parse_args(argv)
+    fmt = args.format or detect_format(args.file)
+
+    conn = connect(args.database)
+    try:
+        if args.command == 'export':
+            output = sys.stdout if args.file == '-' else open(args.file, 'w', encoding='utf-8', newline='')
+            try:
+                for text in export_chunks(conn, args.entity, fmt):
+                    output.write(text)
+            finally:
+                if output is not sys.stdout:
+                    output.close()
+            if output is not sys.stdout:
+                print(f"✅ {args.entity} exported to {args.file}")
+            return 0
+
+        key = default_checkpoint_key(args.entity, args.file)
+        if args.restart:
+            conn.execute('DELETE FROM import_checkpoints WHERE import_key = ?', (key,))
+            conn.commit()
+        errors_file = open(args.errors, 'w', encoding='utf-8') if args.errors else None
+        try:
+            def log_error(error):
+                if errors_file:
+                    errors_file.write(json.dumps(error._asdict(), ensure_ascii=False) + '\n')
+
+            result = import_file(conn, args.entity, args.file, fmt, checkpoint_key=key,
+                                 chunk_size=args.chunk_size, on_error=log_error)
+        finally:
+            if errors_file:
+                errors_file.close()
+    finally:
+        conn.close()
+
+    print(f"✅ {args.entity}: {result.read} read, {result.imported} imported, "
+          f"{result.skipped} skipped (already imported), {result.failed} rejected")
+    for error in result.errors:
+        print(f"❌ record {error.record}: {error.error}")
+    if result.failed > len(result.errors):
+        print(f"   ... {result.failed - len(result.errors)} more" +
+              (f" in {args.errors}" if args.errors else " (use --errors FILE)"))
+    return 1 if result.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
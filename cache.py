@@ -0,0 +1,192 @@
+"""
+AyurSutra - Reference Data Cache
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+Read-through, in-process cache for reference data that changes a few times
+a month: therapies, active therapists and the inventory catalog (item
+metadata, not stock levels).
+
+Every entry is keyed by (name, version). Versions live in cache_versions and
+are bumped by triggers on the underlying tables, so a write from any
+gunicorn worker, a script or the sqlite3 shell is seen by every worker
+within CHECK_SECONDS. Versions are read in one small query at most that
+often; the writing worker also drops its own entry at once via
+invalidate(). Entries also expire after a TTL as a safety net.
+"""
+
+import threading
+import time
+
+from flask import current_app
+
+from database import per_database
+
+VERSIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+"""
+
+# cache name -> (table, columns whose updates change the cached data)
+WATCHED_TABLES = {
+    'therapies': [('therapies', None)],
+    'therapists': [('therapists', None), ('users', 'full_name, is_active, role')],
+    'inventory_catalog': [('inventory', 'item_name, item_type, unit, min_stock_alert, '
+                                        'cost_per_unit, supplier, expiry_date')],
+}
+
+
+def _version_triggers():
+    statements = [
+        f"INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('{name}', 0)"
+        for name in WATCHED_TABLES
+    ]
+    for name, tables in WATCHED_TABLES.items():
+        bump = f"UPDATE cache_versions SET version = version + 1 WHERE name = '{name}';"
+        for table, columns in tables:
+            events = [('update', f'UPDATE OF {columns}' if columns else 'UPDATE')]
+            if table != 'users':
+                # New or removed users only matter once a therapists row points at them
+                events += [('insert', 'INSERT'), ('delete', 'DELETE')]
+            for suffix, event in events:
+                statements.append(f"""CREATE TRIGGER IF NOT EXISTS trg_cache_{name}_{table}_{suffix}
+                    AFTER {event} ON {table} BEGIN {bump} END""")
+    return statements
+
+
+TRIGGERS_SQL = _version_triggers()
+
+
+class Catalog:
+    """Rows of one reference table in display order, plus lookup by id"""
+
+    __slots__ = ('rows', 'by_id')
+
+    def __init__(self, rows):
+        self.rows = tuple(rows)
+        self.by_id = {row[0]: row for row in self.rows}
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, row_id):
+        return self.by_id.get(row_id)
+
+
+def load_therapies(conn):
+    return Catalog(conn.execute("""
+        SELECT id, therapy_name, duration_minutes, cost, description, requires_oil, oil_quantity_ml
+        FROM therapies
+        ORDER BY therapy_name
+    """))
+
+
+def load_therapists(conn):
+    return Catalog(conn.execute("""
+        SELECT t.id, u.full_name, t.specialization, t.available_hours, t.max_sessions_per_day
+        FROM therapists t
+        JOIN users u ON t.user_id = u.id
+        WHERE u.is_active = 1
+        ORDER BY u.full_name
+    """))
+
+
+def load_inventory_catalog(conn):
+    return Catalog(conn.execute("""
+        SELECT id, item_name, item_type, unit, min_stock_alert, cost_per_unit, supplier, expiry_date
+        FROM inventory
+        ORDER BY item_type, item_name
+    """))
+
+
+LOADERS = {
+    'therapies': load_therapies,
+    'therapists': load_therapists,
+    'inventory_catalog': load_inventory_catalog,
+}
+
+
+class ReferenceCache:
+    """Versioned TTL cache of LOADERS results, shared by a worker's threads"""
+
+    def __init__(self, ttl=300.0, check_seconds=2.0, loaders=None):
+        self.ttl = ttl
+        self.check_seconds = check_seconds
+        self.loaders = dict(loaders or LOADERS)
+        self._lock = threading.RLock()
+        self._entries = {}            # name -> (version, loaded_at, value)
+        self._versions = {}
+        self._checked_at = 0.0
+        self._counters = {name: {'hits': 0, 'misses': 0, 'invalidations': 0} for name in self.loaders}
+        self._version_checks = 0
+
+    def _current_versions(self, conn):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_seconds:
+                return self._versions
+        versions = dict(conn.execute('SELECT name, version FROM cache_versions').fetchall())
+        with self._lock:
+            self._versions = versions
+            self._checked_at = now
+            self._version_checks += 1
+        return versions
+
+    def get(self, conn, name):
+        version = self._current_versions(conn).get(name, 0)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry and entry[0] == version and now - entry[1] < self.ttl:
+                self._counters[name]['hits'] += 1
+                return entry[2]
+            self._counters[name]['misses'] += 1
+
+        # Load outside the lock; a concurrent duplicate load is harmless.
+        # The version was read first, so a write racing this load leaves
+        # the entry one version behind and it is reloaded on the next check.
+        value = self.loaders[name](conn)
+        with self._lock:
+            self._entries[name] = (version, now, value)
+        return value
+
+    def invalidate(self, *names):
+        """Drop local entries (all if no names) and re-read versions next time"""
+        with self._lock:
+            for name in names or list(self._entries):
+                if self._entries.pop(name, None) is not None:
+                    self._counters[name]['invalidations'] += 1
+            self._checked_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version_checks': self._version_checks,
+                'versions': dict(self._versions),
+                'entries': {
+                    name: dict(counters, cached=name in self._entries,
+                               hit_ratio=round(counters['hits'] / max(1, counters['hits'] + counters['misses']), 3))
+                    for name, counters in self._counters.items()
+                },
+            }
+
+
+def init_app(app):
+    app.config.setdefault('REFERENCE_CACHE_TTL', 300.0)
+    app.config.setdefault('REFERENCE_CACHE_CHECK_SECONDS', 2.0)
+    app.extensions['reference_cache'] = {}
+
+
+def get_reference_cache():
+    return per_database('reference_cache', lambda: ReferenceCache(
+        ttl=current_app.config['REFERENCE_CACHE_TTL'],
+        check_seconds=current_app.config['REFERENCE_CACHE_CHECK_SECONDS']))
+
+
+def reference(conn, name):
+    """Cached reference data by name, e.g. reference(conn, 'therapies')"""
+    return get_reference_cache().get(conn, name)
@@ -0,0 +1,213 @@
+"""
+AyurSutra - Calendar Grid
+Mohit Yadav - Therapy Scheduling Engine
+
+Builds the schedule for any date range as a therapist x day x 15-minute
+slot array: -1 outside working hours, 0 free, n for the n-th appointment
+in the range. Appointments are read with one indexed date-range query that
+joins only patients (for the name); therapy and therapist names come from
+the reference cache. Open and booked slots per therapist and day are
+array sums over the grid.
+
+schedule_versions holds a counter per day, bumped by triggers whenever an
+appointment on that day is booked, moved, changed or deleted. A range's
+ETag is a hash of its day counters, the filters and the reference data
+versions, so /api/schedule answers If-None-Match with a 304 after one
+primary-key range read, and an unchanged week is never rebuilt or re-sent.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date, timedelta
+
+import numpy as np
+
+from availability import SLOT_STEP_MINUTES, parse_hours, to_hhmm, to_minutes
+from database import per_database
+
+MAX_DAYS = 62
+CLOSED, FREE = -1, 0
+# Same rule as availability and GUARDED_INSERT_SQL: every status but
+# 'cancelled' (including 'rescheduled') keeps its slot
+RELEASED_STATUS = 'cancelled'
+
+VERSIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schedule_versions (
+        day DATE PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+"""
+
+_BUMP = """
+    INSERT INTO schedule_versions (day, version) VALUES ({row}.appointment_date, 1)
+    ON CONFLICT (day) DO UPDATE SET version = version + 1;
+"""
+
+TRIGGERS_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_schedule_versions_insert AFTER INSERT ON appointments
+        BEGIN {_BUMP.format(row='NEW')} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_schedule_versions_update
+        AFTER UPDATE OF patient_id, therapist_id, therapy_id, appointment_date, start_time, end_time, status
+        ON appointments
+        BEGIN
+            {_BUMP.format(row='OLD')}
+            {_BUMP.format(row='NEW')}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_schedule_versions_delete AFTER DELETE ON appointments
+        BEGIN {_BUMP.format(row='OLD')} END""",
+]
+
+APPOINTMENT_COLUMNS = ['id', 'appointment_date', 'start_time', 'end_time', 'therapist_id', 'therapy_id',
+                       'patient_id', 'patient_name', 'status']
+
+CalendarGrid = namedtuple('CalendarGrid', 'start days first_minute slot_minutes therapists cells appointments')
+
+
+def parse_range(start, end=None, days=7):
+    """(first day, day count) from YYYY-MM-DD strings; raises ValueError"""
+    first = date.fromisoformat(start)
+    count = (date.fromisoformat(end) - first).days + 1 if end else days
+    if not 1 <= count <= MAX_DAYS:
+        raise ValueError(f'A schedule covers 1 to {MAX_DAYS} days')
+    return first, count
+
+
+def schedule_etag(conn, start, days, therapist_id=None, therapy_id=None, scope=None):
+    """Strong validator for one range and filter set; scope names the
+    database, so branches with equal counters get different ETags"""
+    end = start + timedelta(days=days - 1)
+    digest = hashlib.sha1(repr((start.isoformat(), days, therapist_id, therapy_id, scope)).encode())
+    for day, version in conn.execute("""
+        SELECT day, version FROM schedule_versions WHERE day BETWEEN ? AND ? ORDER BY day
+    """, (start.isoformat(), end.isoformat())):
+        digest.update(f'{day}:{version};'.encode())
+    for name, version in conn.execute("""
+        SELECT name, version FROM cache_versions WHERE name IN ('therapists', 'therapies') ORDER BY name
+    """):
+        digest.update(f'{name}:{version};'.encode())
+    return digest.hexdigest()
+
+
+def build_grid(conn, therapists, start, days, therapist_id=None, therapy_id=None, step=SLOT_STEP_MINUTES):
+    """CalendarGrid for `days` days from `start`; therapists is the reference catalog"""
+    end = start + timedelta(days=days - 1)
+    filters, params = '', [start.isoformat(), end.isoformat()]
+    if therapist_id is not None:
+        filters += ' AND a.therapist_id = ?'
+        params.append(therapist_id)
+    if therapy_id is not None:
+        filters += ' AND a.therapy_id = ?'
+        params.append(therapy_id)
+    appointments = conn.execute(f"""
+        SELECT a.id, a.appointment_date, a.start_time, a.end_time, a.therapist_id, a.therapy_id,
+               a.patient_id, p.full_name, a.status
+        FROM appointments a
+        JOIN patients p ON p.id = a.patient_id
+        WHERE a.appointment_date BETWEEN ? AND ?{filters}
+        ORDER BY a.appointment_date, a.start_time, a.id
+    """, params).fetchall()
+
+    rows = [row for row in therapists if therapist_id is None or row[0] == therapist_id]
+    windows = [parse_hours(row[3]) for row in rows]
+    # Slot range: every working window plus any session booked outside one
+    bounds = [minute for row_windows in windows for window in row_windows for minute in window]
+    bounds += [to_minutes(appointment[column]) for appointment in appointments for column in (2, 3)]
+    first_minute = (min(bounds) // step) * step if bounds else 9 * 60
+    last_minute = -(-max(bounds) // step) * step if bounds else 18 * 60
+    slots = max(1, (last_minute - first_minute) // step)
+
+    cells = np.full((len(rows), days, slots), CLOSED, dtype='i4')
+    for index, row_windows in enumerate(windows):
+        for window_start, window_end in row_windows:
+            cells[index, :, (window_start - first_minute) // step:-(-(window_end - first_minute) // step)] = FREE
+
+    positions = {row[0]: index for index, row in enumerate(rows)}
+    for number, appointment in enumerate(appointments, 1):
+        index = positions.get(appointment[4])
+        if index is None or appointment[8] == RELEASED_STATUS:
+            continue
+        day = (date.fromisoformat(appointment[1]) - start).days
+        first_slot = (to_minutes(appointment[2]) - first_minute) // step
+        last_slot = -(-(to_minutes(appointment[3]) - first_minute) // step)
+        cells[index, day, first_slot:last_slot] = number
+
+    return CalendarGrid(start, days, first_minute, step, rows, cells, appointments)
+
+
+def capacity(grid):
+    """open slots, booked slots and sessions, each shaped (therapist, day)"""
+    booked = grid.cells > FREE
+    sessions = np.zeros(grid.cells.shape[:2], dtype='i4')
+    positions = {row[0]: index for index, row in enumerate(grid.therapists)}
+    for appointment in grid.appointments:
+        if appointment[8] != RELEASED_STATUS and appointment[4] in positions:
+            sessions[positions[appointment[4]], (date.fromisoformat(appointment[1]) - grid.start).days] += 1
+    return (grid.cells != CLOSED).sum(axis=2), booked.sum(axis=2), sessions
+
+
+def _runs(row):
+    """[[first slot, length, value]] runs of equal cells in one therapist-day"""
+    changes = np.flatnonzero(np.diff(row)) + 1
+    starts = np.concatenate(([0], changes))
+    lengths = np.diff(np.concatenate((starts, [len(row)])))
+    return [[int(first), int(length), int(row[first])] for first, length in zip(starts, lengths)]
+
+
+def grid_json(grid):
+    """Compact JSON body for a client-side calendar.
+
+    grid[t][d] is a run-length list of [first slot, length, value] where
+    value is -1 (closed), 0 (free) or a 1-based index into appointments.
+    """
+    open_slots, booked_slots, sessions = capacity(grid)
+    return {
+        'start': grid.start.isoformat(),
+        'end': (grid.start + timedelta(days=grid.days - 1)).isoformat(),
+        'days': grid.days,
+        'first_slot': to_hhmm(grid.first_minute),
+        'slot_minutes': grid.slot_minutes,
+        'slots_per_day': int(grid.cells.shape[2]),
+        'therapists': [{'id': row[0], 'name': row[1], 'max_sessions': row[4]} for row in grid.therapists],
+        'columns': APPOINTMENT_COLUMNS,
+        'appointments': [list(appointment) for appointment in grid.appointments],
+        'grid': [[_runs(grid.cells[t, d]) for d in range(grid.days)] for t in range(len(grid.therapists))],
+        'capacity': {'open_slots': open_slots.tolist(), 'booked_slots': booked_slots.tolist(),
+                     'sessions': sessions.tolist()},
+    }
+
+
+class ScheduleCache:
+    """Recently built JSON bodies by ETag, shared by a worker's threads"""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = self._misses = 0
+
+    def get(self, etag, build):
+        with self._lock:
+            if etag in self._entries:
+                self._entries.move_to_end(etag)
+                self._hits += 1
+                return self._entries[etag]
+            self._misses += 1
+        body = build()
+        with self._lock:
+            self._entries[etag] = body
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return body
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self._hits, 'misses': self._misses}
+
+
+def init_app(app):
+    app.extensions['schedule_cache'] = {}
+
+
+def get_schedule_cache():
+    return per_database('schedule_cache', ScheduleCache)
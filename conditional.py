@@ -0,0 +1,176 @@
+"""
+AyurSutra - Conditional GET and Rendered Page Cache
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+table_versions holds one counter per tracked table, bumped by triggers on
+every insert, update and delete. A dashboard declares the tables (and
+reference caches) it reads with @conditional(...); its ETag is a hash of
+those counters, the URL, today's date, the branch database and the
+signed-in user (the page shows their name and role-specific links).
+
+A request whose If-None-Match matches gets a 304 after one primary-key
+read, without running the view. Otherwise a rendered body stored under
+the same ETag is served from memory, and only a real miss renders. Streamed
+pages are still streamed on a miss and stored once fully sent. Requests
+carrying flashed messages always render, so a message is never cached or
+swallowed.
+"""
+
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from flask import current_app, make_response, request, session
+
+from database import current_database, get_db
+
+TRACKED_TABLES = ('appointments', 'billing', 'inventory', 'progress_notes', 'patients', 'stock_usage')
+
+VERSIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS table_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+"""
+
+
+def _version_triggers():
+    statements = [
+        f"INSERT OR IGNORE INTO table_versions (name, version) VALUES ('{table}', 0)"
+        for table in TRACKED_TABLES
+    ]
+    for table in TRACKED_TABLES:
+        bump = f"UPDATE table_versions SET version = version + 1 WHERE name = '{table}';"
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            statements.append(f"""CREATE TRIGGER IF NOT EXISTS trg_table_versions_{table}_{event.lower()}
+                AFTER {event} ON {table} BEGIN {bump} END""")
+    return statements
+
+
+TRIGGERS_SQL = _version_triggers()
+
+
+def current_versions(conn, tables, references=()):
+    """[(name, version)] for tracked tables and reference cache names"""
+    sql, params = [], []
+    if tables:
+        sql.append(f"SELECT 'table:' || name, version FROM table_versions "
+                   f"WHERE name IN ({', '.join('?' * len(tables))})")
+        params += tables
+    if references:
+        sql.append(f"SELECT 'reference:' || name, version FROM cache_versions "
+                   f"WHERE name IN ({', '.join('?' * len(references))})")
+        params += references
+    if not sql:
+        return []
+    return sorted(conn.execute(' UNION ALL '.join(sql), params).fetchall())
+
+
+class PageCache:
+    """Rendered bodies by ETag, LRU within a byte budget, shared by a worker's threads"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # etag -> (body, mimetype)
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'bypassed': 0}
+
+    def get(self, etag):
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is not None:
+                self._entries.move_to_end(etag)
+                self._stats['hits'] += 1
+            else:
+                self._stats['misses'] += 1
+            return entry
+
+    def put(self, etag, body, mimetype):
+        if len(body) > self.max_bytes // 4:
+            return
+        with self._lock:
+            old = self._entries.pop(etag, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[etag] = (body, mimetype)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+
+
+def _tee(chunks, store):
+    """Pass a streamed body through unchanged and store it once fully sent"""
+    body = []
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            body.append(chunk)
+            yield chunk
+        store(b''.join(body))
+    finally:
+        # The inner stream_with_context generator must be closed even when
+        # the client goes away part way through
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def conditional(*tables, references=()):
+    """ETag/If-None-Match and page caching for a GET view reading `tables`"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or 'user_id' not in session or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            cache = get_page_cache()
+            digest = hashlib.sha1(repr((
+                request.endpoint, request.full_path, date.today().isoformat(), current_database(),
+                session.get('user_id'), session.get('user_role'), session.get('full_name'),
+                current_versions(get_db(), tables, references),
+            )).encode())
+            etag = digest.hexdigest()
+
+            if request.if_none_match.contains(etag):
+                cache.count('not_modified')
+                response = current_app.response_class(status=304)
+            else:
+                cached = cache.get(etag)
+                if cached is not None:
+                    response = current_app.response_class(cached[0], mimetype=cached[1])
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        cache.count('bypassed')
+                        return response
+                    mimetype = response.mimetype
+                    if response.is_streamed:
+                        response.response = _tee(response.response, lambda body: cache.put(etag, body, mimetype))
+                    else:
+                        cache.put(etag, response.get_data(), mimetype)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    app.config.setdefault('PAGE_CACHE_BYTES', 32 * 1024 * 1024)
+    app.extensions['page_cache'] = PageCache(app.config['PAGE_CACHE_BYTES'])
+
+
+def get_page_cache():
+    return current_app.extensions['page_cache']
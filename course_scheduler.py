@@ -0,0 +1,302 @@
+"""
+AyurSutra - Panchakarma Course Scheduler
+Mohit Yadav - Therapy Scheduling Engine
+
+Places every session of a multi-day course (one or more therapies per day,
+in the order given) against therapist availability in a single pass, then
+books the whole plan in one transaction. Each day is solved greedily with
+backtracking; if a day cannot be completed, the smallest set of therapies
+that has to be dropped for that day is reported as the conflict.
+"""
+
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from itertools import combinations
+
+from availability import (DaySchedule, GUARDED_INSERT_SQL, guarded_insert_params,
+                          to_hhmm, to_minutes)
+
+MAX_COURSE_DAYS = 60
+CANDIDATES_PER_THERAPIST = 4
+SEARCH_BUDGET = 2000             # backtracking nodes per day
+
+Session = namedtuple('Session', 'date therapy_id therapy_name therapist_id therapist_name start_time end_time')
+Conflict = namedtuple('Conflict', 'date therapy_id therapy_name reason')
+
+
+class CoursePreferences:
+    """Placement preferences for a course; every field is optional"""
+
+    def __init__(self, therapist_ids=None, earliest='09:00', latest=None,
+                 gap_minutes=15, skip_weekdays=()):
+        self.therapist_ids = [int(t) for t in therapist_ids or []]
+        self.earliest = earliest or '00:00'
+        self.latest = latest or None
+        self.gap_minutes = int(gap_minutes)
+        self.skip_weekdays = {int(day) for day in skip_weekdays}
+
+    @classmethod
+    def from_mapping(cls, data):
+        return cls(therapist_ids=data.get('therapist_ids'),
+                   earliest=data.get('earliest', '09:00'),
+                   latest=data.get('latest'),
+                   gap_minutes=data.get('gap_minutes', 15),
+                   skip_weekdays=data.get('skip_weekdays', ()))
+
+
+class CoursePlan:
+    def __init__(self, patient_id, start_date, end_date):
+        self.patient_id = patient_id
+        self.start_date = start_date
+        self.end_date = end_date
+        self.sessions = []
+        self.conflicts = []
+        self.course_id = None
+        self.course_code = None
+
+    @property
+    def ok(self):
+        return not self.conflicts
+
+    def as_dict(self):
+        return {
+            'patient_id': self.patient_id,
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'course_id': self.course_id,
+            'course_code': self.course_code,
+            'sessions': [session._asdict() for session in self.sessions],
+            'conflicts': [conflict._asdict() for conflict in self.conflicts],
+        }
+
+
+class CourseError(ValueError):
+    """Invalid course request (bad dates, unknown therapies, too long)"""
+
+
+def _course_dates(start_date, end_date, skip_weekdays):
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    if end < start:
+        raise CourseError('End date is before start date')
+    if (end - start).days >= MAX_COURSE_DAYS:
+        raise CourseError(f'A course can span at most {MAX_COURSE_DAYS} days')
+    day = start
+    while day <= end:
+        if day.weekday() not in skip_weekdays:
+            yield day.isoformat()
+        day += timedelta(days=1)
+
+
+class _DaySolver:
+    """Backtracking placement of one day's therapies for one patient"""
+
+    def __init__(self, conn, engine, date, ranked_therapists, continuity, busy, tentative, preferences):
+        self.conn = conn
+        self.engine = engine
+        self.date = date
+        self.ranked = ranked_therapists
+        self.continuity = continuity      # therapy_id -> therapist used the previous day
+        self.busy = busy                  # patient's existing sessions that day
+        self.tentative = tentative        # therapist_id -> DaySchedule of this plan's sessions
+        self.preferences = preferences
+        self.latest = to_minutes(preferences.latest) if preferences.latest else None
+        self.budget = SEARCH_BUDGET
+
+    def _candidates(self, therapy, not_before):
+        therapy_id, _, duration = therapy
+        ranked = self.ranked
+        keep = self.continuity.get(therapy_id)
+        if keep is not None and keep in ranked:
+            ranked = [keep] + [info for info in ranked if info is not keep]
+
+        found = []
+        for rank, info in enumerate(ranked):
+            planned = self.tentative.get(info.id)
+            if planned and len(planned) + self.engine.booked_count(self.conn, info.id, self.date) >= info.max_sessions:
+                continue
+            slots = self.engine.next_free_slots(
+                self.conn, info.id, self.date, duration, count=CANDIDATES_PER_THERAPIST,
+                not_before=to_hhmm(not_before),
+                blocked=[schedule for schedule in (self.busy, planned) if schedule])
+            for slot in slots:
+                start, end = to_minutes(slot.start_time), to_minutes(slot.end_time)
+                if self.latest is not None and end > self.latest:
+                    break
+                found.append((start, rank, info, end))
+        found.sort(key=lambda candidate: (candidate[0], candidate[1]))
+        return found
+
+    def solve(self, therapies):
+        placed = []
+        if self._place(therapies, 0, to_minutes(self.preferences.earliest), placed):
+            return placed
+        return None
+
+    def _place(self, therapies, index, not_before, placed):
+        if index == len(therapies):
+            return True
+        self.budget -= 1
+        if self.budget <= 0:
+            return False
+
+        therapy = therapies[index]
+        for start, _, info, end in self._candidates(therapy, not_before):
+            schedule = self.tentative.setdefault(info.id, DaySchedule())
+            token = object()
+            schedule.add(start, end, token)
+            placed.append(Session(self.date, therapy[0], therapy[1], info.id, info.name,
+                                  to_hhmm(start), to_hhmm(end)))
+            if self._place(therapies, index + 1, end + self.preferences.gap_minutes, placed):
+                return True
+            placed.pop()
+            schedule.remove(token)
+            self.budget -= 1
+            if self.budget <= 0:
+                return False
+        return False
+
+
+def plan_course(conn, engine, patient_id, therapy_ids, start_date, end_date, preferences=None):
+    """Solve placement for every session of the course without writing anything"""
+    preferences = preferences or CoursePreferences()
+    plan = CoursePlan(patient_id, start_date, end_date)
+    if not therapy_ids:
+        raise CourseError('Select at least one therapy')
+
+    placeholders = ','.join('?' * len(set(therapy_ids)))
+    rows = conn.execute(f"""
+        SELECT id, therapy_name, duration_minutes FROM therapies WHERE id IN ({placeholders})
+    """, tuple(set(therapy_ids))).fetchall()
+    by_id = {row[0]: (row[0], row[1], row[2] or 60) for row in rows}
+    missing = [therapy_id for therapy_id in therapy_ids if therapy_id not in by_id]
+    if missing:
+        raise CourseError(f'Unknown therapy ids: {missing}')
+    therapies = [by_id[therapy_id] for therapy_id in therapy_ids]
+
+    dates = list(_course_dates(start_date, end_date, preferences.skip_weekdays))
+
+    # The patient's own sessions in the range, in one indexed read
+    patient_busy = {}
+    for day, start_time, end_time in conn.execute("""
+        SELECT appointment_date, start_time, end_time FROM appointments
+        WHERE patient_id = ? AND appointment_date BETWEEN ? AND ? AND status != 'cancelled'
+    """, (patient_id, start_date, end_date)):
+        patient_busy.setdefault(day, DaySchedule()).add(to_minutes(start_time), to_minutes(end_time))
+
+    active = engine.therapists(conn)
+    preferred = [active[t] for t in preferences.therapist_ids if t in active]
+    others = [info for info in active.values() if info not in preferred]
+
+    continuity = {}
+    for date in dates:
+        tentative = {}
+        solver = _DaySolver(conn, engine, date, preferred + others, continuity,
+                            patient_busy.get(date, DaySchedule()), tentative, preferences)
+        placed = solver.solve(therapies)
+        dropped = ()
+        size = 1
+        while placed is None and size <= len(therapies):
+            for dropped in combinations(range(len(therapies)), size):
+                tentative.clear()
+                solver.budget = SEARCH_BUDGET
+                kept = [therapy for index, therapy in enumerate(therapies) if index not in dropped]
+                placed = solver.solve(kept)
+                if placed is not None:
+                    break
+            size += 1
+
+        for index in dropped:
+            plan.conflicts.append(Conflict(date, therapies[index][0], therapies[index][1],
+                                           'No therapist free for this therapy on this day'))
+        for session in placed or []:
+            continuity[session.therapy_id] = active.get(session.therapist_id)
+            plan.sessions.append(session)
+
+    return plan
+
+
+class _SessionsLost(Exception):
+    """Raised inside the write unit so its savepoint rolls the course back"""
+
+
+def insert_course(conn, plan, course_code, codes, created_by, notes=''):
+    """Write unit: the course row and every planned session (no begin/commit).
+
+    Returns the course id; raises _SessionsLost, leaving the rollback to the
+    writer, if GUARDED_INSERT_SQL refused any session.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO treatment_courses (course_code, patient_id, start_date, end_date, notes, created_by)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (course_code, plan.patient_id, plan.start_date, plan.end_date, notes, created_by))
+    course_id = cursor.lastrowid
+
+    cursor.executemany(GUARDED_INSERT_SQL, [
+        guarded_insert_params(code, plan.patient_id, session.therapist_id,
+                              session.therapy_id, session.date, session.start_time,
+                              session.end_time, notes, created_by, course_id)
+        for code, session in zip(codes, plan.sessions)
+    ])
+    if cursor.rowcount != len(plan.sessions):
+        raise _SessionsLost()
+    return course_id
+
+
+def book_course(conn, write, engine, plan, created_by, id_generator, notes=''):
+    """Insert the course and every planned session as one write unit, run
+    by write() (writer.write).
+
+    Returns True on success. If another booking took one of the slots in the
+    meantime nothing is written and plan.conflicts names the lost sessions,
+    read back on conn once the unit has been rolled back.
+    """
+    course_code = id_generator.next_id('CRS')
+    codes = id_generator.reserve('APP', len(plan.sessions))
+    try:
+        course_id = write(lambda conn: insert_course(conn, plan, course_code, codes, created_by, notes))
+    except _SessionsLost:
+        _mark_lost_sessions(conn, plan)
+        return False
+    finally:
+        for date in {session.date for session in plan.sessions}:
+            engine.invalidate(date)
+
+    plan.course_id = course_id
+    plan.course_code = course_code
+    return True
+
+
+def _mark_lost_sessions(conn, plan):
+    """Name the sessions GUARDED_INSERT_SQL refused: an overlapping booking,
+    or the therapist's daily cap filled by other bookings plus the sessions
+    of this plan inserted before it"""
+    placed = Counter()
+    for session in plan.sessions:
+        taken = conn.execute("""
+            SELECT 1 FROM appointments
+            WHERE therapist_id = ? AND appointment_date = ? AND status != 'cancelled'
+              AND start_time < ? AND end_time > ?
+        """, (session.therapist_id, session.date, session.end_time, session.start_time)).fetchone()
+        if taken:
+            plan.conflicts.append(Conflict(session.date, session.therapy_id, session.therapy_name,
+                                           'Slot was booked by someone else; re-plan the course'))
+            continue
+
+        booked, limit = conn.execute("""
+            SELECT (SELECT COUNT(*) FROM appointments
+                    WHERE therapist_id = ? AND appointment_date = ? AND status != 'cancelled'),
+                   COALESCE((SELECT max_sessions_per_day FROM therapists WHERE id = ?), 8)
+        """, (session.therapist_id, session.date, session.therapist_id)).fetchone()
+        if booked + placed[session.therapist_id, session.date] >= limit:
+            plan.conflicts.append(Conflict(session.date, session.therapy_id, session.therapy_name,
+                                           'Daily session limit reached for the therapist; re-plan the course'))
+        else:
+            placed[session.therapist_id, session.date] += 1
+
+    if not plan.conflicts:
+        # The schedule changed again after the refused insert
+        first = plan.sessions[0]
+        plan.conflicts.append(Conflict(first.date, first.therapy_id, first.therapy_name,
+                                       'Schedule changed while booking; re-plan the course'))
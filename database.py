@@ -0,0 +1,226 @@
+"""
+AyurSutra - Shared Database Access Layer
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+Keeps a bounded pool of long-lived SQLite connections per database file and
+hands one out per request through Flask's application context. Connections
+are configured once when they are opened (WAL, synchronous, cache and mmap
+sizes) and keep their prepared statement cache for their whole lifetime.
+
+The database of a request is app.config['DATABASE'] unless the branch
+routing layer (branches.py) set g.database to the signed-in user's branch
+file; pools, writers and per-database caches all follow current_database().
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g
+
+DEFAULT_DATABASE = 'ayursutra.db'
+
+# Applied once per connection, in this order
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),        # ~16 MB page cache per connection
+    ('mmap_size', 134217728),      # 128 MB memory-mapped I/O
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),        # wait up to 5 s for another process's write lock
+)
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection became free within the timeout"""
+
+
+def connect(database, cached_statements=256, check_same_thread=False, factory=sqlite3.Connection):
+    """Open a connection with the standard AyurSutra pragmas applied"""
+    conn = sqlite3.connect(database, cached_statements=cached_statements,
+                           check_same_thread=check_same_thread, factory=factory)
+    for name, value in CONNECTION_PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+class ConnectionPool:
+    """Bounded LIFO pool of configured connections to one database file"""
+
+    def __init__(self, database, max_size=8, timeout=10.0, cached_statements=256,
+                 factory=sqlite3.Connection):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.factory = factory
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._connect_hooks = []
+        self._in_use = 0
+        self._stats = {
+            'connections_opened': 0,
+            'connections_discarded': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_ms': 0.0,
+            'timeouts': 0,
+            'high_water': 0,
+        }
+
+    def add_connect_hook(self, hook):
+        """Register hook(conn) to run on every connection the pool opens"""
+        self._connect_hooks.append(hook)
+
+    def _open(self):
+        conn = connect(self.database, cached_statements=self.cached_statements, factory=self.factory)
+        for hook in self._connect_hooks:
+            hook(conn)
+        with self._lock:
+            self._stats['connections_opened'] += 1
+        return conn
+
+    def open_dedicated(self):
+        """A configured connection outside the pool (connect hooks applied),
+        for a long-lived owner such as the writer thread"""
+        return self._open()
+
+    def acquire(self):
+        """Check a connection out of the pool, waiting up to self.timeout"""
+        if not self._slots.acquire(blocking=False):
+            started = time.perf_counter()
+            got_slot = self._slots.acquire(timeout=self.timeout)
+            waited = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self._stats['waits'] += 1
+                self._stats['wait_time_ms'] += waited
+                if not got_slot:
+                    self._stats['timeouts'] += 1
+            if not got_slot:
+                raise PoolTimeout(f'No free connection to {self.database} after {self.timeout}s')
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self._open()
+            except Exception:
+                self._slots.release()
+                raise
+
+        with self._lock:
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            self._stats['high_water'] = max(self._stats['high_water'], self._in_use)
+        return conn
+
+    def release(self, conn):
+        """Return a connection, rolling back anything left uncommitted"""
+        discard = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            discard = True
+
+        with self._lock:
+            self._in_use -= 1
+            if discard:
+                self._stats['connections_discarded'] += 1
+
+        if discard:
+            conn.close()
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    def stats(self):
+        """Snapshot of pool counters for sizing the pool"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['in_use'] = self._in_use
+        snapshot['idle'] = self._idle.qsize()
+        snapshot['max_size'] = self.max_size
+        snapshot['database'] = self.database
+        return snapshot
+
+    def close(self):
+        """Close every idle connection (used at shutdown and in tools)"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# =============================================================================
+# FLASK INTEGRATION
+# =============================================================================
+
+def init_app(app):
+    """Register pool configuration defaults and the per-request teardown"""
+    app.config.setdefault('DATABASE', DEFAULT_DATABASE)
+    app.config.setdefault('DB_POOL_SIZE', 8)
+    app.config.setdefault('DB_POOL_TIMEOUT', 10.0)
+    app.config.setdefault('DB_CACHED_STATEMENTS', 256)
+    app.config.setdefault('DB_CONNECTION_FACTORY', sqlite3.Connection)
+    app.extensions.setdefault('db_pools', {})
+    app.teardown_appcontext(close_db)
+
+
+def current_database():
+    """Database file of the current request: the routed branch database, else
+    app.config['DATABASE']"""
+    return g.get('database') or current_app.config['DATABASE']
+
+
+def per_database(name, factory):
+    """The current database's instance of extension `name` (a dict in
+    app.extensions), created with factory() on first use"""
+    instances = current_app.extensions[name]
+    database = current_database()
+    instance = instances.get(database)
+    if instance is None:
+        instance = instances.setdefault(database, factory())
+    return instance
+
+
+def get_pool(database=None):
+    """Pool for the given database file (defaults to current_database())"""
+    app = current_app
+    database = database or current_database()
+    pools = app.extensions['db_pools']
+    pool = pools.get(database)
+    if pool is None:
+        pool = pools.setdefault(database, ConnectionPool(
+            database,
+            max_size=app.config['DB_POOL_SIZE'],
+            timeout=app.config['DB_POOL_TIMEOUT'],
+            cached_statements=app.config['DB_CACHED_STATEMENTS'],
+            factory=app.config['DB_CONNECTION_FACTORY'],
+        ))
+    return pool
+
+
+def get_db():
+    """Connection bound to the current app context, checked out on first use"""
+    if 'db' not in g:
+        pool = get_pool()
+        g.db = pool.acquire()
+        g.db_pool = pool
+    return g.db
+
+
+def close_db(exception=None):
+    """Teardown hook - hand the request's connection back to its pool"""
+    conn = g.pop('db', None)
+    pool = g.pop('db_pool', None)
+    if conn is not None:
+        pool.release(conn)
+
+
+def pool_stats():
+    """Stats for every pool opened by the current app"""
+    return [pool.stats() for pool in current_app.extensions['db_pools'].values()]
@@ -0,0 +1,59 @@
+"""
+AyurSutra - Default Reference Data
+Aniruddh Negi (Team Lead) - Utilities
+
+The standard Panchakarma therapies and starter inventory a new clinic is
+set up with. seed_default_data() inserts them with one executemany per
+table in a single transaction. therapies and inventory have no unique key
+on the name, so each row is guarded by a NOT EXISTS on it and running the
+seed again only adds the defaults that are missing.
+"""
+
+from inventory import seed_default_consumables
+
+# (therapy_name, description, duration_minutes, cost, requires_oil, oil_quantity_ml)
+DEFAULT_THERAPIES = [
+    ('Abhyanga', 'Full body oil massage with warm herbal oils', 90, 2500.00, 1, 200),
+    ('Shirodhara', 'Continuous pouring of oil on forehead', 60, 3000.00, 1, 500),
+    ('Pizhichil', 'Oil bath therapy with warm medicated oils', 75, 4000.00, 1, 1000),
+    ('Udvartana', 'Herbal powder massage for weight reduction', 45, 2000.00, 0, 0),
+    ('Nasya', 'Nasal administration of medicated oils', 30, 1500.00, 1, 50),
+    ('Karna Purana', 'Ear treatment with medicated oils', 20, 1000.00, 1, 30),
+    ('Akshi Tarpana', 'Eye treatment with medicated ghee', 30, 2500.00, 1, 100),
+]
+
+# (item_name, item_type, current_stock, unit, min_stock_alert, cost_per_unit, supplier, expiry_date)
+DEFAULT_INVENTORY = [
+    ('Sesame Oil', 'oil', 5000, 'ml', 1000, 15.00, 'Ayur Supplier', None),
+    ('Coconut Oil', 'oil', 3000, 'ml', 500, 25.00, 'Ayur Supplier', None),
+    ('Mahanarayan Oil', 'oil', 2000, 'ml', 200, 45.00, 'Ayur Supplier', None),
+    ('Triphala Churna', 'medicine', 1000, 'gm', 100, 120.00, 'Herbal Co.', '2025-12-31'),
+    ('Ashwagandha Tablets', 'medicine', 500, 'tablets', 50, 2.00, 'Herbal Co.', '2025-10-31'),
+    ('Cotton Towels', 'consumable', 50, 'pieces', 10, 150.00, 'Textile Supplier', None),
+    ('Disposable Sheets', 'consumable', 200, 'pieces', 20, 25.00, 'Medical Supplier', None),
+]
+
+
+def seed_default_data(conn):
+    """Insert whichever default therapies, inventory items and consumables
+    are missing, matching therapies and items by name"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany("""
+            INSERT INTO therapies
+            (therapy_name, description, duration_minutes, cost, requires_oil, oil_quantity_ml)
+            SELECT ?1, ?2, ?3, ?4, ?5, ?6
+            WHERE NOT EXISTS (SELECT 1 FROM therapies WHERE therapy_name = ?1)
+        """, DEFAULT_THERAPIES)
+        conn.executemany("""
+            INSERT INTO inventory
+            (item_name, item_type, current_stock, unit, min_stock_alert,
+             cost_per_unit, supplier, expiry_date)
+            SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8
+            WHERE NOT EXISTS (SELECT 1 FROM inventory WHERE item_name = ?1)
+        """, DEFAULT_INVENTORY)
+        seed_default_consumables(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
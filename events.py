@@ -0,0 +1,317 @@
+"""
+AyurSutra - Live Event Stream
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+Triggers append a row to the events table whenever an appointment is
+booked, cancelled, completed, moved or deleted and whenever an item's stock
+changes, in the same transaction as the change. Every writer is covered
+(book_appointment, add_progress_note, update_stock, course booking, bulk
+import, jobs) and an event exists only once its change is committed.
+
+One Broadcaster thread per worker and database reads new rows by primary
+key every poll interval into a fixed-size ring, and wakes the connected
+Server-Sent Events clients. A client is only a position in that ring plus
+its filter, so fan-out costs no copying and no database work per client.
+A client reconnecting with Last-Event-ID is replayed from the ring, or
+from the table if it is further behind; once the gap is older than the
+retained history it gets a `reset` event and reloads its page.
+
+Usage: curl -N -b session=... http://localhost:5000/api/events?topics=stock
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque, namedtuple
+
+from flask import current_app
+
+from database import connect, current_database
+from writer import retry_busy
+
+TOPICS = ('appointment', 'stock')
+POLL_BATCH = 1000
+
+logger = logging.getLogger('ayursutra.events')
+
+# AUTOINCREMENT keeps ids from being reused once old events are pruned, so a
+# Last-Event-ID always means the same event
+TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        subject_id INTEGER NOT NULL,
+        therapist_id INTEGER,
+        day DATE,
+        data TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def _appointment_event(kind, row):
+    return f"""
+        INSERT INTO events (kind, subject_id, therapist_id, day, data)
+        VALUES ({kind}, {row}.id, {row}.therapist_id, {row}.appointment_date, json_object(
+            'id', {row}.id, 'appointment_id', {row}.appointment_id,
+            'patient_id', {row}.patient_id,
+            'patient_name', (SELECT full_name FROM patients WHERE id = {row}.patient_id),
+            'therapist_id', {row}.therapist_id, 'therapy_id', {row}.therapy_id,
+            'date', {row}.appointment_date, 'start_time', {row}.start_time, 'end_time', {row}.end_time,
+            'status', {row}.status));
+    """
+
+
+_STOCK_EVENT = """
+    INSERT INTO events (kind, subject_id, data)
+    VALUES ('stock.changed', NEW.id, json_object(
+        'id', NEW.id, 'item_name', NEW.item_name, 'current_stock', NEW.current_stock, 'unit', NEW.unit,
+        'min_stock_alert', NEW.min_stock_alert, 'low', NEW.current_stock <= NEW.min_stock_alert));
+"""
+
+TRIGGERS_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_events_appointment_insert AFTER INSERT ON appointments
+        BEGIN {_appointment_event("'appointment.booked'", 'NEW')} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_events_appointment_update
+        AFTER UPDATE OF therapist_id, therapy_id, appointment_date, start_time, end_time, status ON appointments
+        WHEN OLD.status IS NOT NEW.status OR OLD.therapist_id IS NOT NEW.therapist_id
+          OR OLD.therapy_id IS NOT NEW.therapy_id OR OLD.appointment_date IS NOT NEW.appointment_date
+          OR OLD.start_time IS NOT NEW.start_time OR OLD.end_time IS NOT NEW.end_time
+        BEGIN {_appointment_event('''CASE
+            WHEN OLD.status IS NOT NEW.status AND NEW.status IN ('cancelled', 'completed')
+            THEN 'appointment.' || NEW.status ELSE 'appointment.updated' END''', 'NEW')} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_events_appointment_delete AFTER DELETE ON appointments
+        BEGIN {_appointment_event("'appointment.deleted'", 'OLD')} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_events_stock_insert AFTER INSERT ON inventory
+        BEGIN {_STOCK_EVENT} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_events_stock_update
+        AFTER UPDATE OF current_stock, min_stock_alert ON inventory
+        WHEN OLD.current_stock IS NOT NEW.current_stock OR OLD.min_stock_alert IS NOT NEW.min_stock_alert
+        BEGIN {_STOCK_EVENT} END""",
+]
+
+Event = namedtuple('Event', 'id kind subject_id therapist_id day data')
+
+EVENT_COLUMNS = 'id, kind, subject_id, therapist_id, day, data'
+
+
+class EventFilter(namedtuple('EventFilter', 'topics therapist_id start end subject_id')):
+    """Per-client filter; None fields match everything"""
+
+    @classmethod
+    def from_args(cls, args):
+        """Filter from request args; raises ValueError"""
+        topics = tuple(topic for topic in args.get('topics', ','.join(TOPICS)).split(',') if topic)
+        unknown = set(topics) - set(TOPICS)
+        if unknown or not topics:
+            raise ValueError(f"topics must be a comma-separated subset of {', '.join(TOPICS)}")
+        return cls(topics, args.get('therapist_id', type=int), args.get('start') or None,
+                   args.get('end') or None, args.get('subject_id', type=int))
+
+    def matches(self, event):
+        topic = event.kind.split('.', 1)[0]
+        if topic not in self.topics:
+            return False
+        if self.subject_id is not None and event.subject_id != self.subject_id:
+            return False
+        if topic != 'appointment':
+            return True
+        if self.therapist_id is not None and event.therapist_id != self.therapist_id:
+            return False
+        return (self.start is None or event.day >= self.start) and (self.end is None or event.day <= self.end)
+
+
+def format_event(event):
+    """One SSE message"""
+    return f'id: {event.id}\nevent: {event.kind}\ndata: {event.data}\n\n'
+
+
+class Broadcaster:
+    """Fans committed events for one database out to a worker's SSE clients"""
+
+    def __init__(self, database, buffer_size=1024, poll_seconds=0.5, retain=20000, prune_seconds=300.0,
+                 max_clients=64):
+        self.database = database
+        self.poll_seconds = poll_seconds
+        self.retain = retain
+        self.prune_seconds = prune_seconds
+        self.max_clients = max_clients
+        self._ring = deque(maxlen=buffer_size)
+        self._changed = threading.Condition()
+        self._last_id = None
+        self._thread = None
+        self._clients = 0
+        self._stats = {'polls': 0, 'events': 0, 'replayed_from_table': 0, 'resets': 0, 'rejected': 0, 'pruned': 0}
+
+    def _start(self):
+        # Caller holds self._changed
+        if self._thread is None:
+            conn = connect(self.database)
+            try:
+                self._last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+            finally:
+                conn.close()
+            self._thread = threading.Thread(target=self._run, name='events-broadcaster', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        conn = connect(self.database)
+        pruned_at = time.monotonic()
+        while True:
+            try:
+                rows = conn.execute(f'SELECT {EVENT_COLUMNS} FROM events WHERE id > ? ORDER BY id LIMIT ?',
+                                    (self._last_id, POLL_BATCH)).fetchall()
+            except sqlite3.Error:
+                logger.exception('event poll failed')
+                rows = []
+            if time.monotonic() - pruned_at >= self.prune_seconds:
+                pruned_at = time.monotonic()
+                self._prune(conn)
+            with self._changed:
+                self._stats['polls'] += 1
+                if rows:
+                    # Commits are serialised and ids only grow, so nothing
+                    # can appear behind _last_id later
+                    self._ring.extend(Event(*row) for row in rows)
+                    self._last_id = rows[-1][0]
+                    self._stats['events'] += len(rows)
+                    self._changed.notify_all()
+            if len(rows) < POLL_BATCH:
+                time.sleep(self.poll_seconds)
+
+    def _prune(self, conn):
+        def delete():
+            cursor = conn.execute('DELETE FROM events WHERE id <= ?', (self._last_id - self.retain,))
+            conn.commit()
+            return cursor.rowcount
+
+        try:
+            pruned = retry_busy(delete, conn)
+        except sqlite3.Error:
+            logger.exception('event prune failed')
+            pruned = 0
+        finally:
+            # A transaction left open would pin every later poll to its
+            # snapshot (and hold back WAL checkpoints)
+            if conn.in_transaction:
+                conn.rollback()
+        with self._changed:
+            self._stats['pruned'] += pruned
+
+    def _replay(self, after_id, until_id):
+        """Events after_id < id <= until_id from the table, or None if some were pruned"""
+        conn = connect(self.database)
+        try:
+            oldest = conn.execute('SELECT MIN(id) FROM events').fetchone()[0]
+            if oldest is None or oldest > after_id + 1:
+                return None
+            return [Event(*row) for row in conn.execute(
+                f'SELECT {EVENT_COLUMNS} FROM events WHERE id > ? AND id <= ? ORDER BY id', (after_id, until_id))]
+        finally:
+            conn.close()
+
+    def _since(self, after_id):
+        """Buffered events after after_id, or None if the ring no longer reaches back that far"""
+        # Caller holds self._changed; new events are at the right end
+        events = []
+        for event in reversed(self._ring):
+            if event.id <= after_id:
+                return events[::-1]
+            events.append(event)
+        if after_id >= self._last_id or (self._ring and self._ring[0].id == after_id + 1):
+            return events[::-1]
+        return None
+
+    def stream(self, event_filter, last_event_id=None, max_seconds=300.0, heartbeat_seconds=15.0):
+        """SSE lines for one client until max_seconds; raises OverflowError when full"""
+        with self._changed:
+            self._start()
+            if self._clients >= self.max_clients:
+                self._stats['rejected'] += 1
+                raise OverflowError('Too many live event clients')
+            self._clients += 1
+            head = self._last_id
+        position = head if last_event_id is None else min(last_event_id, head)
+        return _Subscription(self, self._stream(event_filter, position, max_seconds, heartbeat_seconds))
+
+    def _release(self):
+        with self._changed:
+            self._clients -= 1
+
+    def _stream(self, event_filter, position, max_seconds, heartbeat_seconds):
+        deadline = time.monotonic() + max_seconds
+        # EventSource reconnects with Last-Event-ID after this delay
+        yield 'retry: 3000\n\n'
+        sent_at = time.monotonic()
+        while time.monotonic() < deadline:
+            with self._changed:
+                events = self._since(position)
+                if events == []:
+                    self._changed.wait(max(0.0, min(heartbeat_seconds, deadline - time.monotonic())))
+                    events = self._since(position)
+                head = self._last_id
+            if events is None:
+                # Fell behind the ring (a long disconnect or a bulk import)
+                events = self._replay(position, head)
+                with self._changed:
+                    self._stats['replayed_from_table' if events is not None else 'resets'] += 1
+                if events is None:
+                    yield f'id: {head}\nevent: reset\ndata: {{}}\n\n'
+                    position, sent_at = head, time.monotonic()
+                    continue
+            for event in events:
+                if event_filter.matches(event):
+                    yield format_event(event)
+                    sent_at = time.monotonic()
+                position = event.id
+            if time.monotonic() - sent_at >= heartbeat_seconds:
+                yield ': keepalive\n\n'
+                sent_at = time.monotonic()
+
+    def stats(self):
+        with self._changed:
+            return dict(self._stats, clients=self._clients, buffered=len(self._ring), last_id=self._last_id)
+
+
+class _Subscription:
+    """A client's message iterator; the WSGI server's close() frees its slot
+    even if the client left before the first message"""
+
+    def __init__(self, broadcaster, lines):
+        self._broadcaster = broadcaster
+        self._lines = lines
+        self._closed = False
+
+    def __iter__(self):
+        return self._lines
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._lines.close()
+            self._broadcaster._release()
+
+
+def init_app(app):
+    app.config.setdefault('EVENTS_BUFFER_SIZE', 1024)
+    app.config.setdefault('EVENTS_POLL_SECONDS', 0.5)
+    app.config.setdefault('EVENTS_RETAIN', 20000)
+    app.config.setdefault('EVENTS_MAX_CLIENTS', 64)
+    app.config.setdefault('EVENTS_STREAM_SECONDS', 300.0)
+    app.extensions['event_broadcasters'] = {}
+    app.extensions['event_broadcasters_lock'] = threading.Lock()
+
+
+def get_broadcaster(database=None):
+    """Broadcaster for the given database file (defaults to current_database())"""
+    app = current_app
+    database = database or current_database()
+    with app.extensions['event_broadcasters_lock']:
+        broadcasters = app.extensions['event_broadcasters']
+        if database not in broadcasters:
+            broadcasters[database] = Broadcaster(database, buffer_size=app.config['EVENTS_BUFFER_SIZE'],
+                                                 poll_seconds=app.config['EVENTS_POLL_SECONDS'],
+                                                 retain=app.config['EVENTS_RETAIN'],
+                                                 max_clients=app.config['EVENTS_MAX_CLIENTS'])
+        return broadcasters[database]
@@ -0,0 +1,354 @@
+"""
+AyurSutra - Collision-free ID Generation
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+Snowflake-style 64-bit IDs: milliseconds since EPOCH_MS, a 10-bit worker ID
+leased from the database once per process, and a 12-bit per-process
+sequence. Rendered as a prefix plus 13 Crockford base32 characters, so
+codes like APP/AYU/INV/CRS sort by creation time as plain strings.
+
+A process holds its worker ID until it exits (the lease row is deleted
+then) and refreshes the lease's heartbeat at most every HEARTBEAT_SECONDS
+when it generates IDs. A lease idle for LEASE_STALE_SECONDS may be taken
+over by another process; the idle one notices at its next heartbeat and
+leases a new ID before generating anything.
+
+The sequence restarts at 0 each millisecond, under a lock shared by the
+process's threads; after 4096 IDs in one millisecond the generator waits
+for the next. IDs from one generator therefore strictly increase, inserts
+never have to retry on a duplicate code, and generating an ID never
+touches the database.
+
+Usage: python idgen.py backfill [--database PATH] [--dry-run]
+"""
+
+import argparse
+import atexit
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from database import connect, current_database
+
+EPOCH_MS = 1704067200000              # 2024-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKERS = 1 << WORKER_BITS
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+ENCODED_WIDTH = 13
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+LEASE_STALE_SECONDS = 6 * 3600
+HEARTBEAT_SECONDS = 600
+
+# entity -> (table, code column, prefix)
+ID_COLUMNS = {
+    'patient': ('patients', 'patient_id', 'AYU'),
+    'appointment': ('appointments', 'appointment_id', 'APP'),
+    'invoice': ('billing', 'invoice_id', 'INV'),
+    'course': ('treatment_courses', 'course_code', 'CRS'),
+}
+
+
+def encode(value):
+    """Fixed-width Crockford base32 so string order matches numeric order"""
+    chars = []
+    for _ in range(ENCODED_WIDTH):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def decode(text):
+    value = 0
+    for char in text.upper():
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+
+def is_generated(code, prefix):
+    """True for codes produced by this module (prefix + 13 base32 chars)"""
+    body = code[len(prefix):]
+    return (code.startswith(prefix) and len(body) == ENCODED_WIDTH
+            and all(char in ALPHABET for char in body))
+
+
+def timestamp_of(code, prefix):
+    """UTC creation time encoded in a generated code"""
+    millis = (decode(code[len(prefix):]) >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+
+
+class IdGenerator:
+    """Time-ordered unique IDs for one process and one leased worker ID"""
+
+    def __init__(self, worker_id):
+        if not 0 <= worker_id < MAX_WORKERS:
+            raise ValueError(f'worker_id must be in [0, {MAX_WORKERS})')
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+        self._backdated = {}          # explicit millisecond -> last sequence used
+        self.heartbeat_at = time.monotonic()
+
+    def _compose(self, at_ms, sequence):
+        return (at_ms << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | sequence
+
+    def next_int(self, at_ms=None, sequence=None):
+        """Next ID for now, or for the epoch-ms timestamp at_ms.
+
+        Explicit timestamps (backfill, synthetic data) keep their own
+        sequence per millisecond and spill into the next millisecond when it
+        is full; a caller that orders rows itself passes `sequence` too.
+        Timestamps before EPOCH_MS are clamped to it.
+        """
+        if at_ms is not None:
+            at_ms = max(at_ms, EPOCH_MS) - EPOCH_MS
+            if sequence is not None:
+                return self._compose(at_ms, sequence & SEQUENCE_MASK)
+            with self._lock:
+                sequence = self._backdated.get(at_ms, -1) + 1
+                while sequence > SEQUENCE_MASK:
+                    at_ms += 1
+                    sequence = self._backdated.get(at_ms, -1) + 1
+                self._backdated[at_ms] = sequence
+            return self._compose(at_ms, sequence)
+
+        with self._lock:
+            clock = int(time.time() * 1000) - EPOCH_MS
+            # Never step backwards if the wall clock is adjusted
+            now = max(clock, self._last_ms)
+            if now > self._last_ms:
+                self._sequence = 0
+            else:
+                self._sequence = (self._sequence + 1) & SEQUENCE_MASK
+                if self._sequence == 0:
+                    if clock < self._last_ms:
+                        # Clock stepped back: borrow the next millisecond
+                        now = self._last_ms + 1
+                    while now <= self._last_ms:
+                        now = int(time.time() * 1000) - EPOCH_MS
+            self._last_ms = now
+            return self._compose(now, self._sequence)
+
+    def next_id(self, prefix, at_ms=None, sequence=None):
+        return prefix + encode(self.next_int(at_ms, sequence))
+
+    def reserve(self, prefix, count):
+        """A block of `count` IDs for bulk inserts, in ascending order"""
+        return [self.next_id(prefix) for _ in range(count)]
+
+
+# =============================================================================
+# WORKER ID LEASES
+# =============================================================================
+
+def lease_worker_id(conn, hostname=None, pid=None):
+    """Claim a free (or stale) worker ID in id_workers and return it"""
+    hostname = hostname or socket.gethostname()
+    pid = pid or os.getpid()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute("""
+            SELECT worker_id, hostname, pid,
+                   (julianday('now') - julianday(heartbeat_at)) * 86400 AS idle_seconds
+            FROM id_workers ORDER BY worker_id
+        """).fetchall()
+        taken = {row[0] for row in rows}
+        reusable = [row[0] for row in rows
+                    if row[3] > LEASE_STALE_SECONDS
+                    or (row[1] == hostname and row[2] != pid and not _pid_alive(row[2]))]
+        free = next((worker for worker in range(MAX_WORKERS) if worker not in taken), None)
+        worker_id = free if free is not None else (reusable[0] if reusable else None)
+        if worker_id is None:
+            raise RuntimeError('All worker IDs are leased; raise WORKER_BITS or clear id_workers')
+
+        conn.execute("""
+            INSERT OR REPLACE INTO id_workers (worker_id, hostname, pid, leased_at, heartbeat_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        """, (worker_id, hostname, pid))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    atexit.register(release_worker_id, conn.execute('PRAGMA database_list').fetchone()[2],
+                    worker_id, hostname, pid)
+    return worker_id
+
+
+def release_worker_id(database, worker_id, hostname, pid):
+    """Give a lease back (registered with atexit by lease_worker_id)"""
+    if pid != os.getpid():
+        return    # inherited by a forked child; the lease is its parent's
+    try:
+        conn = connect(database)
+        try:
+            conn.execute('DELETE FROM id_workers WHERE worker_id = ? AND hostname = ? AND pid = ?',
+                         (worker_id, hostname, pid))
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass      # left to go stale
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def heartbeat(conn, worker_id):
+    """Refresh this process's lease; returns 0 if another process took it over"""
+    renewed = conn.execute("""
+        UPDATE id_workers SET heartbeat_at = CURRENT_TIMESTAMP
+        WHERE worker_id = ? AND hostname = ? AND pid = ?
+    """, (worker_id, socket.gethostname(), os.getpid())).rowcount
+    conn.commit()
+    return renewed
+
+
+def _keep_lease(conn, generators, key):
+    """Cached generator for key, heartbeating it when due; a new lease (and
+    generator) if there was none or the old lease was taken over"""
+    generator = generators.get(key)
+    if generator is not None and time.monotonic() - generator.heartbeat_at > HEARTBEAT_SECONDS:
+        if heartbeat(conn, generator.worker_id):
+            generator.heartbeat_at = time.monotonic()
+        else:
+            generators.pop(key, None)
+            generator = None
+    if generator is None:
+        generator = generators.setdefault(key, IdGenerator(lease_worker_id(conn)))
+    return generator
+
+
+def init_app(app):
+    app.extensions['id_generators'] = {}
+
+
+_process_generators = {}
+
+
+def process_generator(conn):
+    """Generator for code running outside a request (job handlers, CLIs):
+    one lease per process and database, kept alive like get_id_generator.
+    Must be called outside a transaction."""
+    key = (conn.execute('PRAGMA database_list').fetchone()[2], os.getpid())
+    return _keep_lease(conn, _process_generators, key)
+
+
+def get_id_generator():
+    """Generator for this process and database, leasing a worker ID on first use.
+
+    Keyed by pid as well, so workers forked from a preloaded master each
+    lease their own worker ID.
+    """
+    database = current_database()
+    key = (database, os.getpid())
+    generators = current_app.extensions['id_generators']
+    generator = generators.get(key)
+
+    if generator is None or time.monotonic() - generator.heartbeat_at > HEARTBEAT_SECONDS:
+        conn = connect(database)
+        try:
+            generator = _keep_lease(conn, generators, key)
+        finally:
+            conn.close()
+    return generator
+
+
+# =============================================================================
+# BACKFILL OF LEGACY CODES
+# =============================================================================
+
+def backfill(conn, generator, dry_run=False, batch_size=1000):
+    """Rewrite legacy codes (date/phone/timestamp based) into generated IDs.
+
+    New codes keep each row's created_at as their timestamp so the ordering
+    survives, and every rewrite is recorded in id_aliases so printed legacy
+    codes can still be looked up. Returns {entity: rows rewritten}.
+    """
+    counts = {}
+    for entity, (table, column, prefix) in ID_COLUMNS.items():
+        rows = conn.execute(f"""
+            SELECT id, {column}, CAST(strftime('%s', COALESCE(created_at, CURRENT_TIMESTAMP)) AS INTEGER) * 1000
+            FROM {table} ORDER BY created_at, id
+        """).fetchall()
+        pending = [(row_id, code, created_ms) for row_id, code, created_ms in rows
+                   if not is_generated(code, prefix)]
+        counts[entity] = len(pending)
+        if dry_run or not pending:
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            at_ms, in_ms = EPOCH_MS, 0
+            for start in range(0, len(pending), batch_size):
+                batch = []
+                for row_id, legacy, created_ms in pending[start:start + batch_size]:
+                    # Rows older than the epoch share its first milliseconds;
+                    # rows sharing a created_at second share a millisecond,
+                    # moving on once its 4096 sequence values are used up
+                    created_ms = max(created_ms, EPOCH_MS)
+                    if created_ms > at_ms:
+                        at_ms, in_ms = created_ms, 0
+                    elif in_ms > SEQUENCE_MASK:
+                        at_ms, in_ms = at_ms + 1, 0
+                    batch.append((row_id, legacy, generator.next_id(prefix, at_ms=at_ms, sequence=in_ms)))
+                    in_ms += 1
+                conn.executemany(f'UPDATE {table} SET {column} = ? WHERE id = ?',
+                                 [(new_code, row_id) for row_id, _, new_code in batch])
+                conn.executemany("""
+                    INSERT OR REPLACE INTO id_aliases (entity, legacy_id, new_id) VALUES (?, ?, ?)
+                """, [(entity, legacy, new_code) for _, legacy, new_code in batch])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return counts
+
+
+def resolve_alias(conn, entity, code):
+    """Current code for a (possibly legacy) code"""
+    row = conn.execute('SELECT new_id FROM id_aliases WHERE entity = ? AND legacy_id = ?',
+                       (entity, code)).fetchone()
+    return row[0] if row else code
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='AyurSutra ID maintenance')
+    parser.add_argument('command', choices=['backfill'])
+    parser.add_argument('--database', default='ayursutra.db')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+
+    conn = connect(args.database)
+    try:
+        generator = IdGenerator(lease_worker_id(conn))
+        counts = backfill(conn, generator, dry_run=args.dry_run)
+    except sqlite3.OperationalError as e:
+        print(f"❌ {e} (run the app once so migrations create the ID tables)")
+        return 1
+    finally:
+        conn.close()
+
+    verb = 'would rewrite' if args.dry_run else 'rewrote'
+    for entity, count in counts.items():
+        print(f"✅ {entity}: {verb} {count} legacy code(s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
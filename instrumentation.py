@@ -0,0 +1,379 @@
+"""
+AyurSutra - Request Profiling & Slow-Query Instrumentation
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+Pooled connections are opened with InstrumentedConnection, whose cursors
+time every statement and count the rows fetched. Figures are added up per
+request in a context variable and folded into the shared histograms once,
+at teardown, so a statement costs two clock reads and a few additions and
+never takes a lock.
+
+Recorded per endpoint: latency histogram (p50/p95/p99 derived from the
+buckets), statements per request, time in SQL and rows fetched; per
+template: render time. Statements slower than SLOW_QUERY_MS are logged to
+the 'ayursutra.slow_query' logger with their bound SQL and query plan.
+
+Exposed as Prometheus text on /admin/metrics and, when SERVER_TIMING is on,
+as a Server-Timing header on every response.
+"""
+
+import contextvars
+import logging
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from flask import before_render_template, current_app, request, session, template_rendered
+
+logger = logging.getLogger('ayursutra.slow_query')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Module level so the per-statement path never needs an app context
+_settings = {'slow_query_seconds': 0.2, 'metrics': None}
+_current = contextvars.ContextVar('ayursutra_request_stats', default=None)
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'query_seconds', 'rows', 'template_seconds', 'template_started',
+                 'status')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.status = 200
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.rows = 0
+        self.template_seconds = 0.0
+        self.template_started = None
+
+
+# =============================================================================
+# STATEMENT TIMING
+# =============================================================================
+
+def _literal(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, bytes):
+        return f"X'{value.hex()}'"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def bind(sql, parameters):
+    """SQL with the parameters inlined as literals (for logs only)"""
+    if isinstance(parameters, dict):
+        return re.sub(r':(\w+)', lambda m: _literal(parameters.get(m.group(1))), sql)
+    values = iter(parameters or ())
+    return re.sub(r'\?', lambda m: _literal(next(values, None)), sql)
+
+
+def _log_slow(conn, sql, parameters, seconds):
+    statement = ' '.join(sql.split())
+    plan = []
+    if statement.upper().startswith(_EXPLAINABLE):
+        try:
+            # Base-class execute: the EXPLAIN itself is not instrumented
+            plan = [row[3] for row in sqlite3.Connection.execute(
+                conn, 'EXPLAIN QUERY PLAN ' + sql, parameters or ())]
+        except sqlite3.Error:
+            pass
+    entry = {
+        'ms': round(seconds * 1000, 2),
+        'sql': bind(statement, parameters),
+        'plan': plan,
+        'endpoint': request.endpoint if request else None,
+        'at': time.time(),
+    }
+    metrics = _settings['metrics']
+    if metrics is not None:
+        metrics.record_slow(entry)
+    logger.warning('slow query (%.1f ms) %s\n    %s', entry['ms'], entry['sql'], '\n    '.join(plan))
+
+
+def _record(cursor, sql, parameters, seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += seconds
+    if seconds >= _settings['slow_query_seconds']:
+        _log_slow(cursor.connection, sql, parameters, seconds)
+
+
+def _count_rows(count):
+    stats = _current.get()
+    if stats is not None:
+        stats.rows += count
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times execute calls and counts fetched rows"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(self, sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(self, sql, None, time.perf_counter() - started)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            _count_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        _count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        _count_rows(len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        _count_rows(1)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors (including conn.execute) are instrumented"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# =============================================================================
+# METRICS REGISTRY
+# =============================================================================
+
+class Histogram:
+    """Fixed-bucket histogram; quantiles are interpolated within a bucket"""
+
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.bounds[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            running += count
+            yield bound, running
+
+
+class Metrics:
+    def __init__(self, slow_log_size=50):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.query_counts = {}
+        self.templates = {}
+        self.requests = {}           # (endpoint, status) -> count
+        self.query_seconds = {}
+        self.rows = {}
+        self.slow_queries = 0
+        self.recent_slow = deque(maxlen=slow_log_size)
+
+    def record_request(self, endpoint, status, stats, seconds):
+        with self._lock:
+            self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.query_counts.setdefault(endpoint, Histogram(QUERY_COUNT_BUCKETS)).observe(stats.queries)
+            key = (endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.query_seconds[endpoint] = self.query_seconds.get(endpoint, 0.0) + stats.query_seconds
+            self.rows[endpoint] = self.rows.get(endpoint, 0) + stats.rows
+
+    def record_template(self, name, seconds):
+        with self._lock:
+            self.templates.setdefault(name, Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def record_slow(self, entry):
+        with self._lock:
+            self.slow_queries += 1
+            self.recent_slow.append(entry)
+
+    def slow_log(self):
+        with self._lock:
+            return list(self.recent_slow)
+
+    def prometheus(self, extra_gauges=()):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            _histograms(lines, 'ayursutra_request_duration_seconds', 'Request latency by endpoint',
+                        'endpoint', self.latency)
+            lines.append('# HELP ayursutra_request_duration_quantile_seconds Latency quantiles from the histogram buckets')
+            lines.append('# TYPE ayursutra_request_duration_quantile_seconds gauge')
+            for endpoint, histogram in sorted(self.latency.items()):
+                for q in QUANTILES:
+                    lines.append(f'ayursutra_request_duration_quantile_seconds'
+                                 f'{{endpoint="{_escape(endpoint)}",quantile="{q}"}} {histogram.quantile(q):.6f}')
+            _histograms(lines, 'ayursutra_request_queries', 'SQL statements per request',
+                        'endpoint', self.query_counts)
+            _histograms(lines, 'ayursutra_template_render_seconds',
+                        'Template render time (streamed pages include their row reads)',
+                        'template', self.templates)
+            _counters(lines, 'ayursutra_requests_total', 'Requests by endpoint and status',
+                      {f'endpoint="{_escape(e)}",status="{s}"': n for (e, s), n in self.requests.items()})
+            _counters(lines, 'ayursutra_request_query_seconds_total', 'Time spent in SQL by endpoint',
+                      {f'endpoint="{_escape(e)}"': v for e, v in self.query_seconds.items()})
+            _counters(lines, 'ayursutra_request_rows_total', 'Rows fetched by endpoint',
+                      {f'endpoint="{_escape(e)}"': v for e, v in self.rows.items()})
+            _counters(lines, 'ayursutra_slow_queries_total', 'Statements slower than SLOW_QUERY_MS',
+                      {'': self.slow_queries})
+        for name, help_text, samples in extra_gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples.items():
+                lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histograms(lines, name, help_text, label, histograms):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for key, histogram in sorted(histograms.items()):
+        labels = f'{label}="{_escape(key)}"'
+        for bound, running in histogram.cumulative():
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {running}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.total:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+
+def _counters(lines, name, help_text, samples):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} counter')
+    for labels, value in sorted(samples.items()):
+        value = f'{value:.6f}' if isinstance(value, float) else value
+        lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+
+
+# =============================================================================
+# FLASK INTEGRATION
+# =============================================================================
+
+def _before_request():
+    _current.set(RequestStats())
+
+
+def _after_request(response):
+    stats = _current.get()
+    if stats is None:
+        return response
+    stats.status = response.status_code
+    if current_app.config['SERVER_TIMING']:
+        # Streamed pages send headers before their rows are read, so for
+        # those this covers the work done up to the first byte
+        total = (time.perf_counter() - stats.started) * 1000
+        response.headers['Server-Timing'] = (
+            f'db;dur={stats.query_seconds * 1000:.1f};desc="{stats.queries} queries, {stats.rows} rows", '
+            f'tpl;dur={stats.template_seconds * 1000:.1f}, total;dur={total:.1f}')
+    return response
+
+
+def _teardown_request(exception=None):
+    stats = _current.get()
+    if stats is None:
+        return
+    _current.set(None)
+    get_metrics().record_request(request.endpoint or 'unmatched', 500 if exception else stats.status,
+                                 stats, time.perf_counter() - stats.started)
+
+
+def _template_started(sender, template, context, **extra):
+    stats = _current.get()
+    if stats is not None:
+        stats.template_started = time.perf_counter()
+
+
+def _template_finished(sender, template, context, **extra):
+    stats = _current.get()
+    if stats is None or stats.template_started is None:
+        return
+    seconds = time.perf_counter() - stats.template_started
+    stats.template_started = None
+    stats.template_seconds += seconds
+    get_metrics().record_template(template.name or 'inline', seconds)
+
+
+def init_app(app):
+    """Instrument pooled connections and record per-request metrics.
+
+    Must run before the first get_db() so pools use InstrumentedConnection.
+    """
+    app.config.setdefault('INSTRUMENTATION', True)
+    app.config.setdefault('SLOW_QUERY_MS', 200)
+    app.config.setdefault('SERVER_TIMING', False)
+    app.config.setdefault('METRICS_TOKEN', None)
+    if not app.config['INSTRUMENTATION']:
+        return
+
+    _settings['slow_query_seconds'] = app.config['SLOW_QUERY_MS'] / 1000
+    app.config['DB_CONNECTION_FACTORY'] = InstrumentedConnection
+    app.extensions['metrics'] = _settings['metrics'] = Metrics()
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+
+def get_metrics():
+    return current_app.extensions['metrics']
+
+
+def metrics_authorized():
+    """Admin session, or 'Authorization: Bearer <METRICS_TOKEN>' for scrapers"""
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') == f'Bearer {token}':
+        return True
+    return session.get('user_role') == 'admin'
@@ -0,0 +1,212 @@
+"""
+AyurSutra - Inventory Consumption Engine
+Aditya Mastwal - Billing & Inventory Management
+
+therapy_consumables lists what one session of each therapy uses (oil in
+ml, disposable sheets, ...). When a session is completed its consumables
+are deducted set-based: one conditional UPDATE over inventory for the whole
+batch, then one INSERT ... SELECT into stock_usage, both in the caller's
+write transaction. A deduction only applies when stock covers it, so stock
+never goes negative; anything that could not be deducted stays pending and
+is picked up by the end-of-day reconcile() once the item is restocked.
+
+stock_usage rows carry the appointment_id, which also makes consumption
+idempotent: a session is never charged twice for the same item.
+
+Usage: python inventory.py reconcile [--date YYYY-MM-DD] [--database PATH]
+"""
+
+import argparse
+import json
+import sys
+from collections import namedtuple
+from datetime import date
+
+from database import connect
+
+CONSUMABLES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS therapy_consumables (
+        therapy_id INTEGER NOT NULL,
+        inventory_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL CHECK (quantity > 0),
+        PRIMARY KEY (therapy_id, inventory_id),
+        FOREIGN KEY (therapy_id) REFERENCES therapies (id),
+        FOREIGN KEY (inventory_id) REFERENCES inventory (id)
+    ) WITHOUT ROWID
+"""
+
+Shortage = namedtuple('Shortage', 'inventory_id item_name unit needed in_stock')
+Consumption = namedtuple('Consumption', 'deducted shortages')
+
+# Consumables of the given completed appointments not yet in stock_usage
+_PENDING_CTE = """
+    WITH pending AS (
+        SELECT a.id AS appointment_id, c.inventory_id, c.quantity,
+               a.appointment_date || ' ' || a.end_time AS used_at,
+               COALESCE(?, t.user_id) AS used_by
+        FROM json_each(?) j
+        JOIN appointments a ON a.id = j.value AND a.status = 'completed'
+        JOIN therapists t ON t.id = a.therapist_id
+        JOIN therapy_consumables c ON c.therapy_id = a.therapy_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM stock_usage u
+            WHERE u.appointment_id = a.id AND u.inventory_id = c.inventory_id
+        )
+    ), needed AS (
+        SELECT inventory_id, SUM(quantity) AS total FROM pending GROUP BY inventory_id
+    )
+"""
+
+
+def seed_default_consumables(conn):
+    """Derive consumables from therapies.requires_oil / oil_quantity_ml.
+
+    Oil comes from the first oil item stocked in ml; every session also
+    uses one disposable sheet if that item exists. Existing entries are
+    left alone.
+    """
+    conn.execute("""
+        INSERT OR IGNORE INTO therapy_consumables (therapy_id, inventory_id, quantity)
+        SELECT th.id, i.id, th.oil_quantity_ml
+        FROM therapies th
+        JOIN (SELECT id FROM inventory WHERE item_type = 'oil' AND unit = 'ml' ORDER BY id LIMIT 1) i
+        WHERE th.requires_oil = 1 AND th.oil_quantity_ml > 0
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO therapy_consumables (therapy_id, inventory_id, quantity)
+        SELECT th.id, i.id, 1
+        FROM therapies th
+        JOIN (SELECT id FROM inventory WHERE item_name = 'Disposable Sheets' ORDER BY id LIMIT 1) i
+    """)
+
+
+def consume(conn, appointment_ids, used_by=None):
+    """Deduct the consumables of completed appointments (no commit).
+
+    Must run inside the caller's write transaction. An item is deducted for
+    the whole batch or, if stock does not cover the batch total, not at all
+    and reported as a Shortage. Returns Consumption({inventory_id: qty}, [Shortage]).
+    """
+    if not conn.in_transaction:
+        raise RuntimeError('consume() must run inside a write transaction')
+    ids = json.dumps([int(appointment_id) for appointment_id in appointment_ids])
+    needs = conn.execute(_PENDING_CTE + """
+        SELECT i.id, i.item_name, i.unit, needed.total, i.current_stock
+        FROM needed JOIN inventory i ON i.id = needed.inventory_id
+        ORDER BY i.item_name
+    """, (used_by, ids)).fetchall()
+    if not needs:
+        return Consumption({}, [])
+
+    # The stock condition lives in the UPDATE itself, so the check and the
+    # deduction cannot be separated by another writer
+    deducted_ids = {row[0] for row in conn.execute(_PENDING_CTE + """
+        UPDATE inventory
+        SET current_stock = current_stock - needed.total, last_updated = CURRENT_TIMESTAMP
+        FROM needed
+        WHERE inventory.id = needed.inventory_id AND inventory.current_stock >= needed.total
+        RETURNING inventory.id
+    """, (used_by, ids))}
+
+    if deducted_ids:
+        conn.execute("""
+            INSERT INTO stock_usage (inventory_id, appointment_id, quantity_used, usage_date, used_by)
+        """ + _PENDING_CTE + """
+            SELECT inventory_id, appointment_id, quantity, used_at, used_by
+            FROM pending
+            WHERE inventory_id IN (SELECT value FROM json_each(?))
+        """, (used_by, ids, json.dumps(sorted(deducted_ids))))
+
+    deducted = {row[0]: row[3] for row in needs if row[0] in deducted_ids}
+    shortages = [Shortage(*row) for row in needs if row[0] not in deducted_ids]
+    return Consumption(deducted, shortages)
+
+
+def reconcile(conn, day=None):
+    """End-of-day pass: charge every completed session of `day` (default
+    today) that still has consumables pending, in one transaction"""
+    day = day or date.today().isoformat()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        ids = [row[0] for row in conn.execute("""
+            SELECT id FROM appointments WHERE appointment_date = ? AND status = 'completed'
+        """, (day,))]
+        result = consume(conn, ids)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(ids), result
+
+
+def apply_stock(conn, item_id, new_stock, used_by):
+    """Set an item's stock level inside the caller's write transaction (no
+    commit), logging any decrease as usage. Returns the previous level, or
+    None if the item does not exist."""
+    if not conn.in_transaction:
+        raise RuntimeError('apply_stock() must run inside a write transaction')
+    row = conn.execute('SELECT current_stock FROM inventory WHERE id = ?', (item_id,)).fetchone()
+    if row is None:
+        return None
+    conn.execute("""
+        UPDATE inventory SET current_stock = ?, last_updated = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, (new_stock, item_id))
+    if new_stock < row[0]:
+        conn.execute("""
+            INSERT INTO stock_usage (inventory_id, quantity_used, used_by)
+            VALUES (?, ?, ?)
+        """, (item_id, row[0] - new_stock, used_by))
+    return row[0]
+
+
+def set_stock(conn, item_id, new_stock, used_by):
+    """apply_stock in its own transaction.
+
+    Read and write happen under BEGIN IMMEDIATE, so concurrent updates are
+    serialized instead of one silently overwriting the other.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        previous = apply_stock(conn, item_id, new_stock, used_by)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return previous
+
+
+def stock_levels(conn, start_date, end_date):
+    """Every item's stock, alert level and usage between two dates
+    (inclusive, from usage_daily), for group reports"""
+    return conn.execute("""
+        SELECT i.item_name, i.item_type, i.unit, i.current_stock, i.min_stock_alert,
+               COALESCE((SELECT SUM(u.quantity) FROM usage_daily u
+                         WHERE u.inventory_id = i.id AND u.day BETWEEN ? AND ?), 0)
+        FROM inventory i
+        ORDER BY i.item_name
+    """, (start_date, end_date)).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Charge pending therapy consumables to inventory')
+    parser.add_argument('command', choices=['reconcile'])
+    parser.add_argument('--date', default=date.today().isoformat())
+    parser.add_argument('--database', default='ayursutra.db')
+    args = parser.parse_args(argv)
+
+    conn = connect(args.database)
+    try:
+        sessions, result = reconcile(conn, args.date)
+    finally:
+        conn.close()
+
+    print(f"✅ {args.date}: {sessions} completed session(s), {len(result.deducted)} item(s) deducted")
+    for shortage in result.shortages:
+        print(f"❌ {shortage.item_name}: need {shortage.needed} {shortage.unit}, "
+              f"{shortage.in_stock} in stock")
+    return 1 if result.shortages else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
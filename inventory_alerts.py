@@ -0,0 +1,239 @@
+"""
+AyurSutra - Inventory Alerts
+Aditya Mastwal - Billing & Inventory Management
+
+inventory_alerts holds one row per (item, kind) that currently needs
+attention: low_stock, near_threshold (within twice the alert level),
+expiring (within expiry_days) and stockout_projected (stock lasts fewer
+than stockout_days at the recent consumption rate). Triggers on inventory
+keep an item's alerts current whenever its stock, threshold or expiry date
+changes, so the dashboard reads only this small table.
+
+Consumption is aggregated per item and day into usage_daily by a trigger on
+stock_usage. inventory_usage_rate keeps each item's total over the last
+rate_window_days; roll_forward() moves that window a day at a time by
+adding the days that entered it and subtracting the days that left it, then
+refreshes the date-dependent alerts for every item.
+
+Usage: python inventory_alerts.py roll [--database PATH]
+"""
+
+import argparse
+import sys
+from datetime import date, timedelta
+
+from database import connect
+
+DEFAULT_SETTINGS = {
+    'expiry_days': 30,
+    'stockout_days': 14,
+    'rate_window_days': 28,
+}
+
+TABLES_SQL = [
+    """CREATE TABLE IF NOT EXISTS inventory_alert_settings (
+           name TEXT PRIMARY KEY,
+           value NOT NULL
+       ) WITHOUT ROWID""",
+    *(f"INSERT OR IGNORE INTO inventory_alert_settings (name, value) VALUES ('{name}', {value})"
+      for name, value in DEFAULT_SETTINGS.items()),
+    """CREATE TABLE IF NOT EXISTS usage_daily (
+           inventory_id INTEGER NOT NULL,
+           day DATE NOT NULL,
+           quantity INTEGER NOT NULL DEFAULT 0,
+           PRIMARY KEY (inventory_id, day)
+       ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS inventory_usage_rate (
+           inventory_id INTEGER PRIMARY KEY,
+           window_total INTEGER NOT NULL DEFAULT 0
+       )""",
+    """CREATE TABLE IF NOT EXISTS inventory_alerts (
+           inventory_id INTEGER NOT NULL,
+           kind TEXT NOT NULL CHECK (kind IN ('low_stock', 'near_threshold', 'expiring', 'stockout_projected')),
+           severity TEXT NOT NULL,
+           value REAL,
+           raised_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (inventory_id, kind)
+       ) WITHOUT ROWID""",
+    # value: stock level, days to expiry or projected days of stock left
+    """CREATE VIEW IF NOT EXISTS inventory_alert_candidates AS
+       SELECT i.id AS inventory_id, 'low_stock' AS kind, 'danger' AS severity, i.current_stock AS value
+       FROM inventory i
+       WHERE i.current_stock <= i.min_stock_alert
+       UNION ALL
+       SELECT i.id, 'near_threshold', 'warning', i.current_stock
+       FROM inventory i
+       WHERE i.current_stock > i.min_stock_alert AND i.current_stock <= i.min_stock_alert * 2
+       UNION ALL
+       SELECT i.id, 'expiring',
+              CASE WHEN i.expiry_date <= date('now') THEN 'danger' ELSE 'warning' END,
+              julianday(i.expiry_date) - julianday(date('now'))
+       FROM inventory i
+       JOIN inventory_alert_settings s ON s.name = 'expiry_days'
+       WHERE i.expiry_date IS NOT NULL AND i.expiry_date <= date('now', '+' || s.value || ' days')
+       UNION ALL
+       SELECT i.id, 'stockout_projected', 'warning',
+              round(i.current_stock * w.value * 1.0 / r.window_total, 1)
+       FROM inventory i
+       JOIN inventory_usage_rate r ON r.inventory_id = i.id
+       JOIN inventory_alert_settings w ON w.name = 'rate_window_days'
+       JOIN inventory_alert_settings h ON h.name = 'stockout_days'
+       WHERE r.window_total > 0 AND i.current_stock * w.value * 1.0 / r.window_total <= h.value""",
+]
+
+
+def _refresh_sql(where):
+    """Statements re-deriving the alerts of the items matched by `where`"""
+    return [
+        f"""DELETE FROM inventory_alerts
+            WHERE {where.format(column='inventory_id')}
+              AND (inventory_id, kind) NOT IN (
+                  SELECT inventory_id, kind FROM inventory_alert_candidates
+                  WHERE {where.format(column='inventory_id')})""",
+        f"""INSERT INTO inventory_alerts (inventory_id, kind, severity, value)
+            SELECT inventory_id, kind, severity, value FROM inventory_alert_candidates
+            WHERE {where.format(column='inventory_id')}
+            ON CONFLICT (inventory_id, kind) DO UPDATE SET
+                severity = excluded.severity, value = excluded.value""",
+    ]
+
+
+_ITEM_REFRESH = '\n'.join(sql + ';' for sql in _refresh_sql('{column} = NEW.id'))
+
+TRIGGERS_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_inventory_alerts_insert AFTER INSERT ON inventory
+        BEGIN {_ITEM_REFRESH} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_inventory_alerts_update
+        AFTER UPDATE OF current_stock, min_stock_alert, expiry_date ON inventory
+        BEGIN {_ITEM_REFRESH} END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_inventory_alerts_delete AFTER DELETE ON inventory BEGIN
+           DELETE FROM inventory_alerts WHERE inventory_id = OLD.id;
+           DELETE FROM inventory_usage_rate WHERE inventory_id = OLD.id;
+       END""",
+    # Usage lands in its day bucket; usage dated inside the already rolled
+    # window (e.g. a late reconciliation) is added to the window at once
+    """CREATE TRIGGER IF NOT EXISTS trg_usage_daily_insert AFTER INSERT ON stock_usage BEGIN
+           INSERT INTO usage_daily (inventory_id, day, quantity)
+           VALUES (NEW.inventory_id, date(NEW.usage_date), NEW.quantity_used)
+           ON CONFLICT (inventory_id, day) DO UPDATE SET quantity = quantity + excluded.quantity;
+           INSERT INTO inventory_usage_rate (inventory_id, window_total)
+           SELECT NEW.inventory_id, NEW.quantity_used
+           FROM inventory_alert_settings t
+           JOIN inventory_alert_settings w ON w.name = 'rate_window_days'
+           WHERE t.name = 'rate_computed_through'
+             AND date(NEW.usage_date) <= t.value
+             AND date(NEW.usage_date) > date(t.value, '-' || w.value || ' days')
+           ON CONFLICT (inventory_id) DO UPDATE SET window_total = window_total + excluded.window_total;
+       END""",
+]
+
+
+def backfill_usage(conn):
+    """Bucket existing stock_usage into usage_daily (used by the migration)"""
+    conn.execute('DELETE FROM usage_daily')
+    conn.execute("""
+        INSERT INTO usage_daily (inventory_id, day, quantity)
+        SELECT inventory_id, date(usage_date), SUM(quantity_used)
+        FROM stock_usage
+        GROUP BY inventory_id, date(usage_date)
+    """)
+
+
+def refresh_all(conn):
+    """Re-derive every item's alerts (date-based kinds change without writes)"""
+    for sql in _refresh_sql('1 = 1'):
+        conn.execute(sql)
+
+
+def _setting(conn, name):
+    row = conn.execute('SELECT value FROM inventory_alert_settings WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+
+def roll_window(conn, through=None):
+    """Write unit form of roll_forward (no begin/commit), for writer.write"""
+    through = through or (date.today() - timedelta(days=1)).isoformat()
+    previous = _setting(conn, 'rate_computed_through')
+    if previous is not None and previous >= through:
+        return False
+
+    window = f"-{int(_setting(conn, 'rate_window_days'))} days"
+    conn.execute('INSERT OR IGNORE INTO inventory_usage_rate (inventory_id) SELECT id FROM inventory')
+    if previous is None:
+        # First roll: sum the whole window once
+        conn.execute("""
+            UPDATE inventory_usage_rate SET window_total = COALESCE((
+                SELECT SUM(quantity) FROM usage_daily u
+                WHERE u.inventory_id = inventory_usage_rate.inventory_id
+                  AND u.day > date(?, ?) AND u.day <= ?), 0)
+        """, (through, window, through))
+    else:
+        # window(new) = window(old) + days entering - days leaving
+        conn.execute("""
+            UPDATE inventory_usage_rate SET window_total = window_total
+                + COALESCE((SELECT SUM(quantity) FROM usage_daily u
+                            WHERE u.inventory_id = inventory_usage_rate.inventory_id
+                              AND u.day > ? AND u.day <= ?), 0)
+                - COALESCE((SELECT SUM(quantity) FROM usage_daily u
+                            WHERE u.inventory_id = inventory_usage_rate.inventory_id
+                              AND u.day > date(?, ?) AND u.day <= date(?, ?)), 0)
+        """, (previous, through, previous, window, through, window))
+    conn.execute("""
+        INSERT INTO inventory_alert_settings (name, value) VALUES ('rate_computed_through', ?)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+    """, (through,))
+    refresh_all(conn)
+    return True
+
+
+def roll_forward(conn, through=None):
+    """Advance the consumption window to `through` (default yesterday, the
+    last complete day) and refresh all alerts. Returns False if already current."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rolled = roll_window(conn, through)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rolled
+
+
+def is_due(conn):
+    """True if the window has not been rolled through yesterday yet"""
+    previous = _setting(conn, 'rate_computed_through')
+    return previous is None or previous < (date.today() - timedelta(days=1)).isoformat()
+
+
+def active_alerts(conn):
+    """Current alerts with their item, most severe first"""
+    return conn.execute("""
+        SELECT a.inventory_id, i.item_name, i.item_type, a.kind, a.severity, a.value,
+               i.current_stock, i.unit, i.min_stock_alert, i.expiry_date, a.raised_at
+        FROM inventory_alerts a
+        JOIN inventory i ON i.id = a.inventory_id
+        ORDER BY CASE a.severity WHEN 'danger' THEN 0 ELSE 1 END, i.item_name, a.kind
+    """).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Roll inventory consumption rates and alerts forward')
+    parser.add_argument('command', choices=['roll'])
+    parser.add_argument('--through', help='last complete day to include (default: yesterday)')
+    parser.add_argument('--database', default='ayursutra.db')
+    args = parser.parse_args(argv)
+
+    conn = connect(args.database)
+    try:
+        rolled = roll_forward(conn, args.through)
+        alerts = active_alerts(conn)
+    finally:
+        conn.close()
+
+    print(f"✅ consumption window {'rolled forward' if rolled else 'already current'}, "
+          f"{len(alerts)} active alert(s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+AyurSutra - Invoicing Engine
+Aditya Mastwal - Billing & Inventory Management
+
+unbilled_sessions is the work queue: triggers add an appointment when it
+is completed and drop it again if it is reopened, deleted or invoiced by
+hand, so finding what to bill never scans the appointment history.
+
+Sessions are billed per patient per course: one invoice for all of a
+patient's unbilled sessions outside a course, and one per course once the
+course has no scheduled session left (or, at a month-end close, for what
+has been completed so far). Course invoices earn a discount by the number
+of sessions on them (COURSE_DISCOUNTS). Each session is priced at its
+therapy's cost and recorded in invoice_lines, whose primary key is the
+appointment, so no session can be billed twice.
+
+Grouping, pricing and discounts are one GROUP BY; the invoices of a batch
+get a block of generated INV codes and are written with one executemany
+and one INSERT ... SELECT for their lines. add_progress_note bills in the
+completing transaction (fast path); run() is the nightly catch-up, which
+commits per batch of patients and can simply be run again after a crash.
+
+Usage: python invoicing.py run [--through YYYY-MM-DD] [--month-end] [--database PATH]
+"""
+
+import argparse
+import json
+import sys
+from collections import namedtuple
+from datetime import date
+
+from database import connect
+from idgen import process_generator
+
+# (minimum sessions on a course invoice, discount percent), highest first
+COURSE_DISCOUNTS = ((21, 15), (14, 10), (7, 5))
+BATCH_PATIENTS = 2000
+
+TABLES_SQL = [
+    "ALTER TABLE billing ADD COLUMN course_id INTEGER REFERENCES treatment_courses (id)",
+    """CREATE TABLE IF NOT EXISTS invoice_lines (
+           appointment_id INTEGER PRIMARY KEY,
+           billing_id INTEGER NOT NULL,
+           therapy_id INTEGER NOT NULL,
+           amount DECIMAL(10,2) NOT NULL,
+           FOREIGN KEY (appointment_id) REFERENCES appointments (id),
+           FOREIGN KEY (billing_id) REFERENCES billing (id),
+           FOREIGN KEY (therapy_id) REFERENCES therapies (id)
+       )""",
+    "CREATE INDEX IF NOT EXISTS idx_invoice_lines_billing ON invoice_lines (billing_id)",
+    """CREATE TABLE IF NOT EXISTS unbilled_sessions (
+           appointment_id INTEGER PRIMARY KEY,
+           patient_id INTEGER NOT NULL,
+           course_id INTEGER,
+           completed_on DATE NOT NULL
+       )""",
+    "CREATE INDEX IF NOT EXISTS idx_unbilled_sessions_patient ON unbilled_sessions (patient_id, course_id)",
+]
+
+# Completed and not on any invoice, its own or a hand-made one
+_QUEUE_NEW = """
+    INSERT OR REPLACE INTO unbilled_sessions (appointment_id, patient_id, course_id, completed_on)
+    SELECT NEW.id, NEW.patient_id, NEW.course_id, NEW.appointment_date
+    WHERE NEW.status = 'completed'
+      AND NOT EXISTS (SELECT 1 FROM invoice_lines l WHERE l.appointment_id = NEW.id)
+      AND NOT EXISTS (SELECT 1 FROM billing b WHERE b.appointment_id = NEW.id);
+"""
+
+TRIGGERS_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_unbilled_appointment_insert AFTER INSERT ON appointments
+        WHEN NEW.status = 'completed'
+        BEGIN {_QUEUE_NEW} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_unbilled_appointment_update
+        AFTER UPDATE OF status, patient_id, course_id, appointment_date ON appointments
+        BEGIN
+            DELETE FROM unbilled_sessions WHERE appointment_id = OLD.id;
+            {_QUEUE_NEW}
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_unbilled_appointment_delete AFTER DELETE ON appointments
+        BEGIN DELETE FROM unbilled_sessions WHERE appointment_id = OLD.id; END""",
+    # A hand-made invoice for one session takes it off the queue
+    """CREATE TRIGGER IF NOT EXISTS trg_unbilled_billing_insert AFTER INSERT ON billing
+        WHEN NEW.appointment_id IS NOT NULL
+        BEGIN DELETE FROM unbilled_sessions WHERE appointment_id = NEW.appointment_id; END""",
+]
+
+
+def backfill_queue(conn):
+    """Queue completed sessions that no invoice refers to yet"""
+    conn.execute("""
+        INSERT OR IGNORE INTO unbilled_sessions (appointment_id, patient_id, course_id, completed_on)
+        SELECT a.id, a.patient_id, a.course_id, a.appointment_date
+        FROM appointments a
+        WHERE a.status = 'completed'
+          AND NOT EXISTS (SELECT 1 FROM billing b WHERE b.appointment_id = a.id)
+          AND NOT EXISTS (SELECT 1 FROM invoice_lines l WHERE l.appointment_id = a.id)
+    """)
+
+
+Invoicing = namedtuple('Invoicing', 'invoices sessions amount')
+
+# Sessions ready to bill among the patients selected by {scope}; a course
+# is billed once nothing in it is still scheduled, unless closing the period
+_READY = """
+    FROM unbilled_sessions u
+    JOIN appointments a ON a.id = u.appointment_id
+    JOIN therapies th ON th.id = a.therapy_id
+    WHERE {scope} AND u.completed_on <= :through
+      AND (u.course_id IS NULL OR :close_courses OR NOT EXISTS (
+          SELECT 1 FROM appointments s WHERE s.course_id = u.course_id AND s.status = 'scheduled'))
+"""
+
+
+def _discount_percent():
+    tiers = ' '.join(f'WHEN COUNT(*) >= {sessions} THEN {percent}' for sessions, percent in COURSE_DISCOUNTS)
+    return f'CASE WHEN u.course_id IS NULL THEN 0 {tiers} ELSE 0 END'
+
+
+_GROUPS_SQL = """
+    SELECT u.patient_id, u.course_id, json_group_array(u.appointment_id),
+           ROUND(SUM(COALESCE(th.cost, 0)), 2), {discount}
+""" + _READY + """
+    GROUP BY u.patient_id, u.course_id
+    ORDER BY u.patient_id, u.course_id
+"""
+
+
+def _bill(conn, generator, scope, params, through, close_courses, created_by):
+    """Invoice every ready session of the patients in `scope` (no commit)"""
+    params = dict(params, through=through, close_courses=int(close_courses))
+    groups = conn.execute(_GROUPS_SQL.format(discount=_discount_percent(), scope=scope), params).fetchall()
+    if not groups:
+        return Invoicing(0, 0, 0.0)
+
+    rows, lines, sessions = [], [], 0
+    for invoice_id, (patient_id, course_id, appointment_ids, total, percent) in zip(
+            generator.reserve('INV', len(groups)), groups):
+        appointment_ids = json.loads(appointment_ids)
+        discount = round(total * percent / 100, 2)
+        # A single-session invoice keeps the appointment link the
+        # hand-made ones have, so per-therapy revenue still attributes it
+        rows.append((invoice_id, patient_id, appointment_ids[0] if len(appointment_ids) == 1 else None,
+                     course_id, total, discount, round(total - discount, 2), created_by))
+        lines.append([invoice_id, appointment_ids])
+        sessions += len(appointment_ids)
+    conn.executemany("""
+        INSERT INTO billing (invoice_id, patient_id, appointment_id, course_id, total_amount,
+                             discount_amount, final_amount, payment_status, created_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?)
+    """, rows)
+
+    lines = json.dumps(lines)
+    conn.execute("""
+        INSERT INTO invoice_lines (appointment_id, billing_id, therapy_id, amount)
+        SELECT a.id, b.id, a.therapy_id, COALESCE(th.cost, 0)
+        FROM json_each(?) j
+        JOIN billing b ON b.invoice_id = json_extract(j.value, '$[0]')
+        JOIN json_each(j.value, '$[1]') s
+        JOIN appointments a ON a.id = s.value
+        JOIN therapies th ON th.id = a.therapy_id
+    """, (lines,))
+    conn.execute("""
+        DELETE FROM unbilled_sessions WHERE appointment_id IN (
+            SELECT s.value FROM json_each(?) j JOIN json_each(j.value, '$[1]') s)
+    """, (lines,))
+    return Invoicing(len(rows), sessions, round(sum(row[6] for row in rows), 2))
+
+
+def invoice_completed(conn, generator, appointment_ids, created_by=None):
+    """Fast path after sessions are completed (no commit).
+
+    Must run inside the caller's write transaction. Bills the patients of
+    the given appointments: their sessions outside a course, and any course
+    this completion finished. Returns Invoicing(invoices, sessions, amount).
+    """
+    if not conn.in_transaction:
+        raise RuntimeError('invoice_completed() must run inside a write transaction')
+    scope = """u.patient_id IN (SELECT patient_id FROM appointments
+                                WHERE id IN (SELECT value FROM json_each(:ids)))"""
+    ids = json.dumps([int(appointment_id) for appointment_id in appointment_ids])
+    return _bill(conn, generator, scope, {'ids': ids}, date.today().isoformat(), False, created_by)
+
+
+def run(conn, generator=None, through=None, close_courses=False, created_by=None, batch_patients=BATCH_PATIENTS):
+    """Catch-up run: bill every ready session completed on or before
+    `through` (default today), one transaction per batch of patients.
+
+    close_courses also bills the completed sessions of courses still in
+    progress (month-end close). Idempotent, so an interrupted run is
+    finished by running it again. Returns Invoicing for the whole run.
+    """
+    generator = generator or process_generator(conn)
+    through = through or date.today().isoformat()
+    totals, after = Invoicing(0, 0, 0.0), 0
+    while True:
+        patients = [row[0] for row in conn.execute("""
+            SELECT DISTINCT patient_id FROM unbilled_sessions WHERE patient_id > ? ORDER BY patient_id LIMIT ?
+        """, (after, batch_patients))]
+        if not patients:
+            return totals
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            batch = _bill(conn, generator, 'u.patient_id BETWEEN :first AND :last',
+                          {'first': patients[0], 'last': patients[-1]}, through, close_courses, created_by)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        totals = Invoicing(totals.invoices + batch.invoices, totals.sessions + batch.sessions,
+                           round(totals.amount + batch.amount, 2))
+        after = patients[-1]
+
+
+def invoice_lines(conn, billing_id):
+    """(appointment_id, appointment_date, therapy_name, amount) on one invoice"""
+    return conn.execute("""
+        SELECT l.appointment_id, a.appointment_date, th.therapy_name, l.amount
+        FROM invoice_lines l
+        JOIN appointments a ON a.id = l.appointment_id
+        JOIN therapies th ON th.id = l.therapy_id
+        WHERE l.billing_id = ?
+        ORDER BY a.appointment_date, a.start_time
+    """, (billing_id,)).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='AyurSutra invoicing')
+    parser.add_argument('command', choices=['run'])
+    parser.add_argument('--through', help='bill sessions completed on or before this day (default today)')
+    parser.add_argument('--month-end', action='store_true', help='also bill courses still in progress')
+    parser.add_argument('--database', default='ayursutra.db')
+    args = parser.parse_args(argv)
+
+    conn = connect(args.database)
+    try:
+        result = run(conn, through=args.through, close_courses=args.month_end)
+    finally:
+        conn.close()
+    print(f"✅ {result.invoices} invoice(s) for {result.sessions} session(s), ₹{result.amount:,.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
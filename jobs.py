@@ -0,0 +1,425 @@
+"""
+AyurSutra - Background Job Queue
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+Deferrable work (data setup, rollup rebuilds, stock reconciliation, bulk
+imports, archival) is recorded in the jobs table by enqueue() and executed
+by worker processes, so Flask request threads only pay for one INSERT.
+
+A worker claims the highest-priority due job with a single UPDATE under
+BEGIN IMMEDIATE and holds it for a lease, renewed by a heartbeat thread
+while the handler runs; a job whose worker died is put back once the lease
+expires. Failed jobs are retried with exponential
+backoff until max_attempts. An idempotency key collapses duplicate
+submissions while a job with that key is still queued or running.
+
+Handlers are registered with @task(name) and called as handler(conn,
+payload); they manage their own transactions and return a JSON-serialisable
+result.
+
+Usage: python jobs.py worker [--processes N] [--once] [--database PATH]
+       python jobs.py enqueue KIND [--payload JSON] [--priority N] [--key KEY]
+       python jobs.py prune [--days N]
+"""
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+
+import archive
+import billing_rollup
+import inventory
+import inventory_alerts
+import invoicing
+import patient_search
+from database import connect
+from default_data import seed_default_data
+from writer import retry_busy
+
+BACKOFF_SECONDS = 10
+MAX_BACKOFF_SECONDS = 3600
+LEASE_SECONDS = 300
+
+# Modules that register further tasks with @task when imported
+TASK_MODULES = ('bulk_io',)
+
+TABLES_SQL = [
+    """CREATE TABLE IF NOT EXISTS jobs (
+           id INTEGER PRIMARY KEY,
+           kind TEXT NOT NULL,
+           payload TEXT NOT NULL DEFAULT '{}',
+           priority INTEGER NOT NULL DEFAULT 0,
+           status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+           idempotency_key TEXT,
+           attempts INTEGER NOT NULL DEFAULT 0,
+           max_attempts INTEGER NOT NULL DEFAULT 3,
+           run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+           locked_by TEXT,
+           locked_until TIMESTAMP,
+           result TEXT,
+           last_error TEXT,
+           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           finished_at TIMESTAMP
+       )""",
+    # Claim order; only queued rows are indexed
+    """CREATE INDEX IF NOT EXISTS idx_jobs_queue
+       ON jobs (priority DESC, run_after, id) WHERE status = 'queued'""",
+    """CREATE INDEX IF NOT EXISTS idx_jobs_lease
+       ON jobs (locked_until) WHERE status = 'running'""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_pending_key
+       ON jobs (idempotency_key) WHERE status IN ('queued', 'running')""",
+    # /admin/jobs counts and prune()
+    """CREATE INDEX IF NOT EXISTS idx_jobs_status_finished
+       ON jobs (status, finished_at)""",
+]
+
+TASKS = {}
+
+
+class UnknownTask(ValueError):
+    """Raised when enqueuing a job kind no handler is registered for"""
+
+
+def task(name):
+    """Register the decorated function as the handler for job kind `name`"""
+    def register(handler):
+        TASKS[name] = handler
+        return handler
+    return register
+
+
+def enqueue(conn, kind, payload=None, priority=0, key=None, max_attempts=3, delay=0):
+    """Queue a job and return its id.
+
+    If a job with the same idempotency key is still queued or running, its
+    id is returned instead. Commits unless the caller already has a
+    transaction open, in which case the job is part of that transaction.
+    """
+    if kind not in TASKS:
+        raise UnknownTask(kind)
+    owns_transaction = not conn.in_transaction
+    row = conn.execute("""
+        INSERT INTO jobs (kind, payload, priority, idempotency_key, max_attempts, run_after)
+        VALUES (?, ?, ?, ?, ?, datetime('now', ?))
+        ON CONFLICT (idempotency_key) WHERE status IN ('queued', 'running') DO NOTHING
+        RETURNING id
+    """, (kind, json.dumps(payload or {}), priority, key, max_attempts, f'+{int(delay)} seconds')).fetchone()
+    if row is None:
+        row = conn.execute("""
+            SELECT id FROM jobs WHERE idempotency_key = ? AND status IN ('queued', 'running')
+        """, (key,)).fetchone()
+    if owns_transaction:
+        conn.commit()
+    return row[0]
+
+
+def job_status(conn, job_id):
+    """The job as a dict, or None if it does not exist"""
+    row = conn.execute("""
+        SELECT id, kind, status, priority, attempts, max_attempts, run_after,
+               result, last_error, created_at, finished_at
+        FROM jobs WHERE id = ?
+    """, (job_id,)).fetchone()
+    if row is None:
+        return None
+    keys = ('id', 'kind', 'status', 'priority', 'attempts', 'max_attempts', 'run_after',
+            'result', 'last_error', 'created_at', 'finished_at')
+    job = dict(zip(keys, row))
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def queue_stats(conn, recent_failures=20):
+    """Job counts per status and the most recent failures"""
+    counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+    failures = conn.execute("""
+        SELECT id, kind, attempts, last_error, finished_at FROM jobs
+        WHERE status = 'failed' ORDER BY finished_at DESC LIMIT ?
+    """, (recent_failures,)).fetchall()
+    return {
+        'counts': {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')},
+        'recent_failures': [dict(zip(('id', 'kind', 'attempts', 'last_error', 'finished_at'), row))
+                            for row in failures],
+    }
+
+
+def prune(conn, days=7):
+    """Delete jobs that finished successfully more than `days` ago"""
+    deleted = conn.execute("""
+        DELETE FROM jobs WHERE status = 'done' AND finished_at < datetime('now', ?)
+    """, (f'-{int(days)} days',)).rowcount
+    conn.commit()
+    return deleted
+
+
+def backoff(attempts):
+    """Seconds before retry number `attempts`, doubling with 25% jitter"""
+    delay = min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+    return delay * (1 + random.random() / 4)
+
+
+class Worker:
+    """Claims and runs jobs one at a time on its own connection"""
+
+    def __init__(self, database, name=None, lease_seconds=LEASE_SECONDS, poll_seconds=1.0):
+        self.database = database
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.conn = connect(database)
+
+    def claim(self):
+        """Lease the next due job; returns (id, kind, payload, attempts, max_attempts) or None"""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs whose worker died go back to the queue (or fail if out of attempts)
+            self.conn.execute("""
+                UPDATE jobs
+                SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                    finished_at = CASE WHEN attempts >= max_attempts THEN CURRENT_TIMESTAMP END,
+                    last_error = 'lease expired', locked_by = NULL, locked_until = NULL
+                WHERE status = 'running' AND locked_until < CURRENT_TIMESTAMP
+            """)
+            job = self.conn.execute("""
+                UPDATE jobs
+                SET status = 'running', attempts = attempts + 1, locked_by = ?,
+                    locked_until = datetime('now', ?)
+                WHERE id = (SELECT id FROM jobs
+                            WHERE status = 'queued' AND run_after <= CURRENT_TIMESTAMP
+                            ORDER BY priority DESC, run_after, id LIMIT 1)
+                RETURNING id, kind, payload, attempts, max_attempts
+            """, (self.name, f'+{self.lease_seconds} seconds')).fetchone()
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return job
+
+    def _keep_lease(self, job_id, done):
+        """Push the job's lease forward until `done` is set, so a long handler
+        (bulk import, archive run, month-end invoicing) is not reclaimed as
+        dead and run a second time while it is still running"""
+        conn = connect(self.database)
+
+        def renew():
+            conn.execute("""
+                UPDATE jobs SET locked_until = datetime('now', ?)
+                WHERE id = ? AND locked_by = ? AND status = 'running'
+            """, (f'+{self.lease_seconds} seconds', job_id, self.name))
+            conn.commit()
+
+        try:
+            while not done.wait(self.lease_seconds / 3):
+                try:
+                    retry_busy(renew, conn)
+                except sqlite3.OperationalError:
+                    pass    # still busy; the lease has two more beats before it runs out
+        finally:
+            conn.close()
+
+    def _finish(self, sql, params):
+        self.conn.execute(sql, params)
+        self.conn.commit()
+
+    def run_one(self):
+        """Run the next due job; returns False if there was none"""
+        # Web workers' group commits hold the write lock briefly; wait them out
+        job = retry_busy(self.claim)
+        if job is None:
+            return False
+        job_id, kind, payload, attempts, max_attempts = job
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._keep_lease, args=(job_id, done),
+                                     name=f'job-{job_id}-lease', daemon=True)
+        heartbeat.start()
+        try:
+            handler = TASKS.get(kind)
+            if handler is None:
+                raise UnknownTask(kind)
+            result = json.dumps(handler(self.conn, json.loads(payload)))
+        except Exception as exc:
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            error = f'{type(exc).__name__}: {exc}'
+            if attempts < max_attempts:
+                finish = ("""
+                    UPDATE jobs SET status = 'queued', last_error = ?, locked_by = NULL,
+                                    locked_until = NULL, run_after = datetime('now', ?)
+                    WHERE id = ? AND locked_by = ?
+                """, (error, f'+{backoff(attempts):.0f} seconds', job_id, self.name))
+            else:
+                finish = ("""
+                    UPDATE jobs SET status = 'failed', last_error = ?, locked_by = NULL,
+                                    locked_until = NULL, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND locked_by = ?
+                """, (error + '\n' + traceback.format_exc(limit=5), job_id, self.name))
+        else:
+            if self.conn.in_transaction:
+                retry_busy(self.conn.commit)
+            finish = ("""
+                UPDATE jobs SET status = 'done', result = ?, locked_by = NULL,
+                                locked_until = NULL, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND locked_by = ?
+            """, (result, job_id, self.name))
+        finally:
+            done.set()
+            heartbeat.join()
+        # A busy error here would otherwise kill the worker loop and leave
+        # the job 'running' until its lease expired
+        retry_busy(lambda: self._finish(*finish), self.conn)
+        return True
+
+    def run_pending(self):
+        """Run jobs until none are due; returns how many ran"""
+        count = 0
+        while self.run_one():
+            count += 1
+        return count
+
+    def run(self, stop):
+        """Poll for jobs until the `stop` event is set"""
+        while not stop.is_set():
+            if not self.run_one():
+                stop.wait(self.poll_seconds)
+        self.conn.close()
+
+
+# -----------------------------------------------------------------------------
+# Built-in tasks
+# -----------------------------------------------------------------------------
+
+@task('setup_default_data')
+def _setup_default_data(conn, payload):
+    seed_default_data(conn)
+
+
+@task('billing_rollup.rebuild')
+def _rebuild_billing_rollup(conn, payload):
+    return {'rows': billing_rollup.rebuild(conn)}
+
+
+@task('patient_search.rebuild')
+def _rebuild_patient_search(conn, payload):
+    conn.execute('BEGIN IMMEDIATE')
+    patient_search.rebuild(conn)
+    conn.commit()
+
+
+@task('inventory.reconcile')
+def _reconcile_inventory(conn, payload):
+    sessions, result = inventory.reconcile(conn, payload.get('date'))
+    return {
+        'sessions': sessions,
+        'deducted': {str(item_id): quantity for item_id, quantity in result.deducted.items()},
+        'shortages': [shortage._asdict() for shortage in result.shortages],
+    }
+
+
+@task('invoicing.run')
+def _run_invoicing(conn, payload):
+    return invoicing.run(conn, through=payload.get('through'), close_courses=payload.get('close_courses', False),
+                         created_by=payload.get('created_by'))._asdict()
+
+
+@task('archive.run')
+def _run_archive(conn, payload):
+    return archive.run(conn, before=payload.get('before'))._asdict()
+
+
+@task('inventory_alerts.roll')
+def _roll_inventory_alerts(conn, payload):
+    return {'rolled': inventory_alerts.roll_forward(conn, payload.get('through'))}
+
+
+@task('jobs.prune')
+def _prune_jobs(conn, payload):
+    return {'deleted': prune(conn, payload.get('days', 7))}
+
+
+def load_task_modules():
+    for module in TASK_MODULES:
+        importlib.import_module(module)
+
+
+def _work(database, name, stop):
+    # The parent turns Ctrl-C / SIGTERM into `stop`, so a job is never cut off
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    load_task_modules()
+    Worker(database, name).run(stop)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_pool(database, processes=2):
+    """Run `processes` worker processes until interrupted"""
+    stop = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=_work, args=(
+        database, f'{socket.gethostname()}:{os.getpid()}-{index}', stop)) for index in range(processes)]
+    for worker in workers:
+        worker.start()
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='AyurSutra background jobs')
+    parser.add_argument('command', choices=['worker', 'enqueue', 'prune'])
+    parser.add_argument('kind', nargs='?', help='job kind to enqueue')
+    parser.add_argument('--payload', default='{}', help='JSON payload for enqueue')
+    parser.add_argument('--priority', type=int, default=0)
+    parser.add_argument('--key', help='idempotency key for enqueue')
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--once', action='store_true', help='run due jobs in this process, then exit')
+    parser.add_argument('--days', type=int, default=7, help='prune: keep finished jobs this long')
+    parser.add_argument('--database', default='ayursutra.db')
+    args = parser.parse_args(argv)
+    load_task_modules()
+
+    if args.command == 'worker':
+        if args.once:
+            worker = Worker(args.database)
+            count = worker.run_pending()
+            worker.conn.close()
+            print(f"✅ {count} job(s) run")
+        else:
+            print(f"✅ {args.processes} worker process(es) polling {args.database} (Ctrl-C to stop)")
+            run_pool(args.database, args.processes)
+        return 0
+
+    conn = connect(args.database)
+    try:
+        if args.command == 'enqueue':
+            if args.kind not in TASKS:
+                print(f"❌ Unknown job kind {args.kind!r}; known: {', '.join(sorted(TASKS))}")
+                return 1
+            job_id = enqueue(conn, args.kind, json.loads(args.payload), args.priority, args.key)
+            print(f"✅ job #{job_id} queued")
+        else:
+            print(f"✅ {prune(conn, args.days)} finished job(s) pruned")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
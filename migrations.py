@@ -0,0 +1,221 @@
+"""
+AyurSutra - Versioned Schema Migrations
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+init_database creates the base tables; every later schema change is a
+numbered migration here. The applied version is kept in PRAGMA user_version
+so each step runs exactly once per database file.
+"""
+
+import analytics
+import archive
+import billing_rollup
+import branches
+import bulk_io
+import cache
+import calendar_grid
+import conditional
+import events
+import inventory
+import inventory_alerts
+import invoicing
+import jobs
+import patient_search
+import patient_timeline
+import similarity
+
+
+def set_aside_duplicate_notes(conn):
+    """Move all but the newest note of each appointment into
+    progress_notes_duplicates, so the unique index can be built without
+    losing clinical records"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS progress_notes_duplicates AS
+        SELECT * FROM progress_notes WHERE 0
+    """)
+    losers = """
+        SELECT id FROM progress_notes p
+        WHERE EXISTS (SELECT 1 FROM progress_notes n
+                      WHERE n.appointment_id = p.appointment_id AND n.id > p.id)
+    """
+    moved = conn.execute(f"""
+        INSERT INTO progress_notes_duplicates
+        SELECT * FROM progress_notes WHERE id IN ({losers})
+        RETURNING appointment_id
+    """).fetchall()
+    if moved:
+        conn.execute(f'DELETE FROM progress_notes WHERE id IN ({losers})')
+        appointments = sorted({row[0] for row in moved})
+        print(f"⚠️  {len(moved)} duplicate progress note(s) moved to progress_notes_duplicates "
+              f"(appointments {', '.join(map(str, appointments))})")
+
+
+# (version, description, statements) - append only, never renumber.
+# A statement is either an SQL string or a callable taking the connection.
+MIGRATIONS = [
+    (1, 'Secondary indexes for route access paths', [
+        # book_appointment conflict check and per-therapist day lookups
+        """CREATE INDEX IF NOT EXISTS idx_appointments_therapist_date
+           ON appointments (therapist_id, appointment_date, start_time)""",
+        # patient_profile history
+        """CREATE INDEX IF NOT EXISTS idx_appointments_patient_date
+           ON appointments (patient_id, appointment_date, start_time)""",
+        # schedule_view date range and progress_dashboard ordering
+        """CREATE INDEX IF NOT EXISTS idx_appointments_date_time
+           ON appointments (appointment_date, start_time)""",
+        # One note per appointment - the newest stays, older duplicates are set aside
+        set_aside_duplicate_notes,
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_progress_notes_appointment
+           ON progress_notes (appointment_id)""",
+        # billing_dashboard 30-day window (covering for the revenue sums)
+        """CREATE INDEX IF NOT EXISTS idx_billing_created_status
+           ON billing (created_at, payment_status, final_amount)""",
+        """CREATE INDEX IF NOT EXISTS idx_billing_patient
+           ON billing (patient_id, created_at)""",
+        """CREATE INDEX IF NOT EXISTS idx_billing_appointment
+           ON billing (appointment_id)""",
+        """CREATE INDEX IF NOT EXISTS idx_stock_usage_inventory_date
+           ON stock_usage (inventory_id, usage_date)""",
+        """CREATE INDEX IF NOT EXISTS idx_stock_usage_appointment
+           ON stock_usage (appointment_id)""",
+        # patients_list ordering and the book_appointment patient picker
+        """CREATE INDEX IF NOT EXISTS idx_patients_created
+           ON patients (created_at)""",
+        """CREATE INDEX IF NOT EXISTS idx_patients_name
+           ON patients (full_name)""",
+        """CREATE INDEX IF NOT EXISTS idx_therapists_user
+           ON therapists (user_id)""",
+    ]),
+    (2, 'Treatment courses for bulk Panchakarma scheduling', [
+        """CREATE TABLE IF NOT EXISTS treatment_courses (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               course_code TEXT UNIQUE NOT NULL,
+               patient_id INTEGER NOT NULL,
+               start_date DATE NOT NULL,
+               end_date DATE NOT NULL,
+               notes TEXT,
+               created_by INTEGER,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               FOREIGN KEY (patient_id) REFERENCES patients (id),
+               FOREIGN KEY (created_by) REFERENCES users (id)
+           )""",
+        "ALTER TABLE appointments ADD COLUMN course_id INTEGER REFERENCES treatment_courses (id)",
+        "CREATE INDEX IF NOT EXISTS idx_appointments_course ON appointments (course_id)",
+        "CREATE INDEX IF NOT EXISTS idx_treatment_courses_patient ON treatment_courses (patient_id, start_date)",
+    ]),
+    (3, 'Worker ID leases and legacy code aliases for ID generation', [
+        """CREATE TABLE IF NOT EXISTS id_workers (
+               worker_id INTEGER PRIMARY KEY,
+               hostname TEXT NOT NULL,
+               pid INTEGER NOT NULL,
+               leased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               heartbeat_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )""",
+        """CREATE TABLE IF NOT EXISTS id_aliases (
+               entity TEXT NOT NULL,
+               legacy_id TEXT NOT NULL,
+               new_id TEXT NOT NULL,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (entity, legacy_id)
+           )""",
+    ]),
+    (4, 'Daily billing rollup maintained by triggers', [
+        billing_rollup.ROLLUP_TABLE_SQL,
+        *billing_rollup.TRIGGERS_SQL,
+        lambda conn: billing_rollup.rebuild(conn, manage_transaction=False),
+    ]),
+    (5, 'FTS5 patient search indexes', [
+        *patient_search.FTS_TABLES_SQL,
+        *patient_search.TRIGGERS_SQL,
+        patient_search.rebuild,
+    ]),
+    (6, 'Keyset pagination index for the invoice list', [
+        # (created_at, rowid) order for billing_dashboard pages; the
+        # created_at/status index above would need a sort on id
+        """CREATE INDEX IF NOT EXISTS idx_billing_created
+           ON billing (created_at)""",
+    ]),
+    (7, 'Version counters for the reference data cache', [
+        cache.VERSIONS_TABLE_SQL,
+        *cache.TRIGGERS_SQL,
+    ]),
+    (8, 'Therapy consumables for automatic stock deduction', [
+        inventory.CONSUMABLES_TABLE_SQL,
+        inventory.seed_default_consumables,
+    ]),
+    (9, 'Incrementally maintained inventory alerts', [
+        *inventory_alerts.TABLES_SQL,
+        *inventory_alerts.TRIGGERS_SQL,
+        inventory_alerts.backfill_usage,
+        inventory_alerts.refresh_all,
+    ]),
+    (10, 'Background job queue', jobs.TABLES_SQL),
+    (11, 'Resumable bulk import checkpoints', [
+        bulk_io.CHECKPOINTS_TABLE_SQL,
+    ]),
+    (12, 'Per-patient treatment timeline and progress summary', [
+        *patient_timeline.TABLES_SQL,
+        patient_timeline.rebuild,
+        *patient_timeline.TRIGGERS_SQL,
+    ]),
+    (13, 'Data watermarks for the analytics frames', analytics.TRIGGERS_SQL),
+    (14, 'Change log for the dosha similarity index', [
+        *similarity.CHANGES_TABLE_SQL,
+        *similarity.TRIGGERS_SQL,
+    ]),
+    (15, 'Per-day schedule versions for calendar ETags', [
+        calendar_grid.VERSIONS_TABLE_SQL,
+        *calendar_grid.TRIGGERS_SQL,
+    ]),
+    (16, 'Per-table change counters for dashboard ETags', [
+        conditional.VERSIONS_TABLE_SQL,
+        *conditional.TRIGGERS_SQL,
+    ]),
+    (17, 'Committed appointment and stock events for live updates', [
+        events.TABLE_SQL,
+        *events.TRIGGERS_SQL,
+    ]),
+    (18, 'Invoice lines and the unbilled session queue for batch invoicing', [
+        *invoicing.TABLES_SQL,
+        invoicing.backfill_queue,
+        *invoicing.TRIGGERS_SQL,
+    ]),
+    (19, 'Archive registry and archive-aware derived-data triggers', [
+        *archive.TABLES_SQL,
+        archive.guard_triggers,
+    ]),
+    (20, 'Branch directory for per-branch databases', branches.TABLES_SQL),
+]
+
+
+def schema_version(conn):
+    """Migration version currently applied to this database"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations in order, one transaction per version"""
+    applied = []
+    current = schema_version(conn)
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        applied.append(version)
+        print(f"✅ Migration {version} applied: {description}")
+
+    return applied
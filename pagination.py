@@ -0,0 +1,118 @@
+"""
+AyurSutra - Keyset Pagination & Streaming Lists
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+List views page with an opaque cursor holding the sort key of the last row
+shown, e.g. (created_at, id) or (appointment_date, start_time, id). The
+next page is a row-value range read on the matching index, so page 1000
+costs the same as page 1 and rows added meanwhile never shift pages.
+
+Pages are lazy: rows are pulled from the SQLite cursor while the template
+renders them, and stream_list() sends the HTML out as it is generated, so
+memory stays flat whatever the page size.
+"""
+
+import base64
+import json
+from operator import itemgetter
+
+from flask import get_flashed_messages, request, stream_template
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Cursor values, or None for a missing or tampered cursor"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    # Every cursor this module writes is a non-empty list
+    return values if isinstance(values, list) and values else None
+
+
+def page_size(default=DEFAULT_PAGE_SIZE):
+    """?limit= from the request, clamped to [1, MAX_PAGE_SIZE]"""
+    return max(1, min(request.args.get('limit', default, type=int), MAX_PAGE_SIZE))
+
+
+class Keyset:
+    """Sort key of a list view: SQL columns plus their positions in each row.
+
+    The last column must be unique (normally the primary key) so that the
+    ordering is total and no row is skipped or repeated across pages.
+    """
+
+    def __init__(self, columns, positions, descending=True):
+        self.columns = tuple(columns)
+        self.key = itemgetter(*positions) if len(positions) > 1 else lambda row: (row[positions[0]],)
+        self.descending = descending
+
+    @property
+    def order_by(self):
+        direction = ' DESC' if self.descending else ''
+        return ', '.join(column + direction for column in self.columns)
+
+    def after(self, values):
+        """WHERE clause (and params) selecting rows that sort after `values`"""
+        if not values or len(values) != len(self.columns):
+            return '1 = 1', []
+        operator = '<' if self.descending else '>'
+        placeholders = ', '.join('?' for _ in values)
+        return f"({', '.join(self.columns)}) {operator} ({placeholders})", list(values)
+
+
+class Page:
+    """One page of rows, read lazily; next_cursor is known once iterated"""
+
+    def __init__(self, rows, limit, key=None, next_cursor=None):
+        self._rows = iter(rows)
+        self._limit = limit
+        self._key = key
+        self.next_cursor = next_cursor
+
+    @classmethod
+    def of(cls, rows, next_cursor=None):
+        """Wrap an already fetched list (e.g. ranked search results)"""
+        return cls(rows, len(rows), next_cursor=next_cursor)
+
+    def __iter__(self):
+        last = None
+        for count, row in enumerate(self._rows):
+            if count == self._limit:
+                # The extra row only tells us there is another page
+                if self._key is not None:
+                    self.next_cursor = encode_cursor(list(self._key(last)))
+                break
+            last = row
+            yield row
+
+
+def fetch_page(conn, sql, params, keyset, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Run `sql` for the page after `cursor`.
+
+    `sql` must contain {keyset} inside its WHERE clause and {order_by} as
+    its ORDER BY; LIMIT is appended here (one extra row to detect a next
+    page).
+    """
+    where, where_params = keyset.after(decode_cursor(cursor))
+    statement = sql.format(keyset=where, order_by=keyset.order_by) + ' LIMIT ?'
+    rows = conn.execute(statement, list(params) + where_params + [limit + 1])
+    return Page(rows, limit, key=keyset.key)
+
+
+def stream_list(template_name, **context):
+    """Render a list template incrementally (Jinja generate under
+    stream_with_context, so the request's pooled connection stays open)"""
+    # The session cookie goes out before the body; consume pending flashes
+    # now (they are cached on the request) or they would show up twice
+    get_flashed_messages(with_categories=True)
+    return stream_template(template_name, **context)
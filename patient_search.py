@@ -0,0 +1,170 @@
+"""
+AyurSutra - Patient Search Index
+Mohit Yadav - Patient Profiles
+
+Two FTS5 indexes over patients, kept in sync by triggers:
+- patients_fts (unicode61, prefix indexes) for ranked word-prefix name
+  search such as 'ram sh' -> 'Ramesh Sharma';
+- patients_trigram (trigram tokenizer) for phone / patient ID fragments
+  (including phone suffixes) and as a typo-tolerant fallback for names.
+
+Results are ranked with bm25 and paged with a keyset cursor on
+(tier, rank, id), so every page is a bounded index read.
+"""
+
+import re
+
+from pagination import decode_cursor, encode_cursor
+
+FTS_TABLES_SQL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+           full_name, patient_id, phone,
+           content='patients', content_rowid='id',
+           tokenize="unicode61 remove_diacritics 2", prefix='2 3'
+       )""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS patients_trigram USING fts5(
+           full_name, patient_id, phone,
+           content='patients', content_rowid='id', tokenize='trigram'
+       )""",
+]
+
+TRIGGERS_SQL = [
+    """CREATE TRIGGER IF NOT EXISTS trg_patients_fts_insert AFTER INSERT ON patients BEGIN
+           INSERT INTO patients_fts (rowid, full_name, patient_id, phone)
+           VALUES (NEW.id, NEW.full_name, NEW.patient_id, NEW.phone);
+           INSERT INTO patients_trigram (rowid, full_name, patient_id, phone)
+           VALUES (NEW.id, NEW.full_name, NEW.patient_id, NEW.phone);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_patients_fts_delete AFTER DELETE ON patients BEGIN
+           INSERT INTO patients_fts (patients_fts, rowid, full_name, patient_id, phone)
+           VALUES ('delete', OLD.id, OLD.full_name, OLD.patient_id, OLD.phone);
+           INSERT INTO patients_trigram (patients_trigram, rowid, full_name, patient_id, phone)
+           VALUES ('delete', OLD.id, OLD.full_name, OLD.patient_id, OLD.phone);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_patients_fts_update
+       AFTER UPDATE OF full_name, patient_id, phone ON patients BEGIN
+           INSERT INTO patients_fts (patients_fts, rowid, full_name, patient_id, phone)
+           VALUES ('delete', OLD.id, OLD.full_name, OLD.patient_id, OLD.phone);
+           INSERT INTO patients_trigram (patients_trigram, rowid, full_name, patient_id, phone)
+           VALUES ('delete', OLD.id, OLD.full_name, OLD.patient_id, OLD.phone);
+           INSERT INTO patients_fts (rowid, full_name, patient_id, phone)
+           VALUES (NEW.id, NEW.full_name, NEW.patient_id, NEW.phone);
+           INSERT INTO patients_trigram (rowid, full_name, patient_id, phone)
+           VALUES (NEW.id, NEW.full_name, NEW.patient_id, NEW.phone);
+       END""",
+]
+
+
+def rebuild(conn):
+    """Repopulate both indexes from patients (used by the migration)"""
+    conn.execute("INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO patients_trigram (patients_trigram) VALUES ('rebuild')")
+
+
+RESULT_COLUMNS = 'p.id, p.patient_id, p.full_name, p.age, p.gender, p.phone, p.email, p.created_at'
+MAX_PAGE_SIZE = 100
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _quote(token):
+    return '"' + token.replace('"', '""') + '"'
+
+
+def _prefix_query(tokens):
+    """'ram sh' -> 'full_name : ("ram"* AND "sh"*)'
+
+    Limited to the name column: every patient ID starts with 'AYU', so an
+    unrestricted 'ay*' would match the whole table.
+    """
+    return 'full_name : (' + ' AND '.join(_quote(token) + '*' for token in tokens) + ')'
+
+
+def _fragment_query(text):
+    """Substring match of an ID or phone fragment (3+ characters)"""
+    return '{patient_id phone} : ' + _quote(text)
+
+
+def _fuzzy_query(tokens):
+    """Any trigram of the name tokens; bm25 ranks closer spellings first"""
+    grams = {token[i:i + 3] for token in tokens for i in range(len(token) - 2)}
+    if not grams:
+        return None
+    return 'full_name : (' + ' OR '.join(_quote(gram) for gram in sorted(grams)) + ')'
+
+
+def _tiers(query):
+    """(table, MATCH expression, rank weights) in result order"""
+    text = query.strip()
+    tokens = [token.lower() for token in _TOKEN_RE.findall(text)]
+    if not tokens:
+        return []
+
+    tiers = []
+    compact = ''.join(tokens)
+    if compact.isdigit() or (compact[:3] == 'ayu' and any(char.isdigit() for char in compact)):
+        if len(compact) >= 3:
+            tiers.append(('patients_trigram', _fragment_query(compact), (0.0, 5.0, 10.0)))
+        else:
+            tiers.append(('patients_fts', '{patient_id phone} : ' + _quote(compact) + '*', (0.0, 5.0, 10.0)))
+        return tiers
+
+    tiers.append(('patients_fts', _prefix_query(tokens), (10.0, 2.0, 1.0)))
+    fuzzy = _fuzzy_query(tokens)
+    if fuzzy:
+        tiers.append(('patients_trigram', fuzzy, (10.0, 0.0, 0.0)))
+    return tiers
+
+
+def search(conn, query, limit=20, cursor=None):
+    """One page of ranked matches and the cursor for the next page.
+
+    Exact/prefix matches (tier 0) always come before fuzzy ones (tier 1);
+    fuzzy matches already returned by tier 0 are skipped.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    after = decode_cursor(cursor)
+    if after and (len(after) != 3 or not all(isinstance(value, (int, float)) for value in after)):
+        after = None    # (tier, score, rowid) or a tampered cursor
+    tiers = _tiers(query)
+    rows = []
+
+    for tier, (table, match, weights) in enumerate(tiers):
+        if after and tier < after[0]:
+            continue
+        needed = limit + 1 - len(rows)
+        if needed <= 0:
+            break
+
+        score = f"bm25({table}, {', '.join(str(weight) for weight in weights)})"
+        where = [f'{table} MATCH ?']
+        params = [match]
+        if after and tier == after[0]:
+            where.append(f'({score} > ? OR ({score} = ? AND rowid > ?))')
+            params += [after[1], after[1], after[2]]
+        if tier > 0:
+            # Skip rows an earlier tier already produced
+            for prior_table, prior_match, _ in tiers[:tier]:
+                where.append(f'rowid NOT IN (SELECT rowid FROM {prior_table} WHERE {prior_table} MATCH ?)')
+                params.append(prior_match)
+
+        found = conn.execute(f"""
+            SELECT {RESULT_COLUMNS}, m.score
+            FROM (
+                SELECT rowid, {score} AS score
+                FROM {table}
+                WHERE {' AND '.join(where)}
+                ORDER BY score, rowid
+                LIMIT ?
+            ) m
+            JOIN patients p ON p.id = m.rowid
+            ORDER BY m.score, m.rowid
+        """, params + [needed]).fetchall()
+        rows.extend((tier, row) for row in found)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        tier, last = rows[-1]
+        next_cursor = encode_cursor([tier, last[-1], last[0]])
+    return [row[:-1] for _, row in rows], next_cursor
@@ -0,0 +1,209 @@
+"""
+AyurSutra - Patient Treatment Timeline and Progress Summary
+Aditya Mastwal - Progress Tracking
+
+patient_timeline holds one row per appointment with the note's
+improvement_scale and side effects. It is clustered on (patient_id,
+appointment_date, start_time), so a patient's whole course is one range
+read. patient_summary holds one row per patient: completed sessions per
+therapy, mean and rolling improvement, first and latest scores, the last
+side effects reported and the vikriti - prakriti dosha deltas.
+
+Triggers on appointments and progress_notes maintain the timeline, and
+every timeline change re-derives that one patient's summary from that
+patient's timeline rows. Booking, cancelling and add_progress_note
+therefore keep both tables current without any caller involvement, and
+the cost of a write is bounded by one patient's course, never the table.
+
+Therapy and therapist names are not copied; readers map the ids through
+the cached reference catalogs.
+"""
+
+import json
+
+ROLLING_SESSIONS = 5
+
+TABLES_SQL = [
+    """CREATE TABLE IF NOT EXISTS patient_timeline (
+           patient_id INTEGER NOT NULL,
+           appointment_date DATE NOT NULL,
+           start_time TIME NOT NULL,
+           appointment_id INTEGER NOT NULL,
+           therapy_id INTEGER NOT NULL,
+           therapist_id INTEGER NOT NULL,
+           status TEXT NOT NULL,
+           improvement_scale INTEGER,
+           side_effects TEXT,
+           PRIMARY KEY (patient_id, appointment_date, start_time, appointment_id)
+       ) WITHOUT ROWID""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS idx_patient_timeline_appointment
+       ON patient_timeline (appointment_id)""",
+    """CREATE TABLE IF NOT EXISTS patient_summary (
+           patient_id INTEGER PRIMARY KEY,
+           sessions_completed INTEGER NOT NULL DEFAULT 0,
+           sessions_scheduled INTEGER NOT NULL DEFAULT 0,
+           sessions_cancelled INTEGER NOT NULL DEFAULT 0,
+           therapy_sessions TEXT NOT NULL DEFAULT '{}',
+           notes_count INTEGER NOT NULL DEFAULT 0,
+           improvement_mean REAL,
+           improvement_rolling REAL,
+           improvement_first INTEGER,
+           improvement_last INTEGER,
+           last_side_effects TEXT,
+           last_side_effects_date DATE,
+           first_session_date DATE,
+           last_session_date DATE,
+           vata_delta INTEGER,
+           pitta_delta INTEGER,
+           kapha_delta INTEGER,
+           updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+       )""",
+]
+
+SUMMARY_COLUMNS = [
+    'patient_id', 'sessions_completed', 'sessions_scheduled', 'sessions_cancelled',
+    'therapy_sessions', 'notes_count', 'improvement_mean', 'improvement_rolling',
+    'improvement_first', 'improvement_last', 'last_side_effects', 'last_side_effects_date',
+    'first_session_date', 'last_session_date', 'vata_delta', 'pitta_delta', 'kapha_delta',
+    'updated_at',
+]
+
+
+def _summary_sql(where):
+    """Re-derive patient_summary for the patients matched by `where` (on p).
+
+    Every subquery is a range read of one patient's timeline rows. Triggers
+    do not allow WITH, hence the repetition."""
+    scored = "t.patient_id = p.id AND t.improvement_scale IS NOT NULL"
+    return f"""
+        INSERT OR REPLACE INTO patient_summary ({', '.join(SUMMARY_COLUMNS)})
+        SELECT p.id,
+            (SELECT COUNT(*) FROM patient_timeline t WHERE t.patient_id = p.id AND t.status = 'completed'),
+            (SELECT COUNT(*) FROM patient_timeline t WHERE t.patient_id = p.id AND t.status = 'scheduled'),
+            (SELECT COUNT(*) FROM patient_timeline t WHERE t.patient_id = p.id AND t.status = 'cancelled'),
+            (SELECT json_group_object(therapy_id, sessions) FROM (
+                 SELECT t.therapy_id, COUNT(*) AS sessions FROM patient_timeline t
+                 WHERE t.patient_id = p.id AND t.status = 'completed' GROUP BY t.therapy_id)),
+            (SELECT COUNT(*) FROM patient_timeline t WHERE {scored}),
+            (SELECT round(AVG(t.improvement_scale), 2) FROM patient_timeline t WHERE {scored}),
+            (SELECT round(AVG(improvement_scale), 2) FROM (
+                 SELECT t.improvement_scale FROM patient_timeline t WHERE {scored}
+                 ORDER BY t.appointment_date DESC, t.start_time DESC LIMIT {ROLLING_SESSIONS})),
+            (SELECT t.improvement_scale FROM patient_timeline t WHERE {scored}
+             ORDER BY t.appointment_date, t.start_time LIMIT 1),
+            (SELECT t.improvement_scale FROM patient_timeline t WHERE {scored}
+             ORDER BY t.appointment_date DESC, t.start_time DESC LIMIT 1),
+            (SELECT t.side_effects FROM patient_timeline t
+             WHERE t.patient_id = p.id AND COALESCE(t.side_effects, '') != ''
+             ORDER BY t.appointment_date DESC, t.start_time DESC LIMIT 1),
+            (SELECT t.appointment_date FROM patient_timeline t
+             WHERE t.patient_id = p.id AND COALESCE(t.side_effects, '') != ''
+             ORDER BY t.appointment_date DESC, t.start_time DESC LIMIT 1),
+            (SELECT MIN(t.appointment_date) FROM patient_timeline t
+             WHERE t.patient_id = p.id AND t.status = 'completed'),
+            (SELECT MAX(t.appointment_date) FROM patient_timeline t
+             WHERE t.patient_id = p.id AND t.status = 'completed'),
+            p.vikriti_vata - p.prakriti_vata,
+            p.vikriti_pitta - p.prakriti_pitta,
+            p.vikriti_kapha - p.prakriti_kapha,
+            CURRENT_TIMESTAMP
+        FROM patients p
+        WHERE {where}
+    """
+
+
+_TIMELINE_INSERT = """
+    INSERT OR REPLACE INTO patient_timeline (patient_id, appointment_date, start_time, appointment_id,
+                                             therapy_id, therapist_id, status, improvement_scale, side_effects)
+    SELECT NEW.patient_id, NEW.appointment_date, NEW.start_time, NEW.id,
+           NEW.therapy_id, NEW.therapist_id, NEW.status, n.improvement_scale, n.side_effects
+    FROM (SELECT 1) LEFT JOIN progress_notes n ON n.appointment_id = NEW.id;
+"""
+
+_NOTE_UPDATE = """
+    UPDATE patient_timeline SET improvement_scale = {note}.improvement_scale, side_effects = {note}.side_effects
+    WHERE appointment_id = {note}.appointment_id;
+"""
+
+TRIGGERS_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_timeline_appointment_insert AFTER INSERT ON appointments
+        BEGIN {_TIMELINE_INSERT} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_timeline_appointment_update
+        AFTER UPDATE OF patient_id, appointment_date, start_time, therapy_id, therapist_id, status ON appointments
+        BEGIN
+            DELETE FROM patient_timeline WHERE appointment_id = OLD.id;
+            {_TIMELINE_INSERT}
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_timeline_appointment_delete AFTER DELETE ON appointments BEGIN
+           DELETE FROM patient_timeline WHERE appointment_id = OLD.id;
+       END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_timeline_note_insert AFTER INSERT ON progress_notes
+        BEGIN {_NOTE_UPDATE.format(note='NEW')} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_timeline_note_update
+        AFTER UPDATE OF improvement_scale, side_effects ON progress_notes
+        BEGIN {_NOTE_UPDATE.format(note='NEW')} END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_timeline_note_delete AFTER DELETE ON progress_notes BEGIN
+           UPDATE patient_timeline SET improvement_scale = NULL, side_effects = NULL
+           WHERE appointment_id = OLD.appointment_id;
+       END""",
+    # Any timeline change re-derives that patient's summary
+    f"""CREATE TRIGGER IF NOT EXISTS trg_summary_timeline_insert AFTER INSERT ON patient_timeline
+        BEGIN {_summary_sql('p.id = NEW.patient_id')}; END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_summary_timeline_update AFTER UPDATE ON patient_timeline
+        BEGIN {_summary_sql('p.id = NEW.patient_id')}; END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_summary_timeline_delete AFTER DELETE ON patient_timeline
+        BEGIN {_summary_sql('p.id = OLD.patient_id')}; END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_summary_patient_insert AFTER INSERT ON patients
+        BEGIN {_summary_sql('p.id = NEW.id')}; END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_summary_patient_dosha
+        AFTER UPDATE OF prakriti_vata, prakriti_pitta, prakriti_kapha,
+                        vikriti_vata, vikriti_pitta, vikriti_kapha ON patients
+        BEGIN {_summary_sql('p.id = NEW.id')}; END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_summary_patient_delete AFTER DELETE ON patients BEGIN
+           DELETE FROM patient_summary WHERE patient_id = OLD.id;
+       END""",
+]
+
+
+def rebuild(conn):
+    """Repopulate the timeline and every summary in two set-based statements.
+
+    The migration runs this before TRIGGERS_SQL exists so the summary is not
+    re-derived once per inserted timeline row."""
+    conn.execute('DELETE FROM patient_timeline')
+    conn.execute("""
+        INSERT INTO patient_timeline (patient_id, appointment_date, start_time, appointment_id,
+                                      therapy_id, therapist_id, status, improvement_scale, side_effects)
+        SELECT a.patient_id, a.appointment_date, a.start_time, a.id,
+               a.therapy_id, a.therapist_id, a.status, n.improvement_scale, n.side_effects
+        FROM appointments a
+        LEFT JOIN progress_notes n ON n.appointment_id = a.id
+    """)
+    conn.execute('DELETE FROM patient_summary')
+    conn.execute(_summary_sql('1 = 1'))
+
+
+def load_summary(conn, patient_id):
+    """The patient's summary as a dict (therapy_sessions decoded), or None"""
+    row = conn.execute(f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM patient_summary WHERE patient_id = ?",
+                       (patient_id,)).fetchone()
+    if row is None:
+        return None
+    summary = dict(zip(SUMMARY_COLUMNS, row))
+    summary['therapy_sessions'] = {int(therapy_id): count for therapy_id, count
+                                   in json.loads(summary['therapy_sessions']).items()}
+    return summary
+
+
+TIMELINE_COLUMNS = ['appointment_date', 'start_time', 'appointment_id', 'therapy_id', 'therapist_id',
+                    'status', 'improvement_scale', 'side_effects']
+
+
+def load_timeline(conn, patient_id, descending=True):
+    """The patient's sessions in date order - one range read of the clustered key"""
+    order = 'DESC' if descending else 'ASC'
+    return conn.execute(f"""
+        SELECT {', '.join(TIMELINE_COLUMNS)} FROM patient_timeline
+        WHERE patient_id = ?
+        ORDER BY appointment_date {order}, start_time {order}, appointment_id {order}
+    """, (patient_id,)).fetchall()
@@ -0,0 +1,270 @@
+"""
+AyurSutra - Query Plan Regression Check
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+Drives every route through the Flask test client against a scratch database,
+captures each SQL statement the routes execute and runs EXPLAIN QUERY PLAN on
+it. Exits non-zero if any statement falls back to a full table scan on a
+table that is expected to grow.
+
+Usage: python query_plans.py [--verbose] [--allow TABLE ...]
+"""
+
+import argparse
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from werkzeug.security import generate_password_hash
+
+from database import connect, get_pool
+from jobs import Worker
+from pagination import encode_cursor
+
+# Reference tables that stay small enough for a full scan to be harmless;
+# the alert tables hold at most a few rows per inventory item and id_workers
+# at most 2**WORKER_BITS leases; the archive registry has one row per
+# table and year, plus one per archive run
+SMALL_TABLES = {'therapies', 'therapists', 'inventory', 'cache_versions',
+                'inventory_alerts', 'inventory_usage_rate', 'inventory_alert_candidates',
+                'id_workers', 'archive_segments', 'archive_runs', 'sqlite_master'}
+
+# (method, path, form data) - one entry per route, seeded ids are all 1
+ROUTE_REQUESTS = [
+    ('GET', '/', None),
+    ('GET', '/patients', None),
+    ('GET', '/patients?cursor=' + encode_cursor(['2999-01-01 00:00:00', 2**31]), None),
+    ('GET', '/patients?search=Demo', None),
+    ('GET', '/patients?search=Dmeo', None),
+    ('GET', '/api/patients/search?q=0001', None),
+    ('GET', '/api/patients/search?q=de', None),
+    ('GET', '/add_patient', None),
+    ('POST', '/add_patient', {
+        'full_name': 'Plan Check', 'age': '40', 'gender': 'Female', 'phone': '9000000002',
+        'prakriti_vata': '5', 'vikriti_vata': '7',
+    }),
+    ('GET', '/patient/1', None),
+    ('GET', '/api/patients/1/timeline', None),
+    ('GET', '/api/patients/1/similar', None),
+    ('GET', '/schedule', None),
+    ('GET', '/schedule?start=2020-01-06&therapist_id=1&therapy_id=1', None),
+    ('GET', '/api/schedule?start=2020-01-01&end=2020-02-15', None),
+    ('GET', '/api/schedule?therapist_id=1', None),
+    ('GET', '/book_appointment', None),
+    ('GET', '/book_appointment?patient_id=1', None),
+    ('POST', '/book_appointment', {
+        'patient_id': '1', 'therapist_id': '1', 'therapy_id': '1',
+        'appointment_date': '2030-01-07', 'start_time': '10:00',
+    }),
+    ('GET', '/api/availability/slots?therapist_id=1&therapy_id=1&date=2030-01-07', None),
+    ('GET', '/api/availability/therapists?therapy_id=1&date=2030-01-07&time=12:00', None),
+    ('POST', '/cancel_appointment/2', None),
+    ('GET', '/book_course', None),
+    ('POST', '/book_course', {
+        'patient_id': '1', 'therapy_ids': ['1'], 'start_date': '2030-02-04', 'end_date': '2030-02-10',
+    }),
+    ('GET', '/progress', None),
+    ('GET', '/progress?cursor=' + encode_cursor(['2999-01-01', '23:59', 2**31]), None),
+    ('GET', '/add_progress_note/1', None),
+    ('POST', '/add_progress_note/1', {
+        'session_notes': 'ok', 'patient_response': 'good', 'therapist_observations': 'calm',
+        'improvement_scale': '7', 'recommendations': 'rest',
+    }),
+    ('GET', '/billing', None),
+    ('GET', '/billing?cursor=' + encode_cursor(['2999-01-01 00:00:00', 2**31]), None),
+    ('POST', '/billing/generate', {}),
+    ('POST', '/billing/generate', {'through': '2040-01-01', 'month_end': '1'}),
+    ('GET', '/api/invoices/1/lines', None),
+    ('GET', '/billing/report?start=2020-01-01&end=2040-01-01', None),
+    ('GET', '/admin/reports/utilization?start=2020-01-01&end=2040-01-01', None),
+    ('GET', '/admin/reports/effectiveness?start=2020-01-01&end=2040-01-01', None),
+    ('GET', '/admin/reports/revenue?start=2020-01-01&end=2040-01-01', None),
+    ('GET', '/admin/reports', None),
+    ('GET', '/inventory', None),
+    ('GET', '/add_inventory_item', None),
+    ('POST', '/add_inventory_item', {
+        'item_name': 'Plan Oil', 'item_type': 'oil', 'current_stock': '100',
+        'unit': 'ml', 'min_stock_alert': '10',
+    }),
+    ('POST', '/update_stock/1', {'new_stock': '4000'}),
+    ('POST', '/inventory/reconcile', {}),
+    ('GET', '/setup_default_data', None),
+    ('GET', '/api/jobs/1', None),
+    ('GET', '/admin/jobs', None),
+    ('POST', '/admin/import/billing', {'file': (io.BytesIO(
+        b'patient_id,appointment_id,total_amount\nAYU000000000001,APP000000000001,100\n'), 'billing.csv')}),
+    ('GET', '/admin/export/patients', None),
+    ('GET', '/admin/export/appointments?format=ndjson', None),
+    ('GET', '/admin/export/billing', None),
+    ('GET', '/admin/db_pool', None),
+    ('GET', '/admin/archive', None),
+    ('GET', '/admin/branches', None),
+    ('GET', '/admin/group/billing', None),
+    ('GET', '/admin/group/inventory', None),
+    ('POST', '/admin/archive', {}),
+    ('GET', '/admin/cache', None),
+    ('GET', '/admin/events', None),
+    ('GET', '/admin/metrics', None),
+    ('GET', '/admin/slow_queries', None),
+]
+
+_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?$')
+_ALIAS_RE = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+_SUBQUERY_RE = re.compile(r'^(?:MATERIALIZE|CO-ROUTINE) (?:SUBQUERY )?(\w+)')
+_TRACKED_PREFIXES = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def seed(database):
+    """Minimal rows so every route reaches its real queries"""
+    conn = connect(database)
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO users (username, email, password_hash, role, full_name, phone)
+        VALUES ('therapist1', 't1@ayursutra.com', ?, 'therapist', 'Demo Therapist', '9000000000')
+    """, (generate_password_hash('therapist123'),))
+    cursor.execute("""
+        INSERT INTO therapists (user_id, specialization, experience_years, available_hours)
+        VALUES (?, 'Abhyanga', 5, '09:00-18:00')
+    """, (cursor.lastrowid,))
+    cursor.execute("""
+        INSERT INTO therapies (therapy_name, description, duration_minutes, cost, requires_oil, oil_quantity_ml)
+        VALUES ('Abhyanga', 'Full body oil massage', 90, 2500.00, 1, 200)
+    """)
+    cursor.execute("""
+        INSERT INTO patients (patient_id, full_name, age, gender, phone, prakriti_vata, vikriti_vata)
+        VALUES ('AYU000000000001', 'Demo Patient', 35, 'Male', '9000000001', 6, 8)
+    """)
+    cursor.execute("""
+        INSERT INTO appointments (appointment_id, patient_id, therapist_id, therapy_id,
+                                  appointment_date, start_time, end_time)
+        VALUES ('APP000000000001', 1, 1, 1, date('now'), '09:00', '10:30')
+    """)
+    cursor.execute("""
+        INSERT INTO billing (invoice_id, patient_id, appointment_id, total_amount, final_amount)
+        VALUES ('INV000000000001', 1, 1, 2500.00, 2500.00)
+    """)
+    cursor.execute("""
+        INSERT INTO inventory (item_name, item_type, current_stock, unit, min_stock_alert)
+        VALUES ('Sesame Oil', 'oil', 5000, 'ml', 1000)
+    """)
+    conn.commit()
+    conn.close()
+
+
+def collect_route_sql(app, init_database, create_default_admin, database):
+    """Run ROUTE_REQUESTS and return every statement executed, in order"""
+    statements = []
+
+    app.config['DATABASE'] = database
+    app.config['IMPORT_FOLDER'] = os.path.join(os.path.dirname(database), 'imports')
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+    with app.app_context():
+        init_database()
+        create_default_admin()
+        seed(database)
+        get_pool().add_connect_hook(lambda conn: conn.set_trace_callback(statements.append))
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    for method, path, data in ROUTE_REQUESTS:
+        before = len(statements)
+        try:
+            # Streamed list views only run their queries as the body is read
+            response = client.open(path, method=method, data=data)
+            response.get_data()
+            response.close()
+        except Exception as exc:  # template gaps must not hide query plans
+            print(f"⚠️  {method} {path}: {type(exc).__name__}: {exc}")
+        for index in range(before, len(statements)):
+            statements[index] = (f'{method} {path}', statements[index])
+
+    # Run the jobs those requests queued, as a worker process would
+    worker = Worker(database)
+    before = len(statements)
+    worker.conn.set_trace_callback(statements.append)
+    worker.run_pending()
+    worker.conn.close()
+    for index in range(before, len(statements)):
+        statements[index] = ('JOB worker', statements[index])
+
+    return [entry for entry in statements if isinstance(entry, tuple)]
+
+
+def full_scans(conn, sql):
+    """Tables a statement reads with a bare (index-less) full scan"""
+    # Aliases used inside referenced views show up in the plan as well
+    views = [row[0] for row in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'view'")
+             if row[0] and re.search(r'\bVIEW\s+(?:IF NOT EXISTS\s+)?(\w+)', row[0]).group(1) in sql]
+    aliases = {}
+    for table, alias in _ALIAS_RE.findall(' '.join([sql, *views])):
+        aliases[table] = table
+        if alias and alias.upper() not in ('WHERE', 'ON', 'JOIN', 'LEFT', 'ORDER', 'GROUP', 'LIMIT'):
+            aliases[alias] = table
+
+    plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+    # Scanning a materialized subquery reads its (already bounded) result
+    subqueries = {match.group(1) for match in map(_SUBQUERY_RE.match, (row[3] for row in plan)) if match}
+    scanned = []
+    for row in plan:
+        match = _SCAN_RE.match(row[3])
+        if match:
+            name = match.group(2) or match.group(1)
+            if name not in subqueries:
+                scanned.append(aliases.get(name, name))
+    return plan, scanned
+
+
+def check(statements, database, allow=SMALL_TABLES, verbose=False):
+    """Explain each tracked statement; return a list of regressions"""
+    conn = connect(database)
+    regressions = []
+    seen = set()
+
+    for route, sql in statements:
+        text = ' '.join(sql.split())
+        if not text.upper().startswith(_TRACKED_PREFIXES) or text in seen:
+            continue
+        seen.add(text)
+
+        plan, scanned = full_scans(conn, text)
+        bad = [table for table in scanned if table not in allow]
+        if verbose or bad:
+            print(f"{'❌' if bad else '✅'} {route}: {text[:110]}")
+            for row in plan:
+                print(f"      {row[3]}")
+        if bad:
+            regressions.append((route, text, bad))
+
+    conn.close()
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fail if any route query regresses to a full table scan')
+    parser.add_argument('--verbose', action='store_true', help='print every plan, not just failures')
+    parser.add_argument('--allow', nargs='*', default=[], help='extra tables allowed to be scanned')
+    args = parser.parse_args(argv)
+
+    from app import app, init_database, create_default_admin
+
+    workdir = tempfile.mkdtemp(prefix='ayursutra-plans-')
+    try:
+        database = os.path.join(workdir, 'plans.db')
+        statements = collect_route_sql(app, init_database, create_default_admin, database)
+        regressions = check(statements, database, SMALL_TABLES | set(args.allow), args.verbose)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("=" * 70)
+    if regressions:
+        print(f"❌ {len(regressions)} statement(s) use a full table scan")
+        return 1
+    print(f"✅ {len({sql for _, sql in statements})} statements checked, no full table scans")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
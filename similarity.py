@@ -0,0 +1,320 @@
+"""
+AyurSutra - Dosha Profile Similarity
+Mohit Yadav - Patient Profiles
+
+Finds past patients with a similar constitution (prakriti) and current
+imbalance (vikriti - prakriti) and shows how they responded to each
+therapy.
+
+DoshaIndex keeps every assessed patient's six features in one contiguous
+float32 matrix. A k-nearest-neighbour query is a single vectorised
+weighted distance over the matrix plus an argpartition, a few
+milliseconds even for a few hundred thousand patients, so no tree has to
+be kept balanced as rows change.
+
+Triggers record each inserted, re-assessed or deleted patient in
+dosha_changes (one row per patient, stamped with a rising seq). An index
+applies only the rows past the seq it last saw, so a patient added in any
+worker or by a bulk import is found within CHECK_SECONDS without
+reloading the matrix. Outcomes come from the patient_timeline store.
+
+Usage: python similarity.py PATIENT_ID [-k N] [--imbalance-weight W] [--database PATH]
+"""
+
+import argparse
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from flask import current_app
+
+from database import connect, per_database
+
+DOSHA_COLUMNS = ('prakriti_vata', 'prakriti_pitta', 'prakriti_kapha',
+                 'vikriti_vata', 'vikriti_pitta', 'vikriti_kapha')
+LOAD_BATCH_SIZE = 50000
+RESPONDER_SCORE = 7
+
+CHANGES_TABLE_SQL = [
+    """CREATE TABLE IF NOT EXISTS dosha_changes (
+           patient_id INTEGER PRIMARY KEY,
+           seq INTEGER NOT NULL
+       )""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_dosha_changes_seq ON dosha_changes (seq)",
+]
+
+_RECORD_CHANGE = """
+    INSERT OR REPLACE INTO dosha_changes (patient_id, seq)
+    VALUES ({row}.id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM dosha_changes));
+"""
+
+TRIGGERS_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_dosha_changes_insert AFTER INSERT ON patients
+        BEGIN {_RECORD_CHANGE.format(row='NEW')} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_dosha_changes_update AFTER UPDATE OF {', '.join(DOSHA_COLUMNS)} ON patients
+        BEGIN {_RECORD_CHANGE.format(row='NEW')} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_dosha_changes_delete AFTER DELETE ON patients
+        BEGIN {_RECORD_CHANGE.format(row='OLD')} END""",
+]
+
+_VECTORS_SQL = f"""
+    SELECT id, {', '.join(f'COALESCE({column}, 0)' for column in DOSHA_COLUMNS)}
+    FROM patients
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+"""
+
+
+def features(scores):
+    """(prakriti, vikriti - prakriti) rows from raw six-score rows"""
+    scores = np.asarray(scores, dtype='f4').reshape(-1, 6)
+    return np.hstack([scores[:, :3], scores[:, 3:] - scores[:, :3]])
+
+
+def assessed(scores):
+    """Rows with at least one non-zero dosha score"""
+    return np.asarray(scores).reshape(-1, 6).any(axis=1)
+
+
+class DoshaIndex:
+    """Feature matrix of assessed patients, kept in sync through dosha_changes"""
+
+    def __init__(self, check_seconds=2.0, capacity=1024):
+        self.check_seconds = check_seconds
+        self._lock = threading.RLock()
+        self._ids = np.empty(capacity, dtype='i8')
+        self._matrix = np.empty((capacity, 6), dtype='f4')
+        self._size = 0
+        self._rows = {}               # patient id -> matrix row
+        self._seq = None              # last dosha_changes.seq applied; None until loaded
+        self._checked_at = 0.0
+        self._stats = {'loads': 0, 'syncs': 0, 'changes_applied': 0, 'queries': 0}
+
+    def __len__(self):
+        return self._size
+
+    def _put(self, patient_id, row_features):
+        row = self._rows.get(patient_id)
+        if row is None:
+            if self._size == len(self._ids):
+                capacity = max(1024, 2 * len(self._ids))
+                self._ids = np.resize(self._ids, capacity)
+                self._matrix = np.resize(self._matrix, (capacity, 6))
+            row = self._size
+            self._size += 1
+            self._ids[row] = patient_id
+            self._rows[patient_id] = row
+        self._matrix[row] = row_features
+
+    def _remove(self, patient_id):
+        # Move the last row into the gap so the matrix stays contiguous
+        row = self._rows.pop(patient_id, None)
+        if row is None:
+            return
+        last = self._size - 1
+        if row != last:
+            moved = int(self._ids[last])
+            self._ids[row] = moved
+            self._matrix[row] = self._matrix[last]
+            self._rows[moved] = row
+        self._size = last
+
+    def load(self, conn):
+        """Read every patient's scores in id batches and rebuild the matrix"""
+        # The seq is read first; changes racing the load are re-applied by
+        # the next sync, which is harmless
+        seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM dosha_changes').fetchone()[0]
+        ids, scores = [], []
+        last_id = 0
+        while True:
+            rows = conn.execute(_VECTORS_SQL, (last_id, LOAD_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            batch = np.array(rows, dtype='f8')
+            keep = assessed(batch[:, 1:])
+            ids.append(batch[keep, 0].astype('i8'))
+            scores.append(batch[keep, 1:])
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype='i8')
+        matrix = features(np.concatenate(scores)) if scores else np.empty((0, 6), dtype='f4')
+
+        with self._lock:
+            capacity = max(1024, len(ids) + len(ids) // 4)
+            self._ids = np.resize(ids, capacity)
+            self._matrix = np.resize(matrix, (capacity, 6))
+            self._size = len(ids)
+            self._rows = {int(patient_id): row for row, patient_id in enumerate(ids)}
+            self._seq = seq
+            self._checked_at = time.monotonic()
+            self._stats['loads'] += 1
+
+    def sync(self, conn, force=False):
+        """Apply dosha_changes past the last seen seq (at most every check_seconds)"""
+        if self._seq is None:
+            self.load(conn)
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._checked_at < self.check_seconds:
+                return
+            self._checked_at = now
+            seq = self._seq
+
+        changes = conn.execute("""
+            SELECT c.seq, c.patient_id, p.id, {columns}
+            FROM dosha_changes c
+            LEFT JOIN patients p ON p.id = c.patient_id
+            WHERE c.seq > ?
+            ORDER BY c.seq
+        """.format(columns=', '.join(f'COALESCE(p.{column}, 0)' for column in DOSHA_COLUMNS)),
+            (seq,)).fetchall()
+        with self._lock:
+            self._stats['syncs'] += 1
+            for change in changes:
+                if change[0] <= self._seq:
+                    continue
+                scores = change[3:]
+                if change[2] is None or not any(scores):
+                    self._remove(change[1])
+                else:
+                    self._put(change[1], features(scores)[0])
+                self._seq = change[0]
+                self._stats['changes_applied'] += 1
+
+    def mark_stale(self):
+        """Make the next query sync, e.g. right after this worker saved a patient"""
+        with self._lock:
+            self._checked_at = 0.0
+
+    def nearest(self, conn, scores, k=10, imbalance_weight=1.0, exclude=()):
+        """[(patient_id, distance)] of the k assessed patients closest to six raw scores"""
+        self.sync(conn)
+        query = features(scores)[0]
+        weights = np.array([1, 1, 1, imbalance_weight, imbalance_weight, imbalance_weight], dtype='f4')
+        with self._lock:
+            self._stats['queries'] += 1
+            size = self._size
+            if not size:
+                return []
+            difference = self._matrix[:size] - query
+            distances = (difference * difference) @ weights
+            for patient_id in exclude:
+                row = self._rows.get(patient_id)
+                if row is not None:
+                    distances[row] = np.inf
+            # k + len(exclude) so the excluded rows never crowd out real ones
+            count = min(size, k + len(exclude))
+            nearest = np.argpartition(distances, count - 1)[:count]
+            nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+            return [(int(self._ids[row]), float(np.sqrt(distances[row])))
+                    for row in nearest if np.isfinite(distances[row])][:k]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, patients=self._size, seq=self._seq,
+                        matrix_bytes=int(self._matrix.nbytes + self._ids.nbytes))
+
+
+Neighbour = namedtuple('Neighbour', 'id patient_id full_name age gender distance scores therapies')
+TherapyResponse = namedtuple('TherapyResponse', 'therapy_id patients sessions mean_improvement responder_rate')
+
+
+def therapy_outcomes(conn, patient_ids):
+    """{patient id: {therapy id: (scored sessions, mean improvement)}} from the timeline store"""
+    if not patient_ids:
+        return {}
+    placeholders = ', '.join('?' * len(patient_ids))
+    outcomes = {patient_id: {} for patient_id in patient_ids}
+    for patient_id, therapy_id, sessions, mean in conn.execute(f"""
+        SELECT patient_id, therapy_id, COUNT(*), AVG(improvement_scale)
+        FROM patient_timeline
+        WHERE patient_id IN ({placeholders}) AND improvement_scale IS NOT NULL
+        GROUP BY patient_id, therapy_id
+    """, list(patient_ids)):
+        outcomes[patient_id][therapy_id] = (sessions, round(mean, 2))
+    return outcomes
+
+
+def find_similar(conn, index, patient_id, k=10, imbalance_weight=1.0):
+    """(neighbours, therapy responses) for a patient, or None if they have no assessment"""
+    row = conn.execute(f"SELECT {', '.join(DOSHA_COLUMNS)} FROM patients WHERE id = ?", (patient_id,)).fetchone()
+    if row is None or not any(row):
+        return None
+
+    matches = index.nearest(conn, [value or 0 for value in row], k=k,
+                            imbalance_weight=imbalance_weight, exclude=(patient_id,))
+    ids = [match[0] for match in matches]
+    outcomes = therapy_outcomes(conn, ids)
+    details = {}
+    if ids:
+        placeholders = ', '.join('?' * len(ids))
+        details = {detail[0]: detail for detail in conn.execute(f"""
+            SELECT id, patient_id, full_name, age, gender, {', '.join(DOSHA_COLUMNS)}
+            FROM patients WHERE id IN ({placeholders})
+        """, ids)}
+
+    neighbours = [Neighbour(match_id, details[match_id][1], details[match_id][2], details[match_id][3],
+                            details[match_id][4], round(distance, 3), details[match_id][5:],
+                            outcomes.get(match_id, {}))
+                  for match_id, distance in matches if match_id in details]
+
+    # Per therapy across the neighbours: each patient's mean counts once
+    by_therapy = {}
+    for neighbour in neighbours:
+        for therapy_id, (sessions, mean) in neighbour.therapies.items():
+            by_therapy.setdefault(therapy_id, []).append((sessions, mean))
+    responses = sorted((TherapyResponse(therapy_id, len(results), sum(result[0] for result in results),
+                                        round(sum(result[1] for result in results) / len(results), 2),
+                                        round(sum(result[1] >= RESPONDER_SCORE for result in results) / len(results), 2))
+                        for therapy_id, results in by_therapy.items()),
+                       key=lambda response: (-response.patients, -response.mean_improvement))
+    return neighbours, responses
+
+
+def init_app(app):
+    app.config.setdefault('DOSHA_INDEX_CHECK_SECONDS', 2.0)
+    app.extensions['dosha_index'] = {}
+
+
+def get_dosha_index():
+    return per_database('dosha_index', lambda: DoshaIndex(
+        check_seconds=current_app.config['DOSHA_INDEX_CHECK_SECONDS']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Patients with a similar dosha profile')
+    parser.add_argument('patient_id', type=int, help='patients.id')
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--imbalance-weight', type=float, default=1.0)
+    parser.add_argument('--database', default='ayursutra.db')
+    args = parser.parse_args(argv)
+
+    conn = connect(args.database)
+    try:
+        index = DoshaIndex()
+        started = time.perf_counter()
+        index.load(conn)
+        loaded = time.perf_counter()
+        result = find_similar(conn, index, args.patient_id, args.k, args.imbalance_weight)
+        elapsed = time.perf_counter() - loaded
+        if result is None:
+            print(f"❌ Patient {args.patient_id} not found or has no dosha assessment")
+            return 1
+        neighbours, responses = result
+        for neighbour in neighbours:
+            print(f"{neighbour.patient_id}  {neighbour.full_name:<24} distance {neighbour.distance:<7} "
+                  f"scores {neighbour.scores}  therapies {neighbour.therapies}")
+        for response in responses:
+            print(f"therapy {response.therapy_id}: {response.patients} patients, {response.sessions} sessions, "
+                  f"mean {response.mean_improvement}, responders {response.responder_rate:.0%}")
+        print(f"✅ {len(index)} patients indexed in {loaded - started:.3f}s, query {elapsed * 1000:.1f} ms")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
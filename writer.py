@@ -0,0 +1,248 @@
+"""
+AyurSutra - Serialized Write Path
+Aniruddh Negi (Team Lead) - Overall Architecture & Database Design
+
+SQLite allows one writer per database. When request threads each open
+their own write transaction, the one that upgrades a read lock second gets
+"database is locked" at once, whatever the busy timeout. Instead, every
+route mutation is a write unit - a function of a connection that neither
+begins nor commits - handed to write(). One writer thread per worker
+process and database runs the units in order on its own connection.
+
+Group commit: the writer takes every unit already queued (up to
+max_batch), opens one BEGIN IMMEDIATE transaction, runs each unit in its
+own SAVEPOINT and commits once. A unit that raises is rolled back alone
+and its exception re-raised in the request thread; the others still
+commit. Conflict checks inside a unit see everything committed before it,
+including earlier units of the same batch. Under load, many units share
+one fsync and one lock acquisition.
+
+A unit whose caller stopped waiting (WRITE_TIMEOUT) before the writer
+reached it is cancelled and never runs, so a request that reported a
+timeout cannot have its write land later.
+
+Between worker processes the database lock is still the arbiter: BEGIN
+IMMEDIATE waits up to the busy timeout, and a busy error is retried with
+exponential backoff and jitter a bounded number of times. retry_busy()
+applies the same policy to writes that manage their own transaction
+(job claims, archive runs, CLIs).
+
+Contention metrics (queue depth and wait, batch sizes, lock wait, busy
+retries) are in /admin/db_pool and /admin/metrics.
+"""
+
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from flask import current_app
+
+from database import get_pool
+
+BUSY_RETRIES = 5
+BUSY_BACKOFF_SECONDS = 0.05
+MAX_BACKOFF_SECONDS = 2.0
+
+
+def is_busy(error):
+    """True for SQLITE_BUSY / SQLITE_LOCKED surfaced as OperationalError"""
+    message = str(error)
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def backoff(attempt):
+    """Seconds to sleep before retry number `attempt`: doubling, full jitter"""
+    return random.uniform(0, min(BUSY_BACKOFF_SECONDS * 2 ** attempt, MAX_BACKOFF_SECONDS))
+
+
+def retry_busy(function, conn=None, retries=BUSY_RETRIES, on_retry=None):
+    """Call function() and retry it when the database is busy.
+
+    If conn is given, its open transaction is rolled back before each
+    retry. The last busy error propagates once retries are used up.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return function()
+        except sqlite3.OperationalError as error:
+            if not is_busy(error) or attempt == retries:
+                raise
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            if on_retry is not None:
+                on_retry()
+            time.sleep(backoff(attempt))
+
+
+class _Unit:
+    __slots__ = ('function', 'future', 'queued_at')
+
+    def __init__(self, function):
+        self.function = function
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class Writer:
+    """Single writer thread with group commit for one database in one process"""
+
+    def __init__(self, pool, max_batch=64, max_queue=1024, timeout=30.0, retries=BUSY_RETRIES):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.retries = retries
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {
+            'units': 0,
+            'failed_units': 0,
+            'batches': 0,
+            'largest_batch': 0,
+            'queue_high_water': 0,
+            'queue_wait_ms': 0.0,
+            'lock_wait_ms': 0.0,
+            'commit_ms': 0.0,
+            'busy_retries': 0,
+            'busy_failures': 0,
+            'abandoned_units': 0,
+        }
+
+    def write(self, function):
+        """Run function(conn) in the writer's transaction and return its result.
+
+        The function must not begin, commit or roll back. Its exception is
+        raised here after its savepoint has been rolled back. If the writer
+        has not started the unit within the timeout it is cancelled and
+        TimeoutError raised; one already running is waited for.
+        """
+        if threading.current_thread() is self._thread:
+            # A unit writing more is part of the same unit
+            return function(self._conn)
+        unit = _Unit(function)
+        with self._lock:
+            if self._thread is None:
+                self._conn = self.pool.open_dedicated()
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+        self._queue.put(unit, timeout=self.timeout)
+        with self._lock:
+            self._stats['queue_high_water'] = max(self._stats['queue_high_water'], self._queue.qsize())
+        try:
+            return unit.future.result(timeout=self.timeout)
+        except FutureTimeout:
+            if unit.future.cancel():
+                raise TimeoutError(f'write unit not started within {self.timeout}s') from None
+            # Already in the writer's transaction: its outcome is moments away
+            return unit.future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            # Drop units whose caller already gave up; the rest can no longer be cancelled
+            live = [unit for unit in batch if unit.future.set_running_or_notify_cancel()]
+            with self._lock:
+                self._stats['queue_wait_ms'] += sum(started - unit.queued_at for unit in batch) * 1000
+                self._stats['abandoned_units'] += len(batch) - len(live)
+            if live:
+                self._commit(live)
+
+    def _commit(self, batch):
+        conn = self._conn
+        for attempt in range(self.retries + 1):
+            outcomes = []
+            try:
+                started = time.perf_counter()
+                conn.execute('BEGIN IMMEDIATE')
+                locked = time.perf_counter()
+                for unit in batch:
+                    conn.execute('SAVEPOINT write_unit')
+                    try:
+                        outcomes.append((True, unit.function(conn)))
+                    except Exception as error:
+                        if is_busy(error):
+                            raise
+                        conn.execute('ROLLBACK TO write_unit')
+                        outcomes.append((False, error))
+                    conn.execute('RELEASE write_unit')
+                conn.commit()
+                break
+            except Exception as error:
+                if conn.in_transaction:
+                    conn.rollback()
+                if is_busy(error) and attempt < self.retries:
+                    with self._lock:
+                        self._stats['busy_retries'] += 1
+                    time.sleep(backoff(attempt))
+                    continue
+                with self._lock:
+                    self._stats['busy_failures' if is_busy(error) else 'failed_units'] += len(batch)
+                for unit in batch:
+                    unit.future.set_exception(error)
+                return
+
+        finished = time.perf_counter()
+        with self._lock:
+            stats = self._stats
+            stats['batches'] += 1
+            stats['units'] += len(batch)
+            stats['failed_units'] += sum(1 for ok, _ in outcomes if not ok)
+            stats['largest_batch'] = max(stats['largest_batch'], len(batch))
+            stats['lock_wait_ms'] += (locked - started) * 1000
+            stats['commit_ms'] += (finished - locked) * 1000
+        for unit, (ok, value) in zip(batch, outcomes):
+            if ok:
+                unit.future.set_result(value)
+            else:
+                unit.future.set_exception(value)
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot['queued'] = self._queue.qsize()
+        snapshot['average_batch'] = round(snapshot['units'] / max(1, snapshot['batches']), 2)
+        snapshot['database'] = self.pool.database
+        for key in ('queue_wait_ms', 'lock_wait_ms', 'commit_ms'):
+            snapshot[key] = round(snapshot[key], 2)
+        return snapshot
+
+
+def init_app(app):
+    app.config.setdefault('WRITE_BATCH_SIZE', 64)
+    app.config.setdefault('WRITE_QUEUE_SIZE', 1024)
+    app.config.setdefault('WRITE_TIMEOUT', 30.0)
+    app.extensions['writers'] = {}
+    app.extensions['writers_lock'] = threading.Lock()
+
+
+def get_writer(database=None):
+    """Writer for the given database file (defaults to current_database())"""
+    app = current_app
+    pool = get_pool(database)
+    with app.extensions['writers_lock']:
+        writer = app.extensions['writers'].get(pool.database)
+        if writer is None:
+            writer = app.extensions['writers'][pool.database] = Writer(
+                pool, max_batch=app.config['WRITE_BATCH_SIZE'], max_queue=app.config['WRITE_QUEUE_SIZE'],
+                timeout=app.config['WRITE_TIMEOUT'])
+    return writer
+
+
+def write(function):
+    """Run a write unit on the current app's database; see Writer.write"""
+    return get_writer().write(function)
+
+
+def writer_stats():
+    """Stats for every writer started by the current app"""
+    return [writer.stats() for writer in current_app.extensions['writers'].values()]
+